@@ -0,0 +1,151 @@
+"""
+Module MMD_Analysis
+
+Offline reanalysis of recorded runs, on all the cores of the workstation.
+Inputs: event files of the timestamped event mode (EVENTS_FILE of MMD_GUI, words of EVENT_DTYPE), and histograms
+saved by np.save (.npy, size_bins counters).
+The event files are split into shards of SHARD_EVENTS events. A ProcessPoolExecutor histograms each shard from a memory
+map of its file (only the file name and the offsets are pickled) into its own row of a shared memory block, then the rows
+are summed in shard order, so the results do not depend on the number of processes or on their timing.
+Each file and the total are then rebinned (group), the background subtracted (photons per bin per second, times the
+duration measured by the timestamps), and the micromotion modulation fitted (MMD_Histogram.fit_modulation).
+Where the timestamps of an event file restart from 0 (a resume or a reconnect, see XEM7305_MicroMotion_Detector.load_restarts()),
+a new shard starts, and the time between the two parts is not counted in the duration.
+
+Usage:
+    python MMD_Analysis.py run1.bin run2.bin --ttl 107 --group 2 --background 3.5 --jobs 8 --save total.npy
+    result = analyze(['run1.bin', 'run2.bin'], ttl_period=107)   # result['total']['fit']['modulation']
+Requirement: Python 3.8 or later (multiprocessing.shared_memory).
+"""
+
+import os
+import argparse
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import MMD_Histogram
+import XEM7305_MicroMotion_Detector
+
+SHARD_EVENTS = 1 << 22 # events per shard, 16 MB of an event file
+N_PERIOD = 5 # RF sine waves per RF trigger TTL
+TIMESTAMP_MASK = (1 << XEM7305_MicroMotion_Detector.TIMESTAMP_BITS) - 1
+
+def _histogram_events(path, start, count, ttl_period, shm_name, n_rows, row):
+    """ Worker: histogram count events of an event file from event start into a row of the shared block. Return (first, last, span) timestamps. """
+    events = np.memmap(path, dtype=XEM7305_MicroMotion_Detector.EVENT_DTYPE, mode='r',
+                       offset=start * XEM7305_MicroMotion_Detector.BYTES_PER_EVENT, shape=(count,))
+    index = MMD_Histogram.phase_bin_index(256, ttl_period) # the 8-bit time difference of an event
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        hists = np.ndarray((n_rows, ttl_period), dtype=np.int64, buffer=shm.buf)
+        hists[row] = np.bincount(index[events['diff']], minlength=ttl_period)
+        del hists
+    finally:
+        shm.close()
+    ticks = XEM7305_MicroMotion_Detector.unwrap_timestamps(events['word'] >> 8)
+    return int(ticks[0]) & TIMESTAMP_MASK, int(ticks[-1]) & TIMESTAMP_MASK, int(ticks[-1] - ticks[0])
+
+def _load_histogram(path, ttl_period, shm_name, n_rows, row):
+    """ Worker: copy a saved histogram into a row of the shared block. """
+    hist = np.load(path)
+    if (hist.size != ttl_period):
+        raise ValueError("%s has %d bins, not %d" % (path, hist.size, ttl_period))
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        hists = np.ndarray((n_rows, ttl_period), dtype=np.int64, buffer=shm.buf)
+        hists[row] = hist
+        del hists
+    finally:
+        shm.close()
+    return None
+
+def _shards(paths, shard_events):
+    """ (file number, path, first event, events) of every shard, in order. Histogram files are one shard each. No shard crosses a restart. """
+    shards = []
+    for k, path in enumerate(paths):
+        if (path.endswith('.npy')):
+            shards.append((k, path, 0, 0))
+            continue
+        n_events = os.path.getsize(path) // XEM7305_MicroMotion_Detector.BYTES_PER_EVENT
+        bounds = [0] + [n for n in XEM7305_MicroMotion_Detector.load_restarts(path) if 0 < n < n_events] + [n_events]
+        for begin, end in zip(bounds[:-1], bounds[1:]):
+            for start in range(begin, end, shard_events):
+                shards.append((k, path, start, min(shard_events, end - start)))
+    return shards
+
+def _summary(path, hist, duration, group, background_rate, n_period):
+    """ Rebin, subtract the background and fit the modulation of one histogram. duration: unit: s, None if unknown. """
+    background = background_rate * duration if (duration is not None) else 0.
+    return {'path': path, 'hist': hist, 'events': int(hist.sum()), 'duration': duration, 'background': background,
+            'grouped': MMD_Histogram.rebin(hist - background, group), 'fit': MMD_Histogram.fit_modulation(hist, n_period, background)}
+
+def analyze(paths, ttl_period, group=1, background_rate=0., n_period=N_PERIOD, jobs=None, shard_events=SHARD_EVENTS):
+    """
+    Histogram the recorded runs with jobs processes (all the cores if None). ttl_period: RF trigger TTL period, the bins.
+    background_rate: unit: photons per bin per second, subtracted where the duration is known (event files).
+    Return a dict: 'files', a summary per path, and 'total'. A summary: hist, events, duration (s), background (per bin),
+    grouped (rebinned by group, background subtracted), fit (MMD_Histogram.fit_modulation).
+    """
+    shards = _shards(paths, shard_events)
+    shm = shared_memory.SharedMemory(create=True, size=max(8 * len(shards) * ttl_period, 1))
+    try:
+        hists = np.ndarray((len(shards), ttl_period), dtype=np.int64, buffer=shm.buf)
+        hists[:] = 0
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = []
+            for row, (k, path, start, count) in enumerate(shards):
+                if (path.endswith('.npy')):
+                    futures.append(pool.submit(_load_histogram, path, ttl_period, shm.name, len(shards), row))
+                elif (count > 0):
+                    futures.append(pool.submit(_histogram_events, path, start, count, ttl_period, shm.name, len(shards), row))
+                else:
+                    futures.append(None)
+            spans = [f.result() if f is not None else None for f in futures] # in shard order, raise the error of a worker
+        # reduce, in shard order
+        files = []
+        for k, path in enumerate(paths):
+            rows = [row for row, shard in enumerate(shards) if shard[0] == k]
+            hist = hists[rows].sum(axis=0) if rows else np.zeros(ttl_period, dtype=np.int64)
+            duration = None
+            if (not path.endswith('.npy')):
+                restarts = set(XEM7305_MicroMotion_Detector.load_restarts(path))
+                ticks, last = 0, None
+                for row in rows:
+                    if (spans[row] is None):
+                        continue
+                    first, end, span = spans[row]
+                    if (last is not None and shards[row][2] not in restarts):
+                        ticks = ticks + ((first - last) & TIMESTAMP_MASK) # between two shards
+                    ticks, last = ticks + span, end
+                duration = ticks * XEM7305_MicroMotion_Detector.TIMESTAMP_TICK * 1e-9
+            files.append(_summary(path, hist, duration, group, background_rate, n_period))
+        del hists
+    finally:
+        shm.close()
+        shm.unlink()
+    total = np.sum([f['hist'] for f in files], axis=0) if files else np.zeros(ttl_period, dtype=np.int64)
+    durations = [f['duration'] for f in files]
+    duration = sum(durations) if (files and None not in durations) else None
+    return {'files': files, 'total': _summary('total', total, duration, group, background_rate, n_period)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Reanalyze recorded runs of the Micro-Motion Detector on all the cores.")
+    parser.add_argument('paths', nargs='+', help="event files (timestamped event mode) or histograms (.npy)")
+    parser.add_argument('--ttl', type=int, required=True, help="RF trigger TTL period in sampling clocks, the number of bins")
+    parser.add_argument('--group', type=int, default=1, help="bins summed together")
+    parser.add_argument('--background', type=float, default=0., help="photons per bin per second, subtracted")
+    parser.add_argument('--n-period', type=int, default=N_PERIOD, help="RF sine waves per RF trigger TTL")
+    parser.add_argument('--jobs', type=int, default=None, help="processes, all the cores by default")
+    parser.add_argument('--save', default=None, help="save the grouped total histogram (.npy)")
+    args = parser.parse_args()
+    t0 = time.perf_counter()
+    result = analyze(args.paths, args.ttl, args.group, args.background, args.n_period, args.jobs)
+    for summary in result['files'] + [result['total']]:
+        fit = summary['fit']
+        duration = "%.1f s" % summary['duration'] if summary['duration'] is not None else "unknown duration"
+        print("%s: %d events, %s, modulation %.4f, phase %.3f rad" % (summary['path'], summary['events'], duration, fit['modulation'], fit['phase']))
+    print("%d files in %.2f s" % (len(args.paths), time.perf_counter() - t0))
+    if (args.save is not None):
+        np.save(args.save, result['total']['grouped'])
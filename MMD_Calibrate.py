@@ -0,0 +1,159 @@
+"""
+Module MMD_Calibrate
+
+Calibration of the readout of the FIFO modes against the connected (or emulated) device, instead of trying update
+intervals by hand. Every combination of the update intervals, the smallest readout lengths (driver.reader_min_words)
+and the look-aheads of the reader (bytes read ahead of the update ticks) is run for a trial time (MIN_TICKS update
+intervals at least) with the photons of the experiment (or of the emulator): a PipeReader reads the FIFO in its thread,
+and the update ticks take and histogram its buffers at the update interval, as MMD does.
+Each trial measures the USB throughput, the transfers per second, the latency of a transfer (mean and longest),
+the highest FIFO occupancy, and the time differences lost (counted by the FPGA, but neither read out nor in the FIFO).
+The FIFO is probed once more after the reader is stopped, so a reader which stopped reading is seen, and the buffers
+it read after the last tick are counted.
+A setting is safe if nothing is lost, the FIFO stays below OCCUPANCY_LIMIT (the rest is the headroom for bursts),
+and the look-ahead of the reader is never full.
+The best safe setting reads the most (within THROUGHPUT_TOLERANCE), with the fewest transfers, at the shortest
+update interval. It is written into the configuration profile (MMD_Config): gui.update_interval,
+driver.reader_min_words and driver.reader_max_bytes, the other settings are kept (the comments of a TOML profile are not).
+
+Usage:
+    python MMD_Calibrate.py --profile mmd_config.toml                     # the board, with the PMT and RF trigger signals on
+    python MMD_Calibrate.py --emulate --photon-rate 2e6 --latency 0.0005 --bandwidth 2e8 --profile lab1.toml
+    results = calibrate(dev, intervals=(100, 200), min_words=(4, 1024), max_bytes=(1 << 24,), trial=1.)
+    best = choose(results)
+"""
+
+import argparse
+import os
+import time
+import numpy as np
+import MMD_Config
+import XEM7305_MicroMotion_Detector
+import XEM7305_Emulator
+
+INTERVALS = (100, 200, 500, 1000) # unit: ms. The update intervals tried.
+MIN_WORDS = (4, 256, 4096) # unit: FIFO words. The smallest readouts tried.
+MAX_BYTES = (1 << 20, 1 << 24) # unit: bytes. The look-aheads of the reader thread tried.
+TRIAL_TIME = 2. # unit: s. Per setting.
+MIN_TICKS = 5 # update ticks of a trial at least, a longer update interval gets a longer trial
+FIFO_WORDS = 32768 # the FIFO holds 131072 bytes
+OCCUPANCY_LIMIT = 0.5 # of the FIFO, the highest occupancy of a safe setting
+LOST_TOLERANCE = 16 # time differences. The FIFO word count does not see the bytes of a word being written.
+THROUGHPUT_TOLERANCE = 0.02 # settings reading this close to the most are as good
+
+def run_trial(dev, update_interval, min_words, max_bytes, trial=TRIAL_TIME, timestamp=False, wide=False,
+              poll=XEM7305_MicroMotion_Detector.READER_POLL):
+    """ Read the FIFO for trial seconds with a setting. Return a dict of the setting and its measurements. """
+    if (timestamp):
+        bytes_per_event = XEM7305_MicroMotion_Detector.BYTES_PER_EVENT
+    elif (wide):
+        bytes_per_event = XEM7305_MicroMotion_Detector.BYTES_PER_WIDE_DIFF
+    else:
+        bytes_per_event = 1
+    trial = max(trial, MIN_TICKS * update_interval / 1000.)
+    dev.set_modes(timestamp=timestamp, wide=wide)
+    dev.reset_dev()
+    reader = XEM7305_MicroMotion_Detector.PipeReader(dev, max_bytes=max_bytes, poll=poll, min_words=min_words)
+    reader.start()
+    events, lost, tick_time = 0, 0, 0.
+    t0 = time.perf_counter()
+    t_tick = t0
+    while (t_tick - t0 < trial):
+        t_tick = t_tick + update_interval / 1000.
+        time.sleep(max(0., t_tick - time.perf_counter()))
+        t = time.perf_counter()
+        for buff, status in reader.get_all():
+            # counted by the FPGA before this transfer, but neither read before it nor in the FIFO
+            lost = max(lost, status[1] - events - status[3] * 4 // bytes_per_event)
+            events = events + len(buff) // bytes_per_event
+            np.bincount(np.frombuffer(buff, dtype=np.uint8), minlength=256) # the work of an update tick
+        tick_time = max(tick_time, time.perf_counter() - t)
+    left = reader.stop() # read after the last tick, counted as read
+    elapsed = time.perf_counter() - t0
+    for buff, status in left:
+        lost = max(lost, status[1] - events - status[3] * 4 // bytes_per_event)
+        events = events + len(buff) // bytes_per_event
+    # the FIFO after the last transfer: a reader which stopped reading (look-ahead full, or too slow) left its data there
+    status = dev.probe_dev()
+    lost = max(lost, status[1] - events - status[3] * 4 // bytes_per_event)
+    fifo_max = max(reader.fifo_max, status[3])
+    n = max(reader.n_transfers, 1)
+    return {'update_interval': update_interval, 'min_words': min_words, 'max_bytes': max_bytes,
+            'throughput': reader.bytes_read / elapsed, 'transfers_per_second': reader.n_transfers / elapsed,
+            'latency_mean': reader.transfer_time / n, 'latency_max': reader.transfer_time_max,
+            'occupancy': fifo_max / FIFO_WORDS, 'lost': lost, 'errors': reader.n_errors, 'events': events, 'tick_time': tick_time,
+            'queued_max': reader.queued_max, 'left': len(left)}
+
+def calibrate(dev, intervals=INTERVALS, min_words=MIN_WORDS, max_bytes=MAX_BYTES, trial=TRIAL_TIME, timestamp=False, wide=False, report=None):
+    """ Run a trial of every setting. report(result) is called after each one. Return the list of results. """
+    results = []
+    for update_interval in intervals:
+        for words in min_words:
+            for look_ahead in max_bytes:
+                result = run_trial(dev, update_interval, words, look_ahead, trial, timestamp, wide)
+                results.append(result)
+                if (report is not None):
+                    report(result)
+    return results
+
+def is_safe(result):
+    """ Nothing lost, the FIFO below OCCUPANCY_LIMIT, and the look-ahead never full (the update ticks kept up). """
+    return (result['lost'] <= LOST_TOLERANCE and result['occupancy'] <= OCCUPANCY_LIMIT and result['errors'] == 0
+            and result['queued_max'] < result['max_bytes'])
+
+def choose(results):
+    """ The best safe result, or None if no setting is safe (too many photons for the FIFO modes: try the histogram mode). """
+    safe = [r for r in results if is_safe(r)]
+    if (not safe):
+        return None
+    most = max(r['throughput'] for r in safe)
+    good = [r for r in safe if r['throughput'] >= (1. - THROUGHPUT_TOLERANCE) * most]
+    return min(good, key=lambda r: (r['transfers_per_second'], r['update_interval']))
+
+def format_result(r):
+    return ("%5d ms %6d words %5d kB ahead: %8.3f MB/s, %7.1f transfers/s, latency %6.2f ms (max %6.2f), FIFO %5.1f %%, lost %d%s"
+            % (r['update_interval'], r['min_words'], r['max_bytes'] >> 10, r['throughput'] * 1e-6, r['transfers_per_second'],
+               r['latency_mean'] * 1e3, r['latency_max'] * 1e3, r['occupancy'] * 100, r['lost'], "" if is_safe(r) else "  (not safe)"))
+
+def write_profile(path, best):
+    """ Write the best setting into the profile path, keeping its other settings. Return the validated configuration. """
+    overrides = ['gui.update_interval=%d' % best['update_interval'], 'driver.reader_min_words=%d' % best['min_words'],
+                 'driver.reader_max_bytes=%d' % best['max_bytes']]
+    cfg = MMD_Config.load(path if os.path.exists(path) else None, overrides)
+    MMD_Config.save(cfg, path)
+    return cfg
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Calibrate the FIFO readout of the Micro-Motion Detector, and write the best setting into a profile.")
+    parser.add_argument('--profile', default=MMD_Config.CONFIG_FILE, help="configuration profile to update (TOML or JSON)")
+    parser.add_argument('--intervals', type=int, nargs='+', default=INTERVALS, help="update intervals, unit: ms")
+    parser.add_argument('--min-words', type=int, nargs='+', default=MIN_WORDS, help="smallest readouts, unit: FIFO words")
+    parser.add_argument('--max-bytes', type=int, nargs='+', default=MAX_BYTES, help="look-aheads of the reader thread, unit: bytes")
+    parser.add_argument('--trial', type=float, default=TRIAL_TIME, help="seconds per setting")
+    parser.add_argument('--timestamp', action='store_true', help="the timestamped event mode")
+    parser.add_argument('--wide', action='store_true', help="the 16-bit mode")
+    parser.add_argument('--dry-run', action='store_true', help="do not write the profile")
+    parser.add_argument('--emulate', action='store_true', help="an emulated board (XEM7305_Emulator) instead of the board")
+    parser.add_argument('--photon-rate', type=float, default=1e6, help="emulated photons per second")
+    parser.add_argument('--latency', type=float, default=0., help="emulated latency of a USB transaction, unit: s")
+    parser.add_argument('--bandwidth', type=float, default=None, help="emulated pipe bandwidth, unit: bytes/s")
+    args = parser.parse_args()
+    cfg = MMD_Config.load(args.profile if os.path.exists(args.profile) else None)
+    options = {'clock_period': cfg.driver.clock_period, 'endpoints': vars(cfg.endpoints)}
+    if (args.emulate):
+        emu = XEM7305_Emulator.FrontPanelEmulator(photon_rate=args.photon_rate, latency=args.latency, bandwidth=args.bandwidth)
+        dev = XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=emu, **options)
+    else:
+        dev = XEM7305_MicroMotion_Detector.get_detector(**options)
+    results = calibrate(dev, args.intervals, args.min_words, args.max_bytes, args.trial, args.timestamp, args.wide,
+                        report=lambda r: print(format_result(r)))
+    best = choose(results)
+    if (best is None):
+        print("No safe setting: too many photons for the FIFO modes, use the histogram mode.")
+    else:
+        print("Best: " + format_result(best))
+        if (not args.dry_run):
+            write_profile(args.profile, best)
+            print("Written to %s" % args.profile)
+    dev.close()
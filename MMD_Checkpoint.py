@@ -0,0 +1,134 @@
+"""
+Module MMD_Checkpoint
+
+Checkpoints of a detecting session, so that a long integration survives closing the GUI or a crash.
+A snapshot is a dict of numbers, strings and numpy arrays: the histogram, the counters of the stop conditions
+(time_detected, cnt_detected), and what the histogram depends on (TTL period, fine bits, modes, channels, background).
+It is written with np.savez (a small binary file, a few kB for a 107-bin histogram) into a temporary file
+next to the checkpoint, flushed to the disk, then renamed over the checkpoint (os.replace), so that the file is always
+the previous or the new snapshot, never half written.
+A Checkpointer writes in its own thread: save() only copies the arrays and hands them over, the update tick does not
+wait for the disk. A snapshot not yet written is replaced by a newer one.
+The first snapshot of a new session (not resumed) is saved with rotate=True: the checkpoint of the previous session is
+kept as previous_path() (mmd_checkpoint.prev.npz), so a Start by mistake does not overwrite a long run.
+
+Usage:
+    cp = Checkpointer('mmd_checkpoint.npz')
+    cp.save({'hist': hist, 'time_detected': 1200, ...}, rotate=True)   # the first one of a new session
+    cp.save({'hist': hist, 'time_detected': 3400, ...})   # at most every CHECKPOINT_INTERVAL, and when stopped
+    cp.flush()                                             # wait until written
+    snapshot = load('mmd_checkpoint.npz')                  # None if there is no checkpoint
+"""
+
+import os
+import threading
+import logging
+import numpy as np
+import MMD_Logging
+
+VERSION = 1 # of the snapshot format
+CHECKPOINT_INTERVAL = 10. # unit: s. Minimum time between the checkpoints of a session.
+
+logger = logging.getLogger(MMD_Logging.LOGGER_NAME + '.Checkpoint')
+
+def previous_path(path):
+    """ Where rotate() keeps the checkpoint of the previous session: mmd_checkpoint.npz -> mmd_checkpoint.prev.npz. """
+    root, ext = os.path.splitext(path)
+    return root + '.prev' + ext
+
+def rotate(path):
+    """ Keep the checkpoint of path as previous_path(path), replacing the one kept before. Return True if there was one. """
+    if (not os.path.exists(path)):
+        return False
+    os.replace(path, previous_path(path))
+    return True
+
+def write(path, snapshot):
+    """ Write a snapshot atomically. """
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, version=VERSION, **snapshot)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def load(path):
+    """ Read a snapshot, a dict of numpy arrays (0-d for the scalars). None if there is no checkpoint, or it is unreadable. """
+    if (not os.path.exists(path)):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            snapshot = {name: data[name] for name in data.files}
+    except (OSError, ValueError) as e:
+        logger.warning("Checkpoint %s unreadable: %s", path, e)
+        return None
+    if (int(snapshot.get('version', 0)) != VERSION):
+        logger.warning("Checkpoint %s has another format version", path)
+        return None
+    return snapshot
+
+class Checkpointer:
+    """ Write snapshots to path in a thread, the latest one first. """
+    def __init__(self, path):
+        self.path = path
+        self.n_written = 0
+        self._pending = None
+        self._rotate = False # before writing the pending snapshot
+        self._cond = threading.Condition()
+        self._busy = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def save(self, snapshot, rotate=False):
+        """ 
+        Queue a snapshot. Its arrays are copied, the caller may go on modifying them.
+        rotate: the first snapshot of a new session, the checkpoint on the disk is kept (see rotate()) before it is written.
+        """
+        snapshot = {name: np.array(value) for name, value in snapshot.items()}
+        with self._cond:
+            self._pending = snapshot
+            self._rotate = self._rotate or rotate # also if a newer snapshot replaces it before it is written
+            self._cond.notify_all()
+
+    def flush(self, timeout=10.):
+        """ Wait until the queued snapshot is written. """
+        with self._cond:
+            self._cond.wait_for(lambda: self._pending is None and not self._busy, timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending is not None)
+                snapshot, self._pending = self._pending, None
+                rotating, self._rotate = self._rotate, False
+                self._busy = True
+            try:
+                if (rotating and rotate(self.path)):
+                    logger.info("Checkpoint of the previous session kept as %s", previous_path(self.path))
+                write(self.path, snapshot)
+                self.n_written = self.n_written + 1
+            except OSError as e:
+                logger.warning("Checkpoint not written to %s: %s", self.path, e)
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+
+# here is a demo of this module: snapshots written while the histogram grows, and the last one read back.
+if __name__ == '__main__':
+    import tempfile
+    import time
+    path = os.path.join(tempfile.gettempdir(), 'mmd_checkpoint_demo.npz')
+    cp = Checkpointer(path)
+    hist = np.zeros(107, dtype=np.int64)
+    t0 = time.perf_counter()
+    for k in range(100):
+        hist[np.random.randint(0, 107, 1000)] += 1
+        cp.save({'hist': hist, 'time_detected': 200 * (k + 1), 'cnt_detected': int(hist.sum())})
+    t_save = (time.perf_counter() - t0) / 100
+    cp.flush()
+    snapshot = load(path)
+    assert np.array_equal(snapshot['hist'], hist)
+    print("save() %.1f us per tick, %d of 100 snapshots written (the others replaced by newer ones), %d bytes, time_detected %d"
+          % (t_save * 1e6, cp.n_written, os.path.getsize(path), snapshot['time_detected']))
+    os.remove(path)
@@ -0,0 +1,226 @@
+"""
+Module MMD_Compensation
+
+Closed-loop micromotion compensation, instead of a person watching the histogram while turning a voltage.
+A CompensationController sets the compensation voltage of an electrode through a VoltageOutput, and measures the
+micromotion at that voltage with the incremental estimate of the accumulating histogram (MMD_Histogram.ModulationEstimator).
+The micromotion is a vector, the complex amplitude z (modulation and RF phase), linear in the voltage: z = a + b V.
+The controller fits a and b (weighted least squares of all its measurements) and goes to the voltage of the smallest
+|z|, -Re(a conj(b)) / |b|^2, which needs no guess of the phase, and is not biased by the noise of the magnitude
+(the modulation of an ion without micromotion is not 0 + noise, but |noise|).
+A measurement stops as soon as its estimate is precise enough to decide the next step (a sequential stop), not at a
+fixed count of photons (condCnt of the GUI): far from the optimum a large modulation is known well enough with
+REL_PRECISION from a few photons, only near the optimum is the error brought down to target / Z_CONFIDENCE.
+It is done when the last measurement is at the fitted optimum, within its uncertainty, or below the target.
+Updates come from a source: SimulatedIon, a local model of the ion (photons of a modulation linear in the voltage,
+a floor of micromotion this electrode can't compensate, background), or SharedHistogramSource, the live histogram of
+the GUI (python MMD_GUI.py SHARE) through MMD_SharedMemory.
+
+Usage:
+    ion = SimulatedIon(optimum=0.37, slope=0.5)
+    result = CompensationController(ion, ion, size_bins=107).run(v_start=0.)     # result['voltage'], result['seconds']
+    source = SharedHistogramSource(MMD_SharedMemory.SharedHistogramReader())       # the GUI detecting, with SHARE
+    controller = CompensationController(CallbackOutput(dac.set_ex), source, size_bins=source.size_bins)
+    python MMD_Compensation.py            # demo: the sequential stop against fixed counts, on the simulated ion
+"""
+
+import numpy as np
+import MMD_Histogram
+
+N_PERIOD = 5 # RF sine waves per RF trigger TTL
+TARGET_MODULATION = 0.02 # compensated: the modulation is below this
+Z_CONFIDENCE = 2. # standard errors of a measurement near the optimum, within the target
+REL_PRECISION = 0.2 # relative standard error of a large modulation, enough to step towards the optimum
+MIN_PHOTONS = 2000 # of a measurement, before its error is trusted
+MAX_PHOTONS = 2000000 # of a measurement, whatever its error
+SETTLE_UPDATES = 1 # updates dropped after a voltage change (the update under way had the previous voltage)
+V_STEP = 0.5 # unit: V. The second measurement, from the start voltage.
+MAX_STEP = 2. # unit: V. The largest step of the controller.
+V_LIMITS = (-10., 10.) # unit: V. The output range.
+MAX_MEASUREMENTS = 20
+
+class VoltageOutput:
+    """ The compensation voltage of an electrode. A subclass drives a DAC: set_voltage() returns once the output is set. """
+    def set_voltage(self, volts):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class CallbackOutput(VoltageOutput):
+    """ A VoltageOutput calling a function, e.g. a method of a DAC driver. """
+    def __init__(self, set_voltage):
+        self._set_voltage = set_voltage
+
+    def set_voltage(self, volts):
+        self._set_voltage(volts)
+
+class SimulatedIon(VoltageOutput):
+    """
+    A local model of the ion: its micromotion amplitude z = slope (V - optimum) e^(i phase) + floor e^(i (phase + pi/2))
+    (the floor: micromotion along another axis, not compensated by this electrode), |z| at most 1.
+    next_update() returns the histogram of an update of update_seconds, Poisson counts of photon_rate (1 + Re(z e^(-i w))),
+    plus background_rate photons per bin per second. The time is simulated, not waited.
+    """
+    def __init__(self, optimum=0.37, slope=0.5, floor=0.005, phase=1.2, photon_rate=2e4, background_rate=0.,
+                 size_bins=107, n_period=N_PERIOD, update_seconds=0.2, seed=None):
+        self.optimum = optimum # unit: V
+        self.slope = slope # unit: 1/V
+        self.floor = floor
+        self.phase = phase # unit: rad
+        self.photon_rate = photon_rate # unit: photons/s
+        self.background_rate = background_rate # unit: photons per bin per second
+        self.update_seconds = update_seconds
+        self._w = 2 * np.pi * n_period * np.arange(size_bins) / size_bins
+        self._rng = np.random.default_rng(seed)
+        self.volts = 0.
+
+    def set_voltage(self, volts):
+        self.volts = volts
+
+    def amplitude(self, volts=None):
+        volts = self.volts if volts is None else volts
+        z = (self.slope * (volts - self.optimum) + 1j * self.floor) * np.exp(1j * self.phase)
+        return z / max(abs(z), 1.)
+
+    def next_update(self):
+        density = 1. + np.real(self.amplitude() * np.exp(-1j * self._w))
+        mean = self.photon_rate * self.update_seconds * density / density.sum() + self.background_rate * self.update_seconds
+        return self._rng.poisson(mean), self.update_seconds
+
+class SharedHistogramSource:
+    """ The updates of the histogram of the GUI (python MMD_GUI.py SHARE), from a MMD_SharedMemory.SharedHistogramReader. """
+    def __init__(self, reader, timeout=5.):
+        self._reader = reader
+        self._timeout = timeout # unit: s, for an update
+        self._last = None
+        self.size_bins = reader.size_bins
+
+    def next_update(self):
+        """ The histogram of the next update(s) and their detecting time (unit: s). RuntimeError if the GUI is not detecting. """
+        while (True):
+            snapshot = self._reader.wait(self._last['seq'] if self._last is not None else 0, self._timeout)
+            if (snapshot is None):
+                raise RuntimeError("no update of the histogram in %g s" % self._timeout)
+            if (not snapshot['detecting']):
+                raise RuntimeError("the detector is stopped")
+            last, self._last = self._last, snapshot
+            if (last is not None and snapshot['n_update'] > last['n_update']): # else the first one, or a new start
+                return snapshot['hist'] - last['hist'], (snapshot['time_detected'] - last['time_detected']) * 1e-3
+
+class CompensationController:
+    """
+    Minimize the micromotion with the voltage of an output, measured from the updates of a source (next_update()).
+    fixed_photons: stop every measurement at this count instead (as condCnt of the GUI), to compare.
+    """
+    def __init__(self, output, source, size_bins, n_period=N_PERIOD, background_rate=0., target=TARGET_MODULATION,
+                 v_step=V_STEP, max_step=MAX_STEP, limits=V_LIMITS, fixed_photons=None):
+        self.output = output
+        self.source = source
+        self.estimator = MMD_Histogram.ModulationEstimator(size_bins, n_period, background_rate)
+        self.target = target
+        self.v_step = v_step
+        self.max_step = max_step
+        self.limits = limits
+        self.fixed_photons = fixed_photons
+        self.measurements = [] # dicts: volts, amplitude (complex), modulation, error, photons, seconds
+        self.seconds = 0. # unit: s. Detecting time of all the updates, the settling ones included.
+
+    def _enough(self, estimate):
+        """ The sequential stop of a measurement. """
+        if (self.fixed_photons is not None):
+            return estimate['photons'] >= self.fixed_photons
+        if (estimate['photons'] >= MAX_PHOTONS):
+            return True
+        return estimate['photons'] >= MIN_PHOTONS and (estimate['error'] <= self.target / Z_CONFIDENCE
+                                                        or estimate['error'] <= REL_PRECISION * estimate['modulation'])
+
+    def measure(self, volts):
+        """ Set the voltage and measure the micromotion until the estimate is precise enough. Return the measurement. """
+        self.output.set_voltage(volts)
+        for k in range(SETTLE_UPDATES):
+            self.seconds = self.seconds + self.source.next_update()[1]
+        self.estimator.clear()
+        while (True):
+            hist_tmp, seconds = self.source.next_update()
+            self.estimator.add(hist_tmp, seconds)
+            self.seconds = self.seconds + seconds
+            estimate = self.estimator.estimate()
+            if (self._enough(estimate)):
+                break
+        measurement = {'volts': volts, 'amplitude': estimate['amplitude'], 'modulation': estimate['modulation'],
+                       'error': estimate['error'], 'photons': estimate['photons'], 'seconds': self.estimator.seconds}
+        self.measurements.append(measurement)
+        return measurement
+
+    def fit(self):
+        """
+        The weighted least squares line z = a + b V of the measurements: return (volts of the smallest |z|, its standard
+        error, the smallest |z|), or None if the slope is not known (fewer than 2 voltages, or b within its noise).
+        """
+        v = np.array([m['volts'] for m in self.measurements])
+        z = np.array([m['amplitude'] for m in self.measurements])
+        w = 1. / np.array([m['error'] for m in self.measurements]) ** 2
+        normal = np.array([[w.sum(), (w * v).sum()], [(w * v).sum(), (w * v * v).sum()]])
+        if (np.unique(v).size < 2 or np.linalg.det(normal) <= 0):
+            return None
+        cov = np.linalg.inv(normal) # of a and b, for the real and the imaginary parts alike
+        a, b = cov @ np.array([(w * z).sum(), (w * v * z).sum()])
+        if (abs(b) < Z_CONFIDENCE * np.sqrt(cov[1, 1])):
+            return None
+        volts = -np.real(a * np.conj(b)) / abs(b) ** 2
+        error = np.sqrt(max(np.array([1., volts]) @ cov @ np.array([1., volts]), 0.)) / abs(b)
+        return volts, error, abs(np.imag(a * np.conj(b))) / abs(b)
+
+    def _clip(self, volts, last):
+        volts = min(max(volts, last - self.max_step), last + self.max_step)
+        return min(max(volts, self.limits[0]), self.limits[1])
+
+    def run(self, v_start=0., max_measurements=MAX_MEASUREMENTS):
+        """
+        Compensate from v_start. Leave the output at the best voltage. Return a dict: voltage, its error (None without a fit),
+        modulation (measured at the last voltage), converged, seconds (detecting time), photons, measurements.
+        """
+        volts, error, converged = v_start, None, False
+        direction = 1.
+        while (len(self.measurements) < max_measurements):
+            m = self.measure(volts)
+            if (m['modulation'] <= self.target and m['error'] <= self.target / Z_CONFIDENCE):
+                converged = True
+                break
+            fit = self.fit()
+            if (fit is None): # no slope yet: step on, away from a larger modulation
+                if (len(self.measurements) > 1 and m['modulation'] > self.measurements[-2]['modulation']):
+                    direction = -direction
+                volts = self._clip(volts + direction * self.v_step, volts)
+                continue
+            best, error, floor = fit
+            if (abs(best - volts) <= max(error, 1e-6) and m['error'] <= self.target / Z_CONFIDENCE): # at the optimum, as precisely as needed
+                converged = True
+                break
+            volts = self._clip(best, volts)
+        fit = self.fit()
+        if (fit is not None and not converged): # the best estimate so far
+            volts, error = self._clip(fit[0], volts), fit[1]
+        self.output.set_voltage(volts)
+        return {'voltage': volts, 'error': error, 'modulation': self.measurements[-1]['modulation'], 'converged': converged,
+                'seconds': self.seconds, 'photons': sum(m['photons'] for m in self.measurements), 'measurements': list(self.measurements)}
+
+
+# here is a demo of this module: compensation of simulated ions, with the sequential stop and with fixed counts per measurement.
+if __name__ == '__main__':
+    rng = np.random.default_rng(1)
+    for name, fixed in (("sequential stop", None), ("fixed 20000 photons", 20000)):
+        seconds, errors, counts, n_converged = [], [], [], 0
+        for k in range(20):
+            slope = rng.uniform(0.2, 1.)
+            ion = SimulatedIon(optimum=rng.uniform(-0.8, 0.8) / slope, slope=slope, phase=rng.uniform(-np.pi, np.pi), # modulation < 0.8 at 0 V
+                               background_rate=1., seed=k)
+            controller = CompensationController(ion, ion, size_bins=107, background_rate=1., fixed_photons=fixed)
+            result = controller.run(v_start=0.)
+            seconds.append(result['seconds'])
+            errors.append(abs(result['voltage'] - ion.optimum) * ion.slope) # the modulation left, unit: modulation
+            counts.append(len(result['measurements']))
+            n_converged = n_converged + result['converged']
+        print("%-20s: %5.1f s of detecting per ion (max %5.1f), %4.1f measurements, modulation left %.4f (max %.4f), %d of 20 converged"
+              % (name, np.mean(seconds), np.max(seconds), np.mean(counts), np.mean(errors), np.max(errors), n_converged))
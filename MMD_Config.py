@@ -0,0 +1,203 @@
+"""
+Module MMD_Config
+
+Configuration profiles of the Micro-Motion Detector: the performance settings of a setup (readout sizes, update
+intervals, buffer pools, clock period and endpoint addresses) in a file, instead of constants edited in the source.
+A profile is a TOML file (Python 3.11, or the tomli package) or a JSON file, with the sections of SCHEMA.
+Missing settings keep their defaults, unknown ones are errors (a misspelled name is not silently ignored).
+Settings on the command line override the profile: section.name=value, e.g. gui.redraw_time=30 endpoints.fifo_pipe=0xA1.
+Everything is checked once, by load(), and all the problems are reported together by a ConfigError.
+
+    [gui]
+    redraw_time = 20
+    update_interval = 200
+    [driver]
+    clock_period = 2.173913
+    reader_max_bytes = 0x2000000
+    [endpoints]
+    fifo_pipe = 0xA0      # TOML integers may be hexadecimal
+
+Usage:
+    cfg = load('lab1.toml', overrides=['gui.redraw_time=30'])
+    cfg.gui.redraw_time, cfg.driver.clock_period, cfg.endpoints.fifo_pipe
+    save(cfg, 'lab1.toml')     # e.g. after a calibration
+"""
+
+import json
+import os
+import types
+try:
+    import tomllib # Python 3.11
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+CONFIG_FILE = "mmd_config.toml" # loaded at startup if it exists, CONFIG=<path> for another profile
+
+# section: {name: (type, default, minimum, maximum, description)}
+SCHEMA = {
+    'gui': {
+        'redraw_time': (int, 20, 0, 1000, "ms. Pipe out I/O and plot time per update, taken off the update interval"),
+        'update_interval': (int, 200, 100, 1000, "ms. The histogram update interval at startup"),
+        'n_period': (int, 5, 1, 1000, "RF drive sine waves per RF trigger TTL"),
+        'n_max_probe': (int, 20, 1, 1000, "probes of the RF trigger TTL and PMT pulses before detecting"),
+        'size_bins_default': (int, 107, 1, 1 << 16, "histogram bins of the simulation"),
+        'pipeout_length_default': (int, 1024, 4, 1 << 15, "FIFO words per pipe out of the simulation, a multiple of 4"),
+        'reconnect_interval': (int, 1000, 100, 60000, "ms. Between the attempts to open a disconnected device"),
+        'checkpoint_interval': (float, 10., 0.1, 86400., "s. Between the checkpoints of a detecting session"),
+    },
+    'driver': {
+        'clock_period': (float, 2.173913, 0.1, 100., "ns. The sampling clock c_clk"),
+        'reader_max_bytes': (int, 1 << 24, 1 << 17, 1 << 30, "bytes read ahead of the updates by the FIFO reader thread, at least one FIFO"),
+        'reader_poll': (float, 0.005, 0.0001, 1., "s. The reader thread waits this long when the FIFO is almost empty"),
+        'reader_min_words': (int, 4, 4, 32768, "FIFO words of the smallest transfer of the reader thread, a multiple of 4"),
+    },
+    'endpoints': {
+        'reset': (int, 0x00, 0x00, 0x1F, "wireIn: bit0 reset, bit1 reset_fifo"),
+        'modes': (int, 0x01, 0x00, 0x1F, "wireIn: bit0 histogram mode, bit1 timestamp mode, bit2 16-bit mode"),
+        'trigger': (int, 0x40, 0x40, 0x5F, "triggerIn: bit0 histogram swap, bit1 self-timed reset"),
+        'photon_count': (int, 0x20, 0x20, 0x3F, "wireOut"),
+        'tdiff_count': (int, 0x21, 0x20, 0x3F, "wireOut"),
+        'ttl_period': (int, 0x22, 0x20, 0x3F, "wireOut"),
+        'fifo_count': (int, 0x23, 0x20, 0x3F, "wireOut"),
+        'build': (int, 0x24, 0x20, 0x3F, "wireOut"),
+        'fifo_pipe': (int, 0xA0, 0xA0, 0xBF, "pipeOut"),
+        'histogram_pipe': (int, 0xA1, 0xA0, 0xBF, "pipeOut"),
+    },
+}
+
+class ConfigError(ValueError):
+    """ A profile or an override which is not valid. The message lists all the problems. """
+
+class Config:
+    """ Validated settings, by section: cfg.gui.redraw_time. """
+    def __init__(self, values):
+        self._values = values
+        for section, settings in values.items():
+            setattr(self, section, types.SimpleNamespace(**settings))
+
+    def as_dict(self):
+        return {section: dict(settings) for section, settings in self._values.items()}
+
+def defaults():
+    return Config({section: {name: spec[1] for name, spec in fields.items()} for section, fields in SCHEMA.items()})
+
+def read(path):
+    """ The sections of a TOML or JSON profile, not validated. """
+    if (path.endswith('.json')):
+        with open(path) as f:
+            return json.load(f)
+    if (tomllib is None):
+        raise ConfigError("%s: TOML profiles need Python 3.11 or the tomli package, use a .json profile" % path)
+    with open(path, 'rb') as f:
+        return tomllib.load(f)
+
+def _convert(kind, value):
+    """ A setting of the profile or the command line (str) as kind. bool is not an int here. """
+    if (isinstance(value, str)):
+        return int(value, 0) if kind is int else kind(value)
+    if (isinstance(value, bool) or not isinstance(value, (int, float)) or (kind is int and not isinstance(value, int))):
+        raise ValueError("not a %s" % kind.__name__)
+    return kind(value)
+
+def load(path=None, overrides=()):
+    """
+    The defaults, updated by the profile path (if not None) and the overrides ('section.name=value'), validated.
+    Raise ConfigError with every problem found.
+    """
+    values = defaults().as_dict()
+    errors = []
+    sources = []
+    if (path is not None):
+        try:
+            profile = read(path)
+        except (OSError, ValueError) as e:
+            raise ConfigError("%s: %s" % (path, e))
+        for section, settings in profile.items():
+            if (not isinstance(settings, dict)):
+                errors.append("%s: [%s] is not a section" % (path, section))
+                continue
+            sources.extend((path, section, name, value) for name, value in settings.items())
+    for item in overrides:
+        key, _, value = item.partition('=')
+        section, _, name = key.partition('.')
+        sources.append(('command line', section, name, value))
+    for source, section, name, value in sources:
+        spec = SCHEMA.get(section, {}).get(name)
+        if (spec is None):
+            errors.append("%s: unknown setting %s.%s" % (source, section, name))
+            continue
+        kind, _, minimum, maximum, _ = spec
+        try:
+            value = _convert(kind, value)
+        except ValueError:
+            errors.append("%s: %s.%s = %r is not a %s" % (source, section, name, value, kind.__name__))
+            continue
+        if (not minimum <= value <= maximum):
+            form = "0x%02X" if section == 'endpoints' else "%r"
+            errors.append(("%s: %s.%s = " + form + " is out of " + form + " ~ " + form) % (source, section, name, value, minimum, maximum))
+            continue
+        values[section][name] = value
+    errors.extend(_check(values))
+    if (errors):
+        raise ConfigError("invalid configuration:\n  " + "\n  ".join(errors))
+    return Config(values)
+
+def _check(values):
+    """ The checks across settings. """
+    errors = []
+    if (values['gui']['pipeout_length_default'] % 4 != 0):
+        errors.append("gui.pipeout_length_default must be a multiple of 4 words (16 bytes per USB 3.0 pipe out)")
+    if (values['driver']['reader_min_words'] % 4 != 0):
+        errors.append("driver.reader_min_words must be a multiple of 4 words (16 bytes per USB 3.0 pipe out)")
+    if (values['gui']['redraw_time'] >= values['gui']['update_interval']):
+        errors.append("gui.redraw_time must be shorter than gui.update_interval")
+    seen = {}
+    for name, address in values['endpoints'].items():
+        if (address in seen):
+            errors.append("endpoints.%s and endpoints.%s are both 0x%02X" % (seen[address], name, address))
+        seen[address] = name
+    return errors
+
+def option_args(argv):
+    """ The section.name=value arguments of a command line. """
+    return [arg for arg in argv if '=' in arg and arg.partition('=')[0].partition('.')[0] in SCHEMA]
+
+def _toml_value(value):
+    if (isinstance(value, bool)):
+        return 'true' if value else 'false'
+    if (isinstance(value, float)):
+        return repr(value)
+    return str(value)
+
+def save(cfg, path):
+    """ Write a profile, TOML or JSON by the extension of path, replacing the file atomically. """
+    values = cfg.as_dict()
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        if (path.endswith('.json')):
+            json.dump(values, f, indent=4)
+        else:
+            for section, settings in values.items():
+                f.write("[%s]\n" % section)
+                for name, value in settings.items():
+                    text = "0x%02X" % value if section == 'endpoints' else _toml_value(value)
+                    f.write("%s = %s    # %s\n" % (name, text, SCHEMA[section][name][4]))
+                f.write("\n")
+    os.replace(tmp, path)
+
+
+# here is a demo of this module: a profile written, read back with overrides, and the errors of a bad one.
+if __name__ == '__main__':
+    import tempfile
+    path = os.path.join(tempfile.gettempdir(), 'mmd_config_demo' + ('.toml' if tomllib is not None else '.json'))
+    save(defaults(), path)
+    cfg = load(path, overrides=['gui.redraw_time=30', 'driver.reader_max_bytes=0x2000000'])
+    print("redraw_time %d, reader_max_bytes %d, fifo_pipe 0x%02X" % (cfg.gui.redraw_time, cfg.driver.reader_max_bytes, cfg.endpoints.fifo_pipe))
+    try:
+        load(path, overrides=['gui.redraw_tim=30', 'gui.pipeout_length_default=1023', 'endpoints.fifo_pipe=0xA1', 'driver.clock_period=fast'])
+    except ConfigError as e:
+        print(e)
+    os.remove(path)
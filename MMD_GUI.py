@@ -7,12 +7,27 @@ It measures time differences between PMT photon pulses and RF trigger TTL signal
             qingyuan.tian@oist.jp
 """
 
+import os
 import sys
 import time
+import logging
+import concurrent.futures
 import XEM7305_MicroMotion_Detector
+import XEM7305_Emulator
+import XEM7305_Cosim
+import MMD_Checkpoint
+import MMD_Config
+import MMD_Histogram
+import MMD_Health
+import MMD_Logging
+import MMD_Metrics
+import MMD_Profiler
+import MMD_Server
+import MMD_SharedMemory
 import numpy as np
 
-from PyQt5.QtCore import QTimer
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+from PyQt5.QtGui import QFont
 from PyQt5.QtWidgets import (QApplication, QCheckBox,  
         QGridLayout, QHBoxLayout, QLabel, QLineEdit,
         QPushButton, QRadioButton,
@@ -30,17 +45,55 @@ BYTES_PER_TIMEDIFF = 1
 REDRAW_TIME = 20 # pipeOut I/O and plot animation time per update. (70~80ms might be good for matplotlib cla and draw, 20~30 mus might be good for pyqtgraph)
 N_PERIOD = 5 # a RF trigger TTL for every 5 RF drive sine waves 
 N_MAX_PROBE = 20 # Try 20 times to probe RF trigger TTL and PMT pulses, and to measure firo_r_count to calculate pipeout length. If there are no good RF trigger TTL or PMT signals, notify the user.
+SAMPLING_PERIOD = 2.17 # unit: ns. c_clk 460 MHz, the time unit of c_diff (divided by 2^fine_bits in the histogram mode of a firmware with sub-clock resolution)
 SIZE_BINS_DEFAULT = 107 # The number of the bins of the histogram will be 107 if using 21.5MHz sine wave, 5 RF drive sine waves a RF trigger TTL, sampling clock period 2.17 ns. 
 PIPEOUT_LENGTH_DEFAULT = 1024
+UPDATE_INTERVAL_DEFAULT = 200 # unit: ms. The histogram update interval at startup.
+READER_MAX_BYTES = XEM7305_MicroMotion_Detector.READER_MAX_BYTES # unit: bytes. The look-ahead of the FIFO reader thread
+READER_POLL = XEM7305_MicroMotion_Detector.READER_POLL # unit: s
+READER_MIN_WORDS = XEM7305_MicroMotion_Detector.PIPE_WORDS_MIN # the smallest transfer of the FIFO reader thread
+DRIVER_OPTIONS = {} # clock_period and endpoints of the detector, from the configuration profile
 ALARM_PROBING = "Probing ... ... "
 ALARM_NO_SIGNALS = "No RF trigger TTL or PMT Signals ! "
 ALARM_DETECTING = "IN DETECTING ... ... "
 ALARM_STPPED = "STOPPED ... ... "
+ALARM_NEED_WIDE = "RF trigger TTL period of 256 clocks or more. Try 16-bit time differences. "
+ALARM_DISCONNECTED = "Device disconnected. Reconnecting ... "
 ALARM_TOO_MANY_PHOTON = "Too many photons arriving in an update interval. Try a shorter interal. "
+RECONNECT_INTERVAL = 1000 # unit: ms. Try to open the device again at this interval after a disconnect.
+PROFILE_DUMP_FILE = "mmd_profile.txt" # per-stage timing of the update ticks, written when the detector is stopped
+PROFILE_OVERLAY_TICKS = 10 # refresh the timing overlay on the graph every 10 updates
+EVENTS_FILE = "mmd_events.bin" # raw words of the timestamped event mode, rewritten at each start. Read by XEM7305_MicroMotion_Detector.load_events().
+# Appended after a resume, with the events where the timestamps restart (resume, reconnect) in EVENTS_FILE + RESTARTS_SUFFIX.
+CHECKPOINT_FILE = "mmd_checkpoint.npz" # the histogram and the stop condition counters, every MMD_Checkpoint.CHECKPOINT_INTERVAL while detecting
 
-# global variables to enable simulation or debug features
-DEBUG = True
+# global variables to enable simulation, emulation or profiling features. Debug messages are enabled by the log level.
 SIMULATE = True
+EMULATE = False # the real detector code path, with XEM7305_Emulator in place of the FPGA board
+COSIM = False # the real detector code path, with the firmware RTL simulated by Verilator (XEM7305_Cosim) in place of the FPGA board
+CHANNELS = None # labels of the histogram channels, e.g. ['gate on', 'gate off']. None: one histogram.
+GATE = None # unit: ms. The channels alternate in windows of GATE by the timestamps (timestamped events). None: chosen by select_channel().
+FINE_BITS = 0 # sub-clock resolution of the emulated or co-simulated firmware (0 ~ 2). A board reports it from its bitstream.
+PROFILE = False
+RESUME = False # "Resume from Checkpoint" is checked at startup
+METRICS = None # None: no metrics endpoint. Otherwise, a TCP port on localhost (int) or a Unix socket path (str).
+CONTROL = None # None: no remote control server. Otherwise, a TCP port on localhost (int) or a Unix socket path (str).
+SHARE = None # None: no shared memory histogram. Otherwise, the name of the block for the other processes (MMD_SharedMemory).
+
+logger = logging.getLogger(MMD_Logging.LOGGER_NAME + '.GUI')
+
+def apply_config(cfg):
+    """ Set the settings of this module from a validated configuration profile (MMD_Config.load). """
+    global REDRAW_TIME, UPDATE_INTERVAL_DEFAULT, N_PERIOD, N_MAX_PROBE, SIZE_BINS_DEFAULT, PIPEOUT_LENGTH_DEFAULT, RECONNECT_INTERVAL
+    global SAMPLING_PERIOD, READER_MAX_BYTES, READER_POLL, READER_MIN_WORDS, DRIVER_OPTIONS
+    REDRAW_TIME, UPDATE_INTERVAL_DEFAULT = cfg.gui.redraw_time, cfg.gui.update_interval
+    N_PERIOD, N_MAX_PROBE = cfg.gui.n_period, cfg.gui.n_max_probe
+    SIZE_BINS_DEFAULT, PIPEOUT_LENGTH_DEFAULT = cfg.gui.size_bins_default, cfg.gui.pipeout_length_default
+    RECONNECT_INTERVAL = cfg.gui.reconnect_interval
+    MMD_Checkpoint.CHECKPOINT_INTERVAL = cfg.gui.checkpoint_interval
+    SAMPLING_PERIOD = cfg.driver.clock_period
+    READER_MAX_BYTES, READER_POLL, READER_MIN_WORDS = cfg.driver.reader_max_bytes, cfg.driver.reader_poll, cfg.driver.reader_min_words
+    DRIVER_OPTIONS = {'clock_period': cfg.driver.clock_period, 'endpoints': vars(cfg.endpoints)}
 
 def myfunc(k, n):
     """  The function used to create a distribution """
@@ -97,6 +150,33 @@ class MyDistribution:
     def size_bins(self):
         return self._size_bins
     
+    @property 
+    def size_samp(self):
+        return self._size_samp
+    
+
+class GuiInvoker(QObject):
+    """ Run functions in the GUI thread on behalf of other threads (e.g. the remote control server). """
+    _call = pyqtSignal(object, object)
+    
+    def __init__(self, *args, **kwargs):
+        super(GuiInvoker, self).__init__(*args, **kwargs)
+        self._call.connect(self._run) # queued connection when emitted from another thread
+        
+    def __call__(self, fn):
+        """ Return a concurrent.futures.Future of fn(), which runs in the GUI thread. """
+        future = concurrent.futures.Future()
+        self._call.emit(fn, future)
+        return future
+        
+    def _run(self, fn, future):
+        if (not future.set_running_or_notify_cancel()):
+            return
+        try:
+            future.set_result(fn())
+        except Exception as e:
+            future.set_exception(e)
+
 
 class GraphMMD(PlotWidget):
     """ The widget to draw Micro-Motion Detector histogram """
@@ -113,6 +193,20 @@ class GraphMMD(PlotWidget):
         self.setBackground('w')
         self.pen = pg.mkPen(color=(255, 0, 0), width=1)
         self.plot_ref =  self.plot(self.xdata, self.ydata, pen=self.pen, stepMode=True, fillLevel=0, brush=(50,50,200,50))
+        self.overlay = None # text item showing the timing of the update ticks, created on demand
+        self.channel_refs = [] # a step curve per histogram channel, over the histogram of all the channels
+        self.legend = None
+        self.factor = 1 # bins drawn as one step
+        self.xsteps = self.xdata # the edges of the steps
+        
+    def set_overlay(self, text):
+        """ Show a text (e.g. the profiler report) at the top left corner of the graph. """
+        if (self.overlay is None):
+            self.overlay = pg.TextItem(color='k', anchor=(0, 0))
+            self.overlay.setFont(QFont('Courier', 8))
+            self.overlay.setParentItem(self.getPlotItem().vb) # fixed on the screen, not moving with the data
+            self.overlay.setPos(5, 5)
+        self.overlay.setText(text)
         
     def init_plot(self, size_bins = 100, sampling_period=2.17):
         """ Using the real parameters to initiate the graph. """
@@ -124,6 +218,8 @@ class GraphMMD(PlotWidget):
         self.ydata = np.full((self.size_bins),0) # initial to 0s
         self.plot_ref.setData(self.xdata, self.ydata)
         self.setXRange(self.xdata[0], self.xdata[self.size_bins], padding=0)
+        self.factor = 1
+        self.xsteps = self.xdata
         
         gtitle = "Histogram of Measured Time Differences"
         gleftlbl = "Number of Photons"
@@ -138,20 +234,41 @@ class GraphMMD(PlotWidget):
         self.getAxis('bottom').setPen('black')
         self.getAxis('bottom').setTextPen('black')
     
-    def update_plot(self, size_bins = 100, hist=[]):
-        """ Update the graph using new values """
+    def set_channels(self, labels=None):
+        """ A step curve for each histogram channel (labels), or none for a single histogram. """
+        for ref in self.channel_refs:
+            self.removeItem(ref)
+        self.channel_refs = []
+        if (self.legend is not None):
+            self.legend.clear()
+        if (labels is None or len(labels) < 2):
+            return
+        if (self.legend is None):
+            self.legend = self.addLegend()
+        for k, label in enumerate(labels):
+            pen = pg.mkPen(color=pg.intColor(k, hues=len(labels)), width=1)
+            self.channel_refs.append(self.plot(self.xsteps, np.zeros(len(self.xsteps) - 1), pen=pen, stepMode=True, name=label))
+
+    def update_plot(self, size_bins = 100, hist=[], channel_hists=None, factor=1):
+        """ 
+        Update the graph using new values. channel_hists: the histograms of the channels, if more than one.
+        factor: hist and channel_hists are rebinned, factor bins per step (the last step has the remaining bins).
+        """
         self.n_from_start = self.n_from_start + 1
         
-        # advance feature: adjust while size_bins changed. Might not be needed.
-        if (self.size_bins > size_bins):
-            pass # to be added if needed
-        elif (self.size_bins < size_bins):
-            pass # to be added if needed
+        if (self.size_bins != size_bins): # a new histogram segment for another RF trigger TTL period
+            self.init_plot(size_bins=size_bins, sampling_period=self.sampling_period)
+        if (self.factor != factor):
+            self.factor = factor
+            self.xsteps = [min(i * factor, self.size_bins) * self.sampling_period for i in range(len(hist) + 1)]
         
         self.ydata = hist
         
         self.setXRange(self.xdata[0], self.xdata[self.size_bins], padding=0)
-        self.plot_ref.setData(self.xdata, self.ydata)
+        self.plot_ref.setData(self.xsteps, self.ydata)
+        if (channel_hists is not None):
+            for ref, ydata in zip(self.channel_refs, channel_hists):
+                ref.setData(self.xsteps, ydata)
     
 class MMD():
     """ 
@@ -160,40 +277,116 @@ class MMD():
     """
     def __init__(self, *args, **kwargs):
         self.timer = None
+        self.profiler = MMD_Profiler.StageProfiler(enabled=PROFILE) # per-stage timing of update_mmd
+        self.metrics = MMD_Metrics.MetricsRegistry() # live statistics, served by a MetricsServer if enabled
+        self.publisher = MMD_Histogram.DeltaPublisher() # histogram deltas for remote viewers, encoded only if subscribed
+        self.n_update = 0
+        self.time_detected = 0
+        self.cnt_detected = 0
+        self.size_bins = 0
+        self.hist = []
+        self.events_file = None # EVENTS_FILE, open while detecting in the timestamped event mode
+        self.reader = None # XEM7305_MicroMotion_Detector.PipeReader, reading the FIFO in a thread while detecting
+        self.reconnecting = False # the device was disconnected while detecting, the updates try to reconnect it
+        self.newSegment = False # start a new histogram when the RF trigger TTL period changes, instead of pausing
+        self.on_health = None # called with each MMD_Health.HealthEvent, e.g. to show it in the GUI
+        self.channels = ['all'] # labels of the histogram channels
+        self.channel = 0
+        self.channel_hist = None # a histogram per channel, if more than one
+        self.corrector = None # MMD_Histogram.HistogramCorrector, the background and the dead time correction of the histogram
+        self.background = False # the beam is blocked: the updates measure the background, not the histogram
+        self.showCorrected = False # plot the corrected histogram instead of the counts
+        self.pyramid = None # MMD_Histogram.HistogramPyramid, the histogram at coarser resolutions for the display and the remote clients
+        self.rebinFactor = 1 # bins per step of the plot
+        self.checkpointer = None # MMD_Checkpoint.Checkpointer, writing CHECKPOINT_FILE in its own thread
+        self.t_checkpoint = 0. # time.monotonic() of the last checkpoint
+        self.rotate_checkpoint = False # the next checkpoint is the first one of a new session, the previous one is kept
+        self.shared = None # MMD_SharedMemory.SharedHistogramWriter, the histogram for the other processes (SHARE)
         self.init_mmd(self, *args, **kwargs)
         self.init_dummy_plots(self, *args, **kwargs)
     
     def init_mmd(self, *args, **kwargs):
         pass
     
+    def is_detecting(self):
+        return self.timer is not None and self.timer.isActive()
+    
     def init_dummy_plots(self, *args, **kwargs):
         """ initiate plots with dummy parameters """
         self.graph0 = GraphMMD()
         self.graph0.setMinimumSize(800,300)
 
-    def start_mmd(self, dev=None, size_bins=100, updateInterval=200, pipeOutLen=1024, useCondCnt=False, useCondTime=False, condCnt=20000, condTime=3000, condOr=True):
+    def start_mmd(self, dev=None, size_bins=100, updateInterval=200, pipeOutLen=1024, useCondCnt=False, useCondTime=False, condCnt=20000, condTime=3000, condOr=True, histOnFPGA=False, timestamp=False, wide=False, channels=None, gate=None, resume=None):
         """ 
         It initiates the plots with real parameters, 
         and start the detector by initiate a timer to  periodically fetch the new time difference values from the FPGA board. 
         The unit of updateInterval: ms.
+        histOnFPGA: the FPGA accumulates the histogram, only its counters are read out, instead of every time difference.
+        timestamp: every time difference comes with a coarse timestamp, and the events are recorded to EVENTS_FILE.
+        wide: 16-bit time differences through the FIFO, for TTL periods of 256 clocks or more, and for the sub-clock bits.
+        channels: labels of separate histograms (e.g. gate on / off), accumulated besides the histogram of all of them.
+        The data of an update goes to the channel chosen by select_channel(), or with timestamp, each event to the channel
+        of its time, the channels alternating in windows of gate (unit: ms) from the start.
+        resume: a snapshot (MMD_Checkpoint.load) to continue from, if it is for the same histogram bins (see restore()).
+        With a firmware of sub-clock resolution (dev.fine_bits > 0), the histogram mode and the 16-bit mode have size_bins << fine_bits bins.
         """
+        self.stop_reader() # the buffers of a previous run go to its histogram
+        self.histOnFPGA = histOnFPGA
+        self.timestamp = timestamp and not histOnFPGA # the histogram mode has priority on the FPGA
+        self.wide = wide and not histOnFPGA and not self.timestamp and dev is not None
+        # sub-clock time differences come only through the histogram mode and the 16-bit mode, the 8-bit mode carries c_clk periods
+        self.fine_bits = dev.fine_bits if (dev is not None and (histOnFPGA or self.wide)) else 0
+
         # Histogram data
         self.n_update = 0 
         self.time_detected = 0 # unit: ms
         self.cnt_detected = 0 # unit: photon
-        self.hist = [0] * size_bins
-        self.size_bins = size_bins
+        self.segments = [] # (TTL period, histogram) of the previous segments, when a new one is started for another TTL period
+        self.channels = list(channels) if channels else ['all']
+        self.channel = 0 # the channel of the data of the next updates, see select_channel()
+        self.gate_ticks = None # unit: timestamp tick. The length of a channel window.
+        if (gate and len(self.channels) > 1):
+            if (self.timestamp):
+                self.gate_ticks = max(1, int(gate * 1e6 / XEM7305_MicroMotion_Detector.TIMESTAMP_TICK))
+            else:
+                logger.warning("Gated channels need the timestamped events, the channels are chosen by select_channel()")
+        self.health = MMD_Health.HealthMonitor(size_bins) # the RF trigger TTL period and the counters, checked at every update
+        self.init_histogram(dev, size_bins) # and the plots
         
         # initiate simulator
-        self.simulator = MyDistribution(my_func = myfunc, normalize=False, size_bins=size_bins)
+        self.simulator = MyDistribution(my_func = myfunc, normalize=False, size_bins=self.size_bins)
         self.simulator.popu()
         
-        # initiate plots with real parameters
-        self.graph0.init_plot(size_bins=size_bins)
+        self.profiler.clear()
+        self.metrics.reset()
+        self.metrics.set('mmd_signals_ok', 1)
+        self.pre_status = None # the (time, photon count, tdiff count) of the previous update, for the rates
+        self.tdiff_base = 0 # unit: photon. Counted by the FPGA before the last reconnect, its counters restart from 0.
+        self.n_reconnect = 0
+        self.reconnecting = False
+        self.read_total = 0 # unit: bytes
+        self.events_total = 0 # unit: photon. Time differences read out, from the fifo or the histogram counters.
+        self.dropped_total = 0 # unit: photon
+        if (self.timestamp):
+            self.bytes_per_event = XEM7305_MicroMotion_Detector.BYTES_PER_EVENT
+        elif (self.wide):
+            self.bytes_per_event = XEM7305_MicroMotion_Detector.BYTES_PER_WIDE_DIFF
+        else:
+            self.bytes_per_event = BYTES_PER_TIMEDIFF
+        resumed = resume is not None and self.restore(resume)
+        self.close_events_file()
+        if (self.timestamp and dev is not None):
+            self.events_file = open(EVENTS_FILE, 'ab' if resumed else 'wb') # resumed: the timestamps restart from the reset, see mark_restart()
+            if (not resumed and os.path.exists(EVENTS_FILE + XEM7305_MicroMotion_Detector.RESTARTS_SUFFIX)):
+                os.remove(EVENTS_FILE + XEM7305_MicroMotion_Detector.RESTARTS_SUFFIX)
+        if (self.checkpointer is None):
+            self.checkpointer = MMD_Checkpoint.Checkpointer(CHECKPOINT_FILE)
+        self.t_checkpoint = time.monotonic()
+        self.rotate_checkpoint = not resumed
 
         # prepare to pipeout values from the FPGA board
         if (dev is not None): 
-            dev.reset_dev() 
+            self.start_device(dev, histOnFPGA)
             
         # use a timer to pipeout values from the FPGA board
         # either the real detector or the simulated detector will use this timer
@@ -206,52 +399,332 @@ class MMD():
         self.interval = updateInterval - REDRAW_TIME # REDRAW_TIME is time needed for I/O and graph render. Set as a const. 
         if (self.interval < 0): 
             self.interval = 0
-        if (DEBUG == True):
-            print("Timer interval", self.interval)
+        logger.debug("Timer interval %s", self.interval)
         self.timer.setInterval(int(self.interval))
-        self.timer.timeout.connect(lambda: self.update_mmd(dev=dev, pipeOutLen=pipeOutLen, size_bins=size_bins, useCondCnt=useCondCnt, useCondTime=useCondTime, condCnt=condCnt, condTime=condTime, condOr=condOr)) # fire the function by the timeout event of the timer.
+        self.timer.timeout.connect(lambda: self.update_mmd(dev=dev, pipeOutLen=pipeOutLen, size_bins=size_bins, useCondCnt=useCondCnt, useCondTime=useCondTime, condCnt=condCnt, condTime=condTime, condOr=condOr, histOnFPGA=histOnFPGA)) # fire the function by the timeout event of the timer.
         self.timer.start()
         
+    def init_histogram(self, dev, ttl_period):
+        """ An empty histogram and plot for a RF trigger TTL period (unit: c_clk), and the maps of the time differences to its bins. """
+        size_bins = ttl_period << self.fine_bits
+        self.hist = [0] * size_bins
+        self.size_bins = size_bins
+        self.pyramid = MMD_Histogram.HistogramPyramid(size_bins)
+        self.graph0.init_plot(size_bins=size_bins, sampling_period=SAMPLING_PERIOD / (1 << self.fine_bits))
+        self.publisher.request_keyframe() # a new histogram
+        hist_bins = dev.hist_bins if dev is not None else XEM7305_MicroMotion_Detector.HIST_BINS
+        self.hist_buff = bytearray(4 * hist_bins) # reused by every histogram readout
+        self.hist_index = MMD_Histogram.phase_bin_index(hist_bins, size_bins, (1 << self.fine_bits) - 1) # the bin of each counter
+        if (self.wide): # the bin of each 16-bit time difference
+            self.diff_index = MMD_Histogram.phase_bin_index(1 << (dev.data_bits + dev.fine_bits), size_bins, (1 << self.fine_bits) - 1)
+        else: # of each 8-bit time difference
+            self.diff_index = MMD_Histogram.phase_bin_index(256, size_bins)
+        self.channel_hist = np.zeros((len(self.channels), size_bins), dtype=np.int64) if len(self.channels) > 1 else None
+        self.graph0.set_channels(self.channels if len(self.channels) > 1 else None)
+        self.corrector = MMD_Histogram.HistogramCorrector(size_bins, ttl_seconds=ttl_period * SAMPLING_PERIOD * 1e-9, 
+                                                         dead_bins=XEM7305_MicroMotion_Detector.DEAD_TIME_CLOCKS << self.fine_bits)
+        if (SHARE is not None):
+            self.open_shared()
+
+    def open_shared(self):
+        """ The shared memory block (SHARE) of the histogram, a new one if the bins or the channels changed. """
+        if (self.shared is not None and (self.shared.size_bins, self.shared.n_channels) == (self.size_bins, len(self.channels))):
+            return
+        self.close_shared()
+        self.shared = MMD_SharedMemory.SharedHistogramWriter(self.size_bins, len(self.channels), SHARE)
+
+    def share(self):
+        """ Publish the histogram and the counters to the other processes. A few copies of memory, the readers are not waited for. """
+        self.shared.publish(self.hist, self.channel_hist, n_update=self.n_update, time_detected=self.time_detected, 
+                            cnt_detected=self.cnt_detected, channel=self.channel, background=int(self.background), 
+                            fine_bits=self.fine_bits, detecting=int(self.is_detecting()))
+
+    def close_shared(self):
+        if (self.shared is not None):
+            self.shared.close()
+            self.shared = None
+
+    def select_channel(self, channel):
+        """ The histogram channel (index or label) of the data of the next updates. """
+        index = self.channels.index(channel) if isinstance(channel, str) else int(channel)
+        if (not 0 <= index < len(self.channels)):
+            raise ValueError("no channel %s" % channel) # the channel is kept
+        self.channel = index
+
+    def bin_counts(self, bins, weights=None, channel=None):
+        """ 
+        Histogram the bins of an update: return (hist_tmp, channel_tmp), the histogram of all the channels, and the histogram
+        of each channel (None with one channel). One np.bincount on channel * size_bins + bin, whatever the number of channels.
+        channel: an int for all the bins, or an array with the channel of each bin. None: self.channel.
+        """
+        size_bins = self.size_bins
+        if (self.channel_hist is None):
+            return np.bincount(bins, weights=weights, minlength=size_bins).astype(np.int64), None
+        if (channel is None):
+            channel = self.channel
+        flat = np.bincount(channel * size_bins + bins, weights=weights, minlength=len(self.channels) * size_bins)
+        channel_tmp = flat.reshape(len(self.channels), size_bins).astype(np.int64)
+        return channel_tmp.sum(axis=0), channel_tmp
+
+    def snapshot(self):
+        """ The state to resume the histogram from: the histograms, the stop condition counters and what the bins depend on. """
+        snapshot = {'size_bins': self.size_bins, 'fine_bits': self.fine_bits, 'hist': self.hist, 'time_detected': self.time_detected,
+                    'cnt_detected': self.cnt_detected, 'histogram_mode': self.histOnFPGA, 'timestamp': self.timestamp, 'wide': self.wide, 
+                    'channels': self.channels, 'background': self.corrector.background, 'background_time': self.corrector.background_time,
+                    'saved_at': time.time()}
+        if (self.channel_hist is not None):
+            snapshot['channel_hist'] = self.channel_hist
+        snapshot.update(self.segment_arrays())
+        return snapshot
+
+    def segment_arrays(self):
+        """ The previous segments (newSegment) as flat arrays for a snapshot: their TTL periods, bin counts, and histograms one after the other. """
+        hists = [hist if isinstance(hist, np.ndarray) else hist[0] for _, hist in self.segments]
+        arrays = {'segment_ttl_periods': np.array([ttl_period for ttl_period, _ in self.segments], dtype=np.int64),
+                  'segment_sizes': np.array([len(hist) for hist in hists], dtype=np.int64),
+                  'segment_hists': np.concatenate(hists).astype(np.int64) if hists else np.zeros(0, dtype=np.int64)}
+        if (self.channel_hist is not None):
+            channel_hists = [hist[1].ravel() for _, hist in self.segments]
+            arrays['segment_channel_hists'] = np.concatenate(channel_hists).astype(np.int64) if channel_hists else np.zeros(0, dtype=np.int64)
+        return arrays
+
+    def restore_segments(self, snapshot):
+        """ The previous segments of a snapshot, with their channel histograms if it has the same channels. """
+        if ('segment_ttl_periods' not in snapshot):
+            return
+        sizes = snapshot['segment_sizes']
+        hists = np.split(snapshot['segment_hists'].astype(np.int64), np.cumsum(sizes)[:-1]) if len(sizes) else []
+        if (self.channel_hist is not None and 'segment_channel_hists' in snapshot and list(snapshot['channels']) == self.channels):
+            n = len(self.channels)
+            flat = np.split(snapshot['segment_channel_hists'].astype(np.int64), np.cumsum(sizes * n)[:-1]) if len(sizes) else []
+            hists = [(hist, channel_hist.reshape(n, len(hist))) for hist, channel_hist in zip(hists, flat)]
+        self.segments = [(int(ttl_period), hist) for ttl_period, hist in zip(snapshot['segment_ttl_periods'], hists)]
+
+    def checkpoint(self):
+        """ Queue a snapshot to CHECKPOINT_FILE, written by the thread of the checkpointer. """
+        self.checkpointer.save(self.snapshot(), rotate=self.rotate_checkpoint)
+        self.rotate_checkpoint = False
+        self.t_checkpoint = time.monotonic()
+
+    def restore(self, snapshot):
+        """ 
+        Continue the histogram, the background and the stop condition counters of a snapshot. 
+        Return False, and keep the empty histogram, if it has other bins (RF trigger TTL period, fine bits).
+        The previous segments (newSegment) are restored too.
+        """
+        if (int(snapshot['size_bins']) != self.size_bins or int(snapshot['fine_bits']) != self.fine_bits):
+            logger.warning("Checkpoint of %d bins (fine bits %d), not %d bins (fine bits %d): not resumed", 
+                           int(snapshot['size_bins']), int(snapshot['fine_bits']), self.size_bins, self.fine_bits)
+            return False
+        self.hist = snapshot['hist'].astype(np.int64)
+        self.pyramid.set(self.hist)
+        self.time_detected = int(snapshot['time_detected'])
+        self.cnt_detected = int(snapshot['cnt_detected'])
+        if (self.channel_hist is not None and 'channel_hist' in snapshot and list(snapshot['channels']) == self.channels):
+            self.channel_hist = snapshot['channel_hist'].astype(np.int64)
+        elif (self.channel_hist is not None):
+            logger.warning("Checkpoint with other histogram channels: the channels start empty")
+        self.corrector.add_background(snapshot['background'], float(snapshot['background_time']))
+        self.restore_segments(snapshot)
+        self.publisher.request_keyframe()
+        logger.info("Resumed from the checkpoint of %s: %d photons, %d ms", 
+                    time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(float(snapshot['saved_at']))), self.cnt_detected, self.time_detected)
+        return True
+
+    def add_update(self, hist_tmp, channel_tmp=None):
+        """ Add the histogram of an update tick, to the background while the beam is blocked. channel_tmp: see bin_counts(). """
+        if (self.background):
+            self.corrector.add_background(hist_tmp, self.settingInterval * 1e-3)
+            return
+        self.hist = self.hist + hist_tmp
+        self.pyramid.add(hist_tmp)
+        if (channel_tmp is not None):
+            self.channel_hist = self.channel_hist + channel_tmp
+        elif (self.channel_hist is not None):
+            self.channel_hist[self.channel] += np.asarray(hist_tmp, dtype=np.int64)
+
+    def corrected_histogram(self):
+        """ The histogram with the dead time corrected and the background (measured with the beam blocked) subtracted. """
+        return self.corrector.correct(self.hist, self.time_detected * 1e-3)
+
+    def check_health(self, dev, photon_cnt, tdiff_cnt, TTL_prd):
+        """ 
+        Check the signals from the status of this update, and report the changes. Return True if the data of this update is accumulated.
+        When the RF trigger TTL period changes, the accumulation pauses until it comes back, or a new histogram is started (newSegment).
+        """
+        for event in self.health.check(photon_cnt, tdiff_cnt, TTL_prd):
+            if (event.state == MMD_Health.OK):
+                logger.info(event.message)
+            else:
+                logger.warning(event.message)
+            self.metrics.set('mmd_signals_ok', 1 if event.state == MMD_Health.OK else 0)
+            if (self.on_health is not None):
+                self.on_health(event)
+            if (event.state == MMD_Health.TTL_CHANGED and self.newSegment and dev is not None):
+                self.segments.append((self.health.ttl_period, self.hist if self.channel_hist is None else (self.hist, self.channel_hist)))
+                logger.info("New histogram segment # %d for the RF trigger TTL period %d", len(self.segments), event.ttl_period)
+                self.init_histogram(dev, event.ttl_period)
+                self.health.reset(event.ttl_period)
+                return False # the data of this update may be from before the change
+        return self.health.accumulate
+
+    def start_device(self, dev, histOnFPGA):
+        """ Set the modes of the device and reset it, then start the FIFO reader. Also after a reconnect. """
+        dev.set_modes(histogram=histOnFPGA, timestamp=self.timestamp, wide=self.wide)
+        dev.reset_dev() # drops the data of before (the probe does not reset), restarts the counts the updates start from, also clears the histogram counters, and restarts the timestamp
+        self.mark_restart()
+        if (not histOnFPGA): # the FIFO is read in a thread, while the previous data is decoded here
+            self.reader = XEM7305_MicroMotion_Detector.PipeReader(dev, max_bytes=READER_MAX_BYTES, poll=READER_POLL, min_words=READER_MIN_WORDS)
+            self.reader_dev = dev # decodes the timestamps of the buffers
+            self.reader_status = (0, 0, 0, 0) # probed before the last buffer taken from the reader
+            self.reader_waiting = 0 # unit: photon. Left in the fifo after the last buffer taken from the reader.
+            self.reader.start()
+
+    def mark_restart(self):
+        """ The timestamps restart from 0 after the events already recorded (resume, reconnect): note where, for load_events() and MMD_Analysis. """
+        if (self.events_file is None):
+            return
+        n_events = self.events_file.tell() // XEM7305_MicroMotion_Detector.BYTES_PER_EVENT
+        if (n_events > 0):
+            with open(EVENTS_FILE + XEM7305_MicroMotion_Detector.RESTARTS_SUFFIX, 'a') as f:
+                f.write("%d\n" % n_events)
+
+    def is_device_lost(self, dev):
+        """ While the reader thread uses the device, it finds a disconnect, else the device is asked here. """
+        if (self.reader is not None):
+            return self.reader.lost
+        return not dev.is_open()
+
+    def device_lost(self):
+        """ The device was disconnected (e.g. a USB cable glitch): pause, and try to reconnect at the next updates. """
+        self.stop_reader()
+        self.reconnecting = True
+        self.t_reconnect = 0 # try at once
+        if (self.pre_status is not None): # the counts of the FPGA restart from 0 after the reconnect
+            self.tdiff_base = self.pre_status[2]
+        self.pre_status = None
+        self.metrics.set('mmd_detecting', 0)
+        self.graph0.setTitle("Histogram (%s)" % ALARM_DISCONNECTED, **{'color':'orange', 'font-size':'16px'})
+        logger.warning(ALARM_DISCONNECTED)
+
+    def reconnect_device(self, dev, histOnFPGA):
+        """ Try to open the device again, at most every RECONNECT_INTERVAL. Resume the detecting into the same histogram. """
+        now = time.monotonic()
+        if (now - self.t_reconnect < RECONNECT_INTERVAL / 1000.):
+            return
+        self.t_reconnect = now
+        if (not dev.reconnect()):
+            logger.debug("device not back yet")
+            return
+        self.start_device(dev, histOnFPGA)
+        self.health.reset() # the counters restart from 0
+        self.reconnecting = False
+        self.n_reconnect = self.n_reconnect + 1
+        self.metrics.set('mmd_reconnects_total', self.n_reconnect)
+        self.graph0.setTitle("Histogram of Measured Time Differences", **{'color':'black', 'font-size':'16px'})
+        logger.info("Device reconnected (%d), detecting again", self.n_reconnect)
+
     def stop_update(self):
         if (self.timer is not None):
             self.timer.stop()
+        self.stop_reader()
+        if (self.checkpointer is not None and self.n_update > 0):
+            self.checkpoint()
+        if (self.shared is not None):
+            self.share()
+        self.metrics.set('mmd_detecting', 0)
+        self.close_events_file()
+
+    def stop_reader(self):
+        """ 
+        Stop reading the FIFO, before the device is used by this thread again. The buffers read since the last update
+        are not dropped: they go to the histogram, the counters and the events file, as in an update.
+        """
+        if (self.reader is not None):
+            chunks = self.reader.stop()
+            self.reader = None
+            if (len(chunks) > 0):
+                self.reader_status = chunks[-1][1]
+                n_bytes, n_events = self.take_chunks(self.reader_dev, chunks, self.health.accumulate)
+                if (self.health.accumulate and not self.background):
+                    self.cnt_detected = self.cnt_detected + n_events
+                self.read_total = self.read_total + n_bytes
+                self.events_total = self.events_total + n_events
+                logger.debug("%d buffers, %d bytes taken from the stopped reader", len(chunks), n_bytes)
+        
+    def close_events_file(self):
+        if (self.events_file is not None):
+            self.events_file.close()
+            self.events_file = None
             
-    def update_mmd(self, dev=None, pipeOutLen=1024, size_bins=100, useCondCnt=False, useCondTime=False, condCnt=20000, condTime=3000, condOr=True):
+    def update_mmd(self, dev=None, pipeOutLen=1024, size_bins=100, useCondCnt=False, useCondTime=False, condCnt=20000, condTime=3000, condOr=True, histOnFPGA=False):
         """ 
         It pipes out the time difference values from the FPGA device, and uses the new  values to update the plot. 
         It is fired periodically by the timeout event of the timer.
         The unit of timer intervals: ms.
+        If the device is disconnected, the updates pause (no detecting time is counted) until it is reconnected.
+        The updates also pause while the RF trigger TTL period differs from the one of the histogram (check_health).
         """
+        if (SIMULATE != True and dev is not None and (self.reconnecting or self.is_device_lost(dev))):
+            if (not self.reconnecting):
+                self.device_lost()
+            self.reconnect_device(dev, histOnFPGA)
+            return
         self.n_update = self.n_update + 1 
+        t_tick = time.perf_counter()
+        prof = self.profiler
+        prof.begin_tick()
 
         # Time difference values.
         pipe_len = pipeOutLen # default length
-        if (SIMULATE != True and dev is not None):
-            fifo_cnt = dev.fifo_r_count() # length of data in fifo ready to pipeout
-            pipe_len = (fifo_cnt // MIN_PIPEOUT_LEN_IN_WORD) * MIN_PIPEOUT_LEN_IN_WORD  # Adjust the pipeOut length
-            if (DEBUG):
-                print("update # : ", self.n_update)
-                print("fifo_cnt, pipe_len ", fifo_cnt, pipe_len ) 
-            self.buff = bytearray(PIPEOUT_BUS_WIDTH * pipe_len) # pipeout length adjusted in each update
-            dev.pipe_out(self.buff) 
-            tdiff_tmp = self.size_bins - np.frombuffer(self.buff, dtype=np.uint8) # np.frombuffer convert a byte array to an int array. The value fetched from FPGA is (time_photon - time_rising_TTL). To mode it by size_bins (period_of_TTL) gets the value (time_rising_TTL - time_photon) we need.
-            if (DEBUG): 
-                #print(self.buff)
-                print(tdiff_tmp)
-            hist_tmp, _ = np.histogram(tdiff_tmp, self.size_bins, density=False) 
-            self.hist = self.hist + hist_tmp 
+        if (SIMULATE != True and dev is not None and histOnFPGA):
+            photon_cnt, tdiff_cnt, TTL_prd, fifo_cnt = dev.probe_dev() # before the swap, so that every counted photon is in this readout or an earlier one
+            accumulate = self.check_health(dev, photon_cnt, tdiff_cnt, TTL_prd)
+            prof.mark('wireout')
+            counters = dev.read_histogram(self.hist_buff) # dev.hist_bins counters, the photons since the previous readout
+            if (counters is None): # the readout failed, the counters are lost
+                self.device_lost()
+                prof.end_tick() # else the stages of this tick would be added to the next one
+                return
+            prof.mark('pipeout')
+            n_bytes = len(self.hist_buff)
+            n_events = n_detected = int(counters.sum())
+            hist_tmp, channel_tmp = self.bin_counts(self.hist_index, weights=counters) # c_diff is 1 ~ size_bins, and a few sampling periods around with fine_bits
+            prof.mark('decode')
+            if (accumulate):
+                self.add_update(hist_tmp, channel_tmp)
+            prof.mark('accumulate')
+        elif (SIMULATE != True and dev is not None):
+            # the reader thread probes the fifo and pipes it out, the buffers filled since the previous update are taken here
+            chunks = self.reader.get_all()
+            accumulate = self.check_health(dev, *self.reader.status[:3]) # the last probe of the reader
+            prof.mark('wireout')
+            if (len(chunks) > 0):
+                self.reader_status = chunks[-1][1] # probed before the transfer of the last buffer
+                self.reader_waiting = max(0, (PIPEOUT_BUS_WIDTH * self.reader_status[3] - len(chunks[-1][0])) // self.bytes_per_event)
+            photon_cnt, tdiff_cnt, TTL_prd, fifo_cnt = self.reader_status
+            logger.debug("update # %d: fifo_cnt %d, %d buffers", self.n_update, fifo_cnt, len(chunks))
+            n_bytes, n_events = self.take_chunks(dev, chunks, accumulate, prof)
+            n_detected = n_events
 
         # Simulation: using the simulator(a simulated distribution) to create the histogram. 
         elif (SIMULATE == True):
             # data from a simulator
             self.simulator.samp()
-            self.hist = self.hist + self.simulator.samp_density
+            prof.mark('decode')
+            self.add_update(self.simulator.samp_density)
+            prof.mark('accumulate')
+            n_bytes = n_events = self.simulator.size_samp # one byte per simulated time difference
+            n_detected = PIPEOUT_BUS_WIDTH * pipe_len
+            tdiff_cnt = photon_cnt = self.read_total + n_bytes
+            TTL_prd, fifo_cnt = self.size_bins, n_bytes // PIPEOUT_BUS_WIDTH
+            accumulate = True
         
         # To stop the update according the pre-configured conditions
-        self.time_detected = self.time_detected + self.settingInterval
-        self.cnt_detected = self.cnt_detected + PIPEOUT_BUS_WIDTH * pipe_len
-        if (DEBUG):
-            print("self.time_detected, self.cnt_detected: ", self.time_detected, self.cnt_detected)
+        if (accumulate and not self.background): # not while paused, nor while measuring the background
+            self.time_detected = self.time_detected + self.settingInterval
+            self.cnt_detected = self.cnt_detected + n_detected
+        logger.debug("time_detected %d, cnt_detected %d", self.time_detected, self.cnt_detected)
         if (not(useCondCnt or useCondTime)):
             self.condStop = False # no stop condtion is checked.
         else:
@@ -268,11 +741,88 @@ class MMD():
             gstyles = {'color':'red', 'font-size':'16px'}
             gtitle = "Histogram (STOPPED -- Enough Data or Time Out.  )"
             self.graph0.setTitle(gtitle, **gstyles)
-            print("STOPPED -- Enough Data or Time Out. ")
+            logger.info("STOPPED -- Enough Data or Time Out. ")
             self.stop_update() # stop fetching more data to update the histogram plot
         
         # update the plot
-        self.graph0.update_plot(size_bins = size_bins, hist=self.hist)
+        factor = self.rebinFactor
+        hist = MMD_Histogram.rebin(self.corrected_histogram(), factor) if self.showCorrected else self.pyramid.rebin(factor)
+        channel_hists = [MMD_Histogram.rebin(h, factor) for h in self.channel_hist] if self.channel_hist is not None else None
+        self.graph0.update_plot(size_bins = self.size_bins, hist=hist, channel_hists=channel_hists, factor=factor)
+        prof.mark('render')
+        prof.end_tick()
+        if (prof.enabled and (self.n_update % PROFILE_OVERLAY_TICKS == 0 or self.condStop)):
+            self.graph0.set_overlay(prof.report())
+        if (SIMULATE == True or dev is not None):
+            n_waiting = self.reader_waiting if self.reader is not None else None
+            self.update_metrics(photon_cnt, tdiff_cnt, TTL_prd, fifo_cnt, n_bytes, n_events, time.perf_counter() - t_tick, n_waiting)
+        if (self.publisher.has_subscribers()):
+            self.publisher.publish(self.hist)
+        if (self.shared is not None):
+            self.share()
+        if (time.monotonic() - self.t_checkpoint >= MMD_Checkpoint.CHECKPOINT_INTERVAL and not self.condStop):
+            self.checkpoint()
+        
+    def take_chunks(self, dev, chunks, accumulate, prof=None):
+        """ 
+        Decode the FIFO buffers of the reader, [(buff, status)], record the events, and add them to the histogram if accumulate.
+        Return (bytes, events). prof: the profiler of the update tick, marked at each stage.
+        """
+        self.buff = chunks[0][0] if len(chunks) == 1 else b''.join(c[0] for c in chunks)
+        n_bytes = len(self.buff)
+        n_events = n_bytes // self.bytes_per_event
+        if (prof is not None):
+            prof.mark('pipeout')
+        channel = None
+        if (self.timestamp and self.gate_ticks is not None):
+            ticks, diff = dev.decode_events(self.buff)
+            channel = (ticks // self.gate_ticks) % len(self.channels) # the channels alternate in gate windows
+            if (self.events_file is not None):
+                self.events_file.write(self.buff)
+        elif (self.timestamp):
+            diff = np.frombuffer(self.buff, dtype=XEM7305_MicroMotion_Detector.EVENT_DTYPE)['diff'] # a view, the timestamps are decoded offline
+            if (self.events_file is not None):
+                self.events_file.write(self.buff)
+        elif (self.wide):
+            diff = np.frombuffer(self.buff, dtype=XEM7305_MicroMotion_Detector.WIDE_DTYPE)
+        else:
+            diff = np.frombuffer(self.buff, dtype=np.uint8) # np.frombuffer convert a byte array to an int array.
+        # The value fetched from FPGA is (time_photon - time_rising_TTL). To mode it by size_bins (period_of_TTL) gets the value (time_rising_TTL - time_photon) we need.
+        tdiff_tmp = self.diff_index[diff] # (size_bins - diff) mod size_bins, by a lookup table
+        if (prof is not None):
+            prof.mark('decode')
+        logger.debug("tdiff %s", tdiff_tmp) # formatted by the logging thread, not here
+        hist_tmp, channel_tmp = self.bin_counts(tdiff_tmp, channel=channel)
+        if (accumulate):
+            self.add_update(hist_tmp, channel_tmp)
+        if (prof is not None):
+            prof.mark('accumulate')
+        return n_bytes, n_events
+
+    def update_metrics(self, photon_cnt, tdiff_cnt, TTL_prd, fifo_cnt, n_bytes, n_events, t_tick, n_waiting=None):
+        """ 
+        Publish the statistics of an update tick. Only the registry is touched, the metrics server reads it from its own thread. 
+        n_waiting: events left in the fifo after this readout, if not the fifo_cnt events minus this readout.
+        """
+        now = time.monotonic()
+        tdiff_cnt = tdiff_cnt + self.tdiff_base
+        self.read_total = self.read_total + n_bytes
+        self.events_total = self.events_total + n_events
+        # events counted by the FPGA, but neither read out nor still waiting in the fifo, were lost (cdc hold time or full fifo).
+        if (n_waiting is None):
+            n_waiting = max(0, PIPEOUT_BUS_WIDTH // self.bytes_per_event * fifo_cnt - n_events) # fifo_cnt was probed before this readout
+        self.dropped_total = max(self.dropped_total, tdiff_cnt - self.events_total - n_waiting)
+        values = {'mmd_ttl_period': TTL_prd, 'mmd_fifo_occupancy': fifo_cnt, 'mmd_read_bytes_total': self.read_total, 
+                  'mmd_dropped_events_total': self.dropped_total, 'mmd_tick_seconds': t_tick, 
+                  'mmd_updates_total': self.n_update, 'mmd_detecting': 0 if self.condStop else 1}
+        if (self.pre_status is not None):
+            dt = now - self.pre_status[0]
+            if (dt > 0):
+                values['mmd_photon_rate'] = (photon_cnt - self.pre_status[1]) / dt
+                values['mmd_tdiff_rate'] = (tdiff_cnt - self.pre_status[2]) / dt
+                values['mmd_read_bytes_per_second'] = n_bytes / dt
+        self.pre_status = (now, photon_cnt, tdiff_cnt)
+        self.metrics.update(**values)
         
 
 class MainWindow(QMainWindow):
@@ -282,9 +832,28 @@ class MainWindow(QMainWindow):
         
         self.dev = self.getDev()
         self.mmd = self.getMMD()
+        self.mmd.on_health = self.showHealth
         self.gui = self.createGUI()
         self.calcConfig()
         self.stop_timer = None
+        self.metrics_server = None
+        if (METRICS is not None):
+            if (isinstance(METRICS, str)):
+                self.metrics_server = MMD_Metrics.MetricsServer(self.mmd.metrics, unix_socket=METRICS)
+            else:
+                self.metrics_server = MMD_Metrics.MetricsServer(self.mmd.metrics, port=METRICS)
+            self.metrics_server.start()
+            logger.info("Metrics served at %s", self.metrics_server.address)
+        self.control_server = None
+        if (CONTROL is not None):
+            self.invoker = GuiInvoker()
+            if (isinstance(CONTROL, str)):
+                self.control_server = MMD_Server.ControlServer(self, unix_socket=CONTROL, invoke=self.invoker)
+            else:
+                self.control_server = MMD_Server.ControlServer(self, port=CONTROL, invoke=self.invoker)
+            self.control_server.start()
+            self.mmd.publisher.add_subscriber(self.control_server.publish)
+            logger.info("Remote control served at %s", self.control_server.address)
         
         layout = QGridLayout()
         layout.addWidget(self.gui, 0, 0)
@@ -294,17 +863,28 @@ class MainWindow(QMainWindow):
         self.setCentralWidget(widget)
         self.setWindowTitle("Micro-Motion Detector")
 
+    def closeEvent(self, event):
+        self.mmd.stop_reader()
+        self.mmd.close_shared()
+        if (self.dev is not None):
+            XEM7305_MicroMotion_Detector.release_detector(self.dev)
+        if (self.metrics_server is not None):
+            self.metrics_server.stop()
+        if (self.control_server is not None):
+            self.control_server.stop()
+        super(MainWindow, self).closeEvent(event)
+
     def getDev(self):
         """ To get the FPGA device """
         if (SIMULATE != True):
-            dev = XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(bit_file='micromotion_detector.bit')
+            if (EMULATE == True):
+                dev = XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(bit_file='micromotion_detector.bit', device=XEM7305_Emulator.FrontPanelEmulator(fine_bits=FINE_BITS), **DRIVER_OPTIONS)
+            elif (COSIM == True):
+                dev = XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(bit_file='micromotion_detector.bit', device=XEM7305_Cosim.FrontPanelCosim(fine_bits=FINE_BITS), **DRIVER_OPTIONS)
+            else:
+                dev = XEM7305_MicroMotion_Detector.get_detector(bit_file='micromotion_detector.bit', **DRIVER_OPTIONS) # opened once per process
             return dev
     
-    def clrDev(self):
-        """ To clear the FPGA device """
-        if (SIMULATE != True):
-            self.dev.clear_dev()
-
     def getMMD(self):
         """ To get the Micro-Motion Detector """
         mmd = MMD()
@@ -317,6 +897,11 @@ class MainWindow(QMainWindow):
         self.settingUseCondTime = self.ckbTimeStop.isChecked()
         self.settingCondAnd = self.rdbCondAnd.isChecked() 
         self.settingCondOr = self.rdbCondOr.isChecked()
+        self.settingHistOnFPGA = self.ckbHistOnFPGA.isChecked()
+        self.settingTimestamp = self.ckbTimestamp.isChecked()
+        self.settingWide = self.ckbWide.isChecked()
+        self.settingNewSegment = self.ckbNewSegment.isChecked()
+        self.settingResume = self.ckbResume.isChecked()
         try:
             stop_cnt = int(self.leCountStop.text())
         except ValueError:
@@ -333,18 +918,14 @@ class MainWindow(QMainWindow):
             stop_time = 3000
         self.settingStopTime = stop_time
         self.leTimeStop.setText(str( self.settingStopTime))
-        if (DEBUG):
-            self.debugInfo()
+        self.debugInfo()
         
     def start(self):
         """ Start fetching data from the FPGA to draw the graph. """
-        self.clrDev()
+        self.mmd.stop_reader() # the device is used by this thread from here
 
         # get settings, and calculate all configurations needed 
         self.calcConfig() 
-
-        if (DEBUG == True) :
-            self.debugInfo()
         
         # default values will be kept for simulation
         self.TTLPeriod = SIZE_BINS_DEFAULT
@@ -353,35 +934,40 @@ class MainWindow(QMainWindow):
             mydev = None 
         else:
             mydev = self.dev
-            # probe the RF trigger TTL and PMT signals
-            print(ALARM_PROBING)
+            # probe the RF trigger TTL and PMT signals, from the counters: the device is reset once, by start_device
+            logger.info(ALARM_PROBING)
             self.TTLPeriod, self.tdiffCountIncr, self.fifoReadCountIncr = self.probeTTLandPMT() 
             readyToDetect = True
             if (self.TTLPeriod <=0  or self.tdiffCountIncr <=0): # no signals
                 alarm_tmp = ALARM_NO_SIGNALS
                 readyToDetect = False
-            elif (self.fifoReadCountIncr <= 0 and self.tdiffCountIncr >= 130000): # Too many photons arriving in an update interval. Fifo write depth is 131072.
+            elif (self.tdiffCountIncr >= 130000): # Too many photons arriving in an update interval. Fifo write depth is 131072 bytes, a byte per time difference.
                 alarm_tmp = ALARM_TOO_MANY_PHOTON 
                 readyToDetect = False
             if (not readyToDetect ):
-                print(alarm_tmp)
+                logger.warning(alarm_tmp)
                 self.lblAlarm.setText(alarm_tmp)
                 self.lblAlarm.setStyleSheet("background-color: Orange")
-                if (DEBUG):
-                    print(self.TTLPeriod, self.tdiffCountIncr, self.fifoReadCountIncr) # debug
+                logger.debug("TTLPeriod %d, tdiffCountIncr %d, fifoReadCountIncr %d", self.TTLPeriod, self.tdiffCountIncr, self.fifoReadCountIncr)
                 return # Not ready. No signal, or too many photons. Exit the function. 
-            if (DEBUG): 
-                print(self.TTLPeriod, self.tdiffCountIncr, self.fifoReadCountIncr) # debug
+            logger.debug("TTLPeriod %d, tdiffCountIncr %d, fifoReadCountIncr %d", self.TTLPeriod, self.tdiffCountIncr, self.fifoReadCountIncr)
+            if (self.TTLPeriod > 255 and not (self.settingWide or self.settingHistOnFPGA)):
+                logger.warning(ALARM_NEED_WIDE) # the 8-bit time differences wrap, the histogram is aliased
                 
                 
         #Ready to detect. To initiate the FPGA device, fetch its output to update the plot
         self.fifoReadCountIncr = (self.fifoReadCountIncr // MIN_PIPEOUT_LEN_IN_WORD) * MIN_PIPEOUT_LEN_IN_WORD # MIN_PIPEOUT_LEN_IN_WORD = 4. Pipeout length should be multiple of 16 in bytes (char) for opal kelly API usb3.0. Here fifo read bus is PIPEOUT_BUS_WIDTH=4 bytes wide, so that this length must be multiple of 16/4 = 4. Because the photon arriving rate might change, this pipeout length is continously adjusted.
-        if (DEBUG): 
-            print("pipeout length: ", self.fifoReadCountIncr)
+        logger.debug("pipeout length: %d", self.fifoReadCountIncr)
             
         # Detecting
-        self.mmd.start_mmd(dev=mydev, pipeOutLen=self.fifoReadCountIncr, updateInterval=self.settingUpdateInterval, size_bins=self.TTLPeriod, useCondCnt=self.settingUseCondCount, useCondTime=self.settingUseCondTime, condCnt=self.settingStopCnt, condTime=self.settingStopTime, condOr=self.settingCondOr) 
-        print(ALARM_DETECTING)
+        resume = None
+        if (self.settingResume):
+            resume = MMD_Checkpoint.load(CHECKPOINT_FILE)
+            if (resume is None):
+                logger.warning("No checkpoint in %s, a new histogram is started", CHECKPOINT_FILE)
+        self.mmd.newSegment = self.settingNewSegment
+        self.mmd.start_mmd(dev=mydev, pipeOutLen=self.fifoReadCountIncr, updateInterval=self.settingUpdateInterval, size_bins=self.TTLPeriod, useCondCnt=self.settingUseCondCount, useCondTime=self.settingUseCondTime, condCnt=self.settingStopCnt, condTime=self.settingStopTime, condOr=self.settingCondOr, histOnFPGA=self.settingHistOnFPGA, timestamp=self.settingTimestamp, wide=self.settingWide, channels=CHANNELS, gate=GATE, resume=resume) 
+        logger.info(ALARM_DETECTING)
         self.lblAlarm.setText(ALARM_DETECTING)
         self.lblAlarm.setStyleSheet("background-color: LightGreen") # LightYellow, Orange, Coral, Red
 
@@ -391,53 +977,137 @@ class MainWindow(QMainWindow):
             To probe the necessory input signals (RF trigger TTL and PMT pulse).
             If continously probed signals and the data is good for Micro-Motion Detecting, return 3 parameters to the detector (they should be all positive). 
             Otherwise, if no good signals probed for 20 times, time out and return 3 parameters with negtive or zero values to indicate the status.
+            The device is not reset: the counts are taken relative to the previous probe, whatever is left in the FIFO,
+            and the fifo length is the FIFO words of the time differences of an update interval, a byte per time difference.
         """
         TTLPeriod = -1
         tdiffCountIncr = -1
         fifoReadCountIncr = -1
-        pre_probed = False
         n_probe = 0
-        photon_cnt = 0
-        tdiff_cnt = 0
-        TTL_prd = 0
-        fifo_r_cnt = 0
-        pre_tdiff_cnt = 0
-        pre_TTL_prd = 0
-        pre_fifo_r_cnt = 0
-        self.dev.reset_dev()
+        photon_cnt, pre_tdiff_cnt, pre_TTL_prd, fifo_r_cnt = self.dev.probe_dev() # the counts to start from
         while (n_probe < N_MAX_PROBE):
-            # print(n_probe, pre_photon_cnt, pre_tdiff_cnt, pre_TTL_prd, pre_fifo_r_cnt, pre_probed) # for debug
+            logger.debug("probe # %d: pre_tdiff_cnt %d, pre_TTL_prd %d", n_probe, pre_tdiff_cnt, pre_TTL_prd)
             n_probe = n_probe + 1
             time.sleep(self.settingUpdateInterval / 1000.)
             photon_cnt, tdiff_cnt, TTL_prd, fifo_r_cnt = self.dev.probe_dev()
-            # print(photon_cnt, tdiff_cnt, TTL_prd, fifo_r_cnt) # for debug
-            if (tdiff_cnt > 0 and TTL_prd > 0 and fifo_r_cnt > 0): # Signals probed
-                if (pre_probed == True and TTL_prd == pre_TTL_prd): # Probed again, and signals are good. 
-                    TTLPeriod = TTL_prd  # to be used as size_bins
-                    tdiffCountIncr = tdiff_cnt - pre_tdiff_cnt  # photon count in the interval
-                    fifoReadCountIncr = fifo_r_cnt - pre_fifo_r_cnt # to be used as pipeout length
-                    break # probe finished
-                pre_probed = True  # store the previous probed values
-                pre_tdiff_cnt = tdiff_cnt
-                pre_TTL_prd = TTL_prd
-                pre_fifo_r_cnt = fifo_r_cnt
+            logger.debug("probed: photon_cnt %d, tdiff_cnt %d, TTL_prd %d, fifo_r_cnt %d", photon_cnt, tdiff_cnt, TTL_prd, fifo_r_cnt)
+            incr = (tdiff_cnt - pre_tdiff_cnt) & 0xFFFFFFFF # the 32-bit counter may wrap
+            if (incr > 0 and TTL_prd > 0 and TTL_prd == pre_TTL_prd): # time differences in this interval, and the period of the previous probe
+                TTLPeriod = TTL_prd  # to be used as size_bins
+                tdiffCountIncr = incr  # photon count in the interval
+                fifoReadCountIncr = incr // PIPEOUT_BUS_WIDTH # to be used as pipeout length
+                break # probe finished
+            pre_tdiff_cnt = tdiff_cnt  # store the previous probed values
+            pre_TTL_prd = TTL_prd
         return TTLPeriod, tdiffCountIncr, fifoReadCountIncr
 
+    def showHealth(self, event):
+        """ Show a change of the signals while detecting (MMD_Health.HealthEvent). """
+        if (event.state == MMD_Health.OK):
+            self.lblAlarm.setText(ALARM_DETECTING)
+            self.lblAlarm.setStyleSheet("background-color: LightGreen")
+            return
+        alarm_tmp = event.message
+        if (event.state == MMD_Health.TTL_CHANGED and not self.mmd.newSegment):
+            alarm_tmp = alarm_tmp + "Paused until it is back. "
+        self.lblAlarm.setText(alarm_tmp)
+        self.lblAlarm.setStyleSheet("background-color: Orange")
+
     def debugInfo(self):
-        print("self.settingUpdateInterval ",self.settingUpdateInterval)
-        print("self.settingCondAnd ", self.settingCondAnd)
-        print("self.settingCondOr ", self.settingCondOr)
-        print("self.settingStopCnt ", self.settingStopCnt)
-        print("self.settingStopTime ", self.settingStopTime)
-        print("self.settingUseCondCount ", self.settingUseCondCount)
-        print("self.settingUseCondTime ", self.settingUseCondTime)
+        logger.debug("settingUpdateInterval %s, settingCondAnd %s, settingCondOr %s, settingStopCnt %s, settingStopTime %s, settingUseCondCount %s, settingUseCondTime %s, settingHistOnFPGA %s, settingTimestamp %s, settingWide %s, settingNewSegment %s", 
+                     self.settingUpdateInterval, self.settingCondAnd, self.settingCondOr, self.settingStopCnt, self.settingStopTime, self.settingUseCondCount, self.settingUseCondTime, self.settingHistOnFPGA, self.settingTimestamp, self.settingWide, self.settingNewSegment)
 
     def stop(self):
         self.mmd.stop_update()
-        print(ALARM_STPPED)
+        if (PROFILE and self.mmd.profiler.n_tick > 0):
+            self.mmd.profiler.dump(PROFILE_DUMP_FILE)
+            logger.info("Profile written to %s", PROFILE_DUMP_FILE)
+        logger.info(ALARM_STPPED)
         self.lblAlarm.setText(ALARM_STPPED)
         self.lblAlarm.setStyleSheet("background-color: LightGray")
         
+    def remote_set_conditions(self, update_interval=None, use_cond_cnt=None, cond_cnt=None, use_cond_time=None, cond_time=None, cond_or=None):
+        """ Set the widgets as a user would, then validate them by calcConfig(). Called by the remote control server in the GUI thread. """
+        if (update_interval is not None):
+            self.sbxUpdateInterval.setValue(int(update_interval))
+        if (use_cond_cnt is not None):
+            self.ckbCountStop.setChecked(bool(use_cond_cnt))
+        if (cond_cnt is not None):
+            self.leCountStop.setText(str(int(cond_cnt)))
+        if (use_cond_time is not None):
+            self.ckbTimeStop.setChecked(bool(use_cond_time))
+        if (cond_time is not None):
+            self.leTimeStop.setText(str(int(cond_time)))
+        if (cond_or is not None):
+            self.rdbCondOr.setChecked(bool(cond_or))
+            self.rdbCondAnd.setChecked(not cond_or)
+        self.calcConfig()
+        return self.remote_status()['settings']
+
+    def remote_start(self, **settings):
+        self.remote_set_conditions(**settings)
+        self.start()
+        return self.mmd.is_detecting()
+
+    def remote_stop(self):
+        self.stop()
+        return True
+
+    def setDisplay(self):
+        """ Also while detecting: measure the background while the beam is blocked, plot the corrected histogram, and the bins per step. """
+        self.mmd.background = self.ckbBackground.isChecked()
+        self.mmd.showCorrected = self.ckbCorrected.isChecked()
+        self.mmd.rebinFactor = self.sbxRebin.value()
+
+    def remote_set_background(self, blocked):
+        self.ckbBackground.setChecked(bool(blocked))
+        return self.mmd.background
+
+    def remote_corrected(self):
+        mmd = self.mmd
+        if (mmd.corrector is None):
+            return {'hist': [], 'background_time': 0., 'fit': None}
+        fit = mmd.corrector.fit(mmd.hist, mmd.time_detected * 1e-3, N_PERIOD)
+        return {'hist': mmd.corrected_histogram().tolist(), 'background_time': mmd.corrector.background_time, 
+                'fit': {name: float(value) for name, value in fit.items()}}
+
+    def remote_histogram(self, factor):
+        """ The histogram rebinned by factor, from the pyramid. edges: the first bin of each group, and size_bins. """
+        mmd = self.mmd
+        if (mmd.pyramid is None):
+            return {'seq': mmd.publisher.seq, 'factor': factor, 'edges': [], 'hist': []}
+        return {'seq': mmd.publisher.seq, 'factor': factor, 'edges': mmd.pyramid.edges(factor).tolist(), 'hist': mmd.pyramid.rebin(factor).tolist()}
+
+    def remote_select_channel(self, channel):
+        self.mmd.select_channel(channel)
+        return self.mmd.channels[self.mmd.channel]
+
+    def remote_channels(self):
+        mmd = self.mmd
+        hists = [mmd.hist] if mmd.channel_hist is None else mmd.channel_hist
+        return {'channels': mmd.channels, 'hists': [np.asarray(h, dtype=np.int64).tolist() for h in hists]}
+
+    def remote_segments(self):
+        """ The previous histograms, one per RF trigger TTL period (newSegment), oldest first; the current one is not included. """
+        segments = []
+        for ttl_period, hist in self.mmd.segments:
+            segment = {'ttl_period': int(ttl_period)}
+            if (isinstance(hist, np.ndarray)):
+                segment['hist'] = hist.tolist()
+            else:
+                segment['hist'], segment['channel_hists'] = hist[0].tolist(), hist[1].tolist()
+            segments.append(segment)
+        return {'segments': segments, 'channels': self.mmd.channels}
+
+    def remote_status(self):
+        mmd = self.mmd
+        return {'detecting': mmd.is_detecting(), 'alarm': self.lblAlarm.text(), 'seq': mmd.publisher.seq, 'n_update': mmd.n_update, 
+                'time_detected': mmd.time_detected, 'cnt_detected': int(mmd.cnt_detected), 'size_bins': int(mmd.size_bins), 
+                'channels': mmd.channels, 'channel': mmd.channel, 'background': mmd.background,
+                'settings': {'update_interval': self.settingUpdateInterval, 'use_cond_cnt': self.settingUseCondCount, 'cond_cnt': self.settingStopCnt, 
+                             'use_cond_time': self.settingUseCondTime, 'cond_time': self.settingStopTime, 'cond_or': self.settingCondOr},
+                'metrics': {name: float(mmd.metrics.get(name)) for name, _, _ in MMD_Metrics.METRICS}}
+
     def createGUI(self):
         gui = QWidget()
         layout = QGridLayout()
@@ -497,7 +1167,7 @@ class MainWindow(QMainWindow):
         self.sbxUpdateInterval = QSpinBox()
         self.sbxUpdateInterval.setRange(100, 1000)
         self.sbxUpdateInterval.setSingleStep(100)
-        self.sbxUpdateInterval.setValue(200)
+        self.sbxUpdateInterval.setValue(UPDATE_INTERVAL_DEFAULT)
         self.sbxUpdateInterval.setPrefix("Histogram Update Interval:     ")
         self.sbxUpdateInterval.setSuffix("     (ms)")
         self.sbxUpdateInterval.valueChanged.connect(self.calcConfig)
@@ -507,6 +1177,36 @@ class MainWindow(QMainWindow):
         rowUpdateInterval.addWidget(lblSpace)
         rowUpdateInterval.stretch(1)
         rowUpdateInterval.addWidget(lblSpace)
+        self.ckbHistOnFPGA = QCheckBox("Accumulate Histogram on FPGA (For High Photon Rates)")
+        self.ckbHistOnFPGA.setChecked(False)
+        rowUpdateInterval.addWidget(self.ckbHistOnFPGA)
+        self.ckbTimestamp = QCheckBox("Timestamped Events (Recorded to %s)" % EVENTS_FILE)
+        self.ckbTimestamp.setChecked(False)
+        rowUpdateInterval.addWidget(self.ckbTimestamp)
+        self.ckbWide = QCheckBox("16-bit Time Differences (For TTL Periods >= 256 Clocks)")
+        self.ckbWide.setChecked(False)
+        rowUpdateInterval.addWidget(self.ckbWide)
+        self.ckbNewSegment = QCheckBox("New Histogram on TTL Period Change")
+        self.ckbNewSegment.setChecked(False)
+        rowUpdateInterval.addWidget(self.ckbNewSegment)
+        self.ckbBackground = QCheckBox("Beam Blocked (Measure Background)")
+        self.ckbBackground.setChecked(False)
+        self.ckbBackground.stateChanged.connect(self.setDisplay)
+        rowUpdateInterval.addWidget(self.ckbBackground)
+        self.ckbCorrected = QCheckBox("Show Corrected Histogram (Dead Time, Background)")
+        self.ckbCorrected.setChecked(False)
+        self.ckbCorrected.stateChanged.connect(self.setDisplay)
+        rowUpdateInterval.addWidget(self.ckbCorrected)
+        self.sbxRebin = QSpinBox()
+        self.sbxRebin.setRange(1, 64)
+        self.sbxRebin.setValue(1)
+        self.sbxRebin.setPrefix("Display:  ")
+        self.sbxRebin.setSuffix("  Bins per Step")
+        self.sbxRebin.valueChanged.connect(self.setDisplay)
+        rowUpdateInterval.addWidget(self.sbxRebin)
+        self.ckbResume = QCheckBox("Resume from Checkpoint (%s)" % CHECKPOINT_FILE)
+        self.ckbResume.setChecked(RESUME)
+        rowUpdateInterval.addWidget(self.ckbResume)
         layout.addLayout(rowUpdateInterval, 2, 0)
         layout.addWidget(QLabel("      "), 3, 0)
         
@@ -528,20 +1228,71 @@ class MainWindow(QMainWindow):
 
 # A sample of the usage of this class.
 if __name__ == '__main__':
-    # using arguments in python command line to enable debug.
+    # using arguments in python command line to enable debug messages.
     if 'DEBUG' in sys.argv: 
-        DEBUG = True
+        MMD_Logging.setup_logging(logging.DEBUG)
     else:
-        DEBUG = False
+        MMD_Logging.setup_logging(logging.INFO)
     # using arguments in python command line to choose the simulator instead of the real detector.
     if 'SIMU' in sys.argv:
         SIMULATE = True
     else:
         SIMULATE = False
+    # using arguments in python command line to run the real detector code path with an emulated FPGA board (XEM7305_Emulator).
+    if 'EMULATE' in sys.argv:
+        EMULATE = True
+    # using arguments in python command line to run the real detector code path with the firmware RTL simulated by Verilator (XEM7305_Cosim).
+    if 'COSIM' in sys.argv:
+        COSIM = True
+    # using arguments in python command line to time the stages of each update, shown on the graph and written to PROFILE_DUMP_FILE.
+    if 'PROFILE' in sys.argv:
+        PROFILE = True
+    # using arguments in python command line to continue the histogram and the stop conditions of the last checkpoint (CHECKPOINT_FILE) at Start.
+    if 'RESUME' in sys.argv:
+        RESUME = True
+    # using arguments in python command line to serve live statistics: METRICS (localhost:9105), METRICS=<port> or METRICS=<unix socket path>,
+    # and the remote control: CONTROL (localhost:9106), CONTROL=<port> or CONTROL=<unix socket path>.
+    # SHARE or SHARE=<name>: publish the histogram into a shared memory block for the other processes (MMD_SharedMemory).
+    # FINE=<n>: the emulated or co-simulated firmware has sub-clock resolution, c_clk / 2^n in the histogram mode.
+    # CHANNELS=<label>,<label>,...: separate histograms, chosen by the remote command select_channel, or with GATE=<ms> (timestamped events)
+    # alternating in windows of GATE ms.
+    for arg in sys.argv:
+        if arg == 'METRICS':
+            METRICS = MMD_Metrics.METRICS_PORT_DEFAULT
+        elif arg.startswith('METRICS='):
+            METRICS = int(arg[8:]) if arg[8:].isdigit() else arg[8:]
+        elif arg == 'CONTROL':
+            CONTROL = MMD_Server.CONTROL_PORT_DEFAULT
+        elif arg.startswith('CONTROL='):
+            CONTROL = int(arg[8:]) if arg[8:].isdigit() else arg[8:]
+        elif arg == 'SHARE':
+            SHARE = MMD_SharedMemory.SHM_NAME_DEFAULT
+        elif arg.startswith('SHARE='):
+            SHARE = arg[6:]
+        elif arg.startswith('FINE='):
+            FINE_BITS = int(arg[5:])
+        elif arg.startswith('CHANNELS='):
+            CHANNELS = arg[9:].split(',')
+        elif arg.startswith('GATE='):
+            GATE = float(arg[5:])
+
+    # CONFIG=<path>: a configuration profile (TOML or JSON, see MMD_Config), MMD_Config.CONFIG_FILE if it exists.
+    # section.name=value: a setting of the profile, e.g. gui.redraw_time=30 driver.reader_max_bytes=0x2000000.
+    config_file = MMD_Config.CONFIG_FILE if os.path.exists(MMD_Config.CONFIG_FILE) else None
+    for arg in sys.argv:
+        if arg.startswith('CONFIG='):
+            config_file = arg[7:]
+    try:
+        apply_config(MMD_Config.load(config_file, MMD_Config.option_args(sys.argv[1:])))
+    except MMD_Config.ConfigError as e:
+        sys.exit("Error: %s" % e)
 
     # Start the program with the GUI
     app = QApplication(sys.argv)
-    win = MainWindow()
+    try:
+        win = MainWindow()
+    except XEM7305_MicroMotion_Detector.DetectorError as e: # no board, or it can't be opened after the retries
+        sys.exit("Error: %s" % e)
     win.show()
     sys.exit(app.exec())
 
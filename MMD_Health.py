@@ -0,0 +1,112 @@
+"""
+Module MMD_Health
+
+Signal health of the Micro-Motion Detector while detecting. probeTTLandPMT checks the RF trigger TTL and
+the PMT pulses once before a run; HealthMonitor keeps checking them at every update tick, from the status
+the tick reads anyway (photon count, time difference count, RF trigger TTL period), so no USB transaction is added.
+States, reported as events when they change (TTL_CHANGED also when the new period changes again):
+    OK:          the signals look right
+    TTL_CHANGED: the RF trigger TTL period differs from the one of the histogram, the same for CONFIRM_TICKS ticks in a row
+    NO_TTL:      photons are counted, but no time difference for STALL_TIME (the RF trigger is gone)
+    NO_PHOTONS:  the photon count does not move for STALL_TIME (PMT off, or the beam blocked)
+accumulate is False from the first tick with another TTL period, the caller should not add that data to the
+histogram, whose bins are for the old period. The stalls bring no data, they only raise events.
+
+Usage:
+    health = HealthMonitor(ttl_period=107)
+    for event in health.check(photon_cnt, tdiff_cnt, TTL_prd):   # at each update tick
+        print(event.state, event.message)
+    if (health.accumulate):
+        hist = hist + hist_tmp
+    health.reset(ttl_period=214)     # a new histogram for another period, or the device was restarted
+"""
+
+import time
+from collections import namedtuple
+
+OK = 'ok'
+TTL_CHANGED = 'ttl_changed'
+NO_TTL = 'no_ttl'
+NO_PHOTONS = 'no_photons'
+MESSAGES = {
+    OK: "Signals OK, RF trigger TTL period %d",
+    TTL_CHANGED: "RF trigger TTL period changed to %d ! ",
+    NO_TTL: "No RF trigger TTL ! (last period %d)",
+    NO_PHOTONS: "No PMT pulses ! (RF trigger TTL period %d)",
+}
+CONFIRM_TICKS = 2 # a new TTL period is reported after 2 ticks in a row, one tick may catch the change halfway
+STALL_TIME = 5. # unit: s. Long enough for the lowest photon rates (1/s).
+
+HealthEvent = namedtuple('HealthEvent', ['state', 'ttl_period', 'message'])
+
+class HealthMonitor:
+    """ Per-tick checks of the RF trigger TTL period and the counters. A few integer comparisons per tick. """
+    def __init__(self, ttl_period, confirm_ticks=CONFIRM_TICKS, stall_time=STALL_TIME):
+        self.confirm_ticks = confirm_ticks
+        self.stall_time = stall_time
+        self.reset(ttl_period)
+
+    def reset(self, ttl_period=None):
+        """ Start again, e.g. with the period of a new histogram, or after the counters of the device restarted. """
+        if (ttl_period is not None):
+            self.ttl_period = ttl_period # of the histogram being accumulated
+        self.state = OK
+        self.accumulate = True
+        self._pre = None # photon count, tdiff count of the previous tick
+        self._t_photon = self._t_tdiff = None # the last time each count moved
+        self._other_period = None # the TTL period of the ticks in a row with another period than the histogram's
+        self._n_other_period = 0
+        self._reported_period = self.ttl_period # of the last event
+
+    def check(self, photon_cnt, tdiff_cnt, ttl_period, now=None):
+        """ Check the status of a tick. Return the list of HealthEvent, empty unless the state changed. """
+        if (now is None):
+            now = time.monotonic()
+        if (self._pre is None or photon_cnt != self._pre[0]):
+            self._t_photon = now
+        if (self._pre is None or tdiff_cnt != self._pre[1] or photon_cnt == self._pre[0]):
+            self._t_tdiff = now # NO_TTL only while photons come
+        self._pre = (photon_cnt, tdiff_cnt)
+        # 0: no TTL since the last reset of the device, the register keeps the last period otherwise
+        if (ttl_period != 0 and ttl_period != self.ttl_period):
+            if (ttl_period == self._other_period):
+                self._n_other_period = self._n_other_period + 1
+            else: # another period, or a new one while already changed
+                self._other_period = ttl_period
+                self._n_other_period = 1
+        else:
+            self._other_period = None
+            self._n_other_period = 0
+        self.accumulate = self._n_other_period == 0
+
+        if (now - self._t_photon >= self.stall_time):
+            state, period = NO_PHOTONS, self.ttl_period
+        elif (now - self._t_tdiff >= self.stall_time):
+            state, period = NO_TTL, self.ttl_period
+        elif (self._n_other_period >= self.confirm_ticks):
+            state, period = TTL_CHANGED, ttl_period
+        elif (self._n_other_period > 0):
+            return [] # maybe a glitch, wait for the next tick
+        else:
+            state, period = OK, self.ttl_period
+        if (state == self.state and period == self._reported_period):
+            return []
+        self.state = state
+        self._reported_period = period
+        return [HealthEvent(state, period, MESSAGES[state] % period)]
+
+
+if __name__ == '__main__':
+    health = HealthMonitor(ttl_period=107, stall_time=1.)
+    photon, tdiff, t = 0, 0, 0.
+    n_accumulated = 0
+    for k in range(30):
+        t = t + 0.2
+        ttl = 107 if k < 22 else (214 if k < 26 else 321) # the RF drive frequency is lowered in two steps
+        photon = photon + 100
+        if (k < 10 or k >= 17): # the RF trigger is gone meanwhile
+            tdiff = tdiff + 90
+        for event in health.check(photon, tdiff, ttl, now=t):
+            print("t = %.1f s: %s" % (t, event.message))
+        n_accumulated = n_accumulated + health.accumulate
+    print("%d of 30 ticks accumulated" % n_accumulated)
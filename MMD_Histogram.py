@@ -0,0 +1,405 @@
+"""
+Module MMD_Histogram
+
+Histogram utilities of the Micro-Motion Detector.
+
+Delta encoding: most update ticks change only a few bins of the histogram, so instead of the full array
+a DeltaPublisher emits a packet with the changed bins only, and a DeltaDecoder rebuilds the exact histogram.
+Packet format (all integers are LEB128 varints, packed and unpacked with numpy):
+    keyframe:  b'K' seq size_bins  zigzag(hist[0]) ... zigzag(hist[size_bins-1])
+    delta:     b'D' seq size_bins n  gap[0] ... gap[n-1]  zigzag(incr[0]) ... zigzag(incr[n-1])
+gap[i] is the distance from the previous changed bin (the first from -1), so most gaps fit in one byte.
+Increments are zigzag encoded, because a histogram can also decrease (e.g. cleared by a restart).
+A keyframe is sent every KEYFRAME_INTERVAL packets and whenever the number of bins changes, so that a
+decoder which missed packets (seq not consecutive) is resynchronized.
+
+Time-resolved histograms: with timestamped events (XEM7305_MicroMotion_Detector.load_events), the recorded
+time differences can be histogrammed again in time slices of any width, without measuring again.
+
+Phase bins: phase_bin_index() maps every value of c_diff to its histogram bin, (size_bins - c_diff) mod size_bins,
+so a histogram is one np.bincount, for the FPGA counters and for the 16-bit time differences alike.
+
+Analysis: rebin() groups neighbour bins, fit_modulation() fits the micromotion modulation of the arrival phase,
+a linear least squares fit of a + b cos + c sin at the RF frequency (n_period sine waves per RF trigger TTL).
+
+Pyramid: a HistogramPyramid keeps the histogram at 1, 2, 4, 8 ... bins per group, each level the pairwise sums of the
+level below, updated along with the histogram, so that a display (or a remote client) gets any coarser view without
+summing the full resolution histogram again: a power of 2 is a level, O(size_bins / factor), and other factors are
+differences of the prefix sums, computed once per update.
+
+Corrections: at high photon rates a detected photon hides the photons of the next few clocks (the dead time of the
+detection, which also merges piled-up photons into one), more in the bins after the bright ones, which lowers the
+modulation. dead_time_correct() restores the expected counts bin by bin, and a HistogramCorrector subtracts the dark
+counts and stray light measured while the beam is blocked, scaled to the detecting time.
+
+Incremental modulation: a ModulationEstimator keeps the sums of the counts times 1, cos, sin, cos^2, sin^2 and cos sin
+of the RF phase of each bin, updated by the histogram of each update (one matrix product), so that the modulation and
+its Poisson standard error are known at any update without fitting the accumulated histogram again. It is the
+fit_modulation() of the accumulated histogram (the cos and sin of whole RF periods are orthogonal), and also gives the
+complex amplitude (modulation and phase as one vector), whose noise is not biased by taking a magnitude.
+
+Usage:
+    pub = DeltaPublisher()
+    pub.add_subscriber(lambda seq, packet, hist: send(packet))
+    pub.publish(hist)                # after each update
+    dec = DeltaDecoder()
+    dec.apply(packet)                # dec.hist is the histogram of the publisher
+    hists, t_edges = time_resolved_histogram(ticks, size_bins - diff, size_bins, t_bin=10000)
+    fit = fit_modulation(hist, n_period=5)   # fit['modulation'], fit['phase']
+    pyramid = HistogramPyramid(size_bins=107)
+    pyramid.add(hist_tmp)                    # at each update
+    coarse = pyramid.rebin(4)                # 27 bins of 4, the last one of 3; pyramid.edges(4) are their first bins
+    corrector = HistogramCorrector(size_bins=107, ttl_seconds=107 * 2.17e-9, dead_bins=14)
+    corrector.add_background(hist_tmp, 0.2)  # update ticks with the beam blocked
+    corrected = corrector.correct(hist, 60.)  # the histogram of 60 s of detecting, corrected
+    estimator = ModulationEstimator(size_bins=107, n_period=5)
+    estimator.add(hist_tmp, 0.2)             # at each update
+    estimate = estimator.estimate()          # estimate['modulation'], estimate['error'], estimate['amplitude'] (complex)
+"""
+
+import numpy as np
+
+KEYFRAME_INTERVAL = 50 # a keyframe every 50 packets
+KEYFRAME = b'K'
+MIN_LIVE = 0.05 # the dead time correction divides by the live fraction of a bin, at least this
+DELTA = b'D'
+
+_SHIFTS = np.arange(0, 64, 7, dtype=np.uint64) # bit shifts of the 7-bit groups of a 64-bit varint
+
+def zigzag_encode(values):
+    v = np.asarray(values, dtype=np.int64)
+    return ((v << 1) ^ (v >> 63)).astype(np.uint64)
+
+def zigzag_decode(values):
+    v = np.asarray(values, dtype=np.uint64)
+    return (v >> np.uint64(1)).astype(np.int64) ^ -(v & np.uint64(1)).astype(np.int64)
+
+def pack_varints(values):
+    """ LEB128 encoding of non-negative integers, vectorized. """
+    v = np.asarray(values, dtype=np.uint64).ravel()
+    if (v.size == 0):
+        return b''
+    nbytes = 1 + (v[:, None] >> _SHIFTS[1:] > 0).sum(axis=1) # bytes per value
+    owner = np.repeat(np.arange(v.size), nbytes) # the value of each output byte
+    pos = np.arange(owner.size) - np.repeat(np.cumsum(nbytes) - nbytes, nbytes) # the position of the byte in its value
+    out = (v[owner] >> _SHIFTS[pos]) & np.uint64(0x7F)
+    out[pos < nbytes[owner] - 1] |= np.uint64(0x80) # continuation bit
+    return out.astype(np.uint8).tobytes()
+
+def unpack_varints(data, offset=0):
+    """ Decode all the LEB128 varints in data[offset:]. """
+    b = np.frombuffer(data, dtype=np.uint8, offset=offset)
+    if (b.size == 0):
+        return np.zeros(0, dtype=np.uint64)
+    last = (b & 0x80) == 0 # the last byte of each value
+    if (not last[-1]):
+        raise ValueError("truncated varint")
+    ends = np.flatnonzero(last)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    pos = np.arange(b.size) - np.repeat(starts, ends - starts + 1)
+    terms = (b & 0x7F).astype(np.uint64) << _SHIFTS[pos]
+    return np.add.reduceat(terms, starts)
+
+def encode_keyframe(seq, hist):
+    hist = np.asarray(hist)
+    return KEYFRAME + pack_varints([seq, hist.size]) + pack_varints(zigzag_encode(hist))
+
+def encode_delta(seq, size_bins, bins, incr):
+    bins = np.asarray(bins, dtype=np.int64)
+    gaps = np.diff(bins, prepend=-1)
+    # each part as uint64: int64 with uint64 would concatenate as float64, which rounds the values above 2**53
+    header = np.array([seq, size_bins, bins.size], dtype=np.uint64)
+    return DELTA + pack_varints(np.concatenate((header, gaps.astype(np.uint64), zigzag_encode(incr))))
+
+def phase_bin_index(n_values, size_bins, n_negative=0):
+    """ 
+    Histogram bin of each c_diff value 0 ~ n_values-1: (size_bins - c_diff) mod size_bins. 
+    The last n_negative values are small negative c_diff wrapped by the firmware (sub-clock resolution: 2^fine_bits - 1),
+    c_diff -1 is bin 1. Use as np.bincount(index[diff], minlength=size_bins) or np.bincount(index, weights=counters).
+    """
+    index = (size_bins - np.arange(n_values)) % size_bins
+    if (n_negative > 0):
+        index[n_values - n_negative:] = np.arange(n_negative, 0, -1) % size_bins
+    return index
+
+def time_resolved_histogram(t, bins, size_bins, t_bin, t_start=None):
+    """ 
+    Histogram events in time slices: hists[i, b] is the number of events of bin b with t_start + i*t_bin <= t < t_start + (i+1)*t_bin.
+    t: event times (e.g. timestamp ticks), sorted or not. bins: histogram bin of each event, 0 ~ size_bins-1, others are ignored.
+    Return (hists, t_edges). One np.bincount over all events, whatever the number of slices.
+    """
+    t = np.asarray(t)
+    bins = np.asarray(bins, dtype=np.int64)
+    if (t_start is None):
+        t_start = t.min() if t.size > 0 else 0
+    n_slices = max(int((t.max() - t_start) // t_bin) + 1, 0) if t.size > 0 else 0 # none if every event is before t_start
+    slices = ((t - t_start) // t_bin).astype(np.int64)
+    good = (bins >= 0) & (bins < size_bins) & (slices >= 0)
+    flat = np.bincount(slices[good] * size_bins + bins[good], minlength=n_slices * size_bins)
+    return flat.reshape(n_slices, size_bins), t_start + t_bin * np.arange(n_slices + 1)
+
+def rebin(hist, factor):
+    """ Sum groups of factor neighbour bins. The last group has the remaining bins if size_bins is not a multiple of factor. """
+    hist = np.asarray(hist)
+    if (factor <= 1):
+        return hist
+    return np.add.reduceat(hist, np.arange(0, hist.size, factor))
+
+def fit_modulation(hist, n_period=5, background=0.):
+    """ 
+    Fit hist[k] - background = a + b cos(2 pi n_period k / size_bins) + c sin(2 pi n_period k / size_bins), by linear least squares.
+    Return a dict: mean a, amplitude sqrt(b^2 + c^2), modulation amplitude / a (0 without micromotion), phase atan2(c, b) (unit: rad).
+    """
+    y = np.asarray(hist, dtype=np.float64) - background
+    w = 2 * np.pi * n_period * np.arange(y.size) / y.size
+    design = np.column_stack((np.ones(y.size), np.cos(w), np.sin(w)))
+    (a, b, c), _, _, _ = np.linalg.lstsq(design, y, rcond=None)
+    amplitude = np.hypot(b, c)
+    return {'mean': a, 'amplitude': amplitude, 'modulation': amplitude / a if a > 0 else 0., 'phase': np.arctan2(c, b)}
+
+def dead_time_correct(hist, n_cycles, dead_bins):
+    """ 
+    Correct the photons lost in the dead time: a detected photon hides the photons of the next dead_bins bins.
+    The bins are in the histogram order, where a bin is preceded in time by the next bins (bin = (size_bins - c_diff) mod size_bins),
+    cyclically over the RF trigger TTL. n_cycles: RF trigger TTL periods of the accumulation.
+    The detector is dead in bin b with the probability of a detection in the dead time before it, the detections per TTL period
+    of bins b+1 ~ b+dead_bins-1 and half of bins b and b+dead_bins (a photon arrives anywhere within its bin),
+    return hist / (1 - that probability), float64.
+    """
+    hist = np.asarray(hist, dtype=np.float64)
+    if (n_cycles <= 0 or dead_bins <= 0 or hist.size == 0):
+        return hist
+    rate = hist / n_cycles
+    ext = np.concatenate((rate, np.resize(rate, dead_bins))) # np.resize repeats the TTL period
+    cum = np.concatenate(([0.], np.cumsum(ext)))
+    dead = cum[dead_bins: dead_bins + hist.size] - cum[1: 1 + hist.size] + 0.5 * (rate + ext[dead_bins: dead_bins + hist.size])
+    return hist / np.maximum(1. - dead, MIN_LIVE)
+
+def _pair_sums(x):
+    """ x[0] + x[1], x[2] + x[3], ... The last one alone if x has an odd size. """
+    return np.add.reduceat(x, np.arange(0, x.size, 2)) if x.size > 1 else x.copy()
+
+class HistogramPyramid:
+    """ 
+    Multi-resolution histogram: levels[k] sums 2^k neighbour bins of levels[0], the histogram, up to a single bin.
+    add() updates all the levels with an update's histogram, in O(size_bins) (the levels halve in size).
+    """
+    def __init__(self, size_bins):
+        self.size_bins = size_bins
+        self.levels = [np.zeros(size_bins, dtype=np.int64)]
+        while (self.levels[-1].size > 1):
+            self.levels.append(np.zeros((self.levels[-1].size + 1) // 2, dtype=np.int64))
+        self._cum = None # prefix sums of the histogram, for the factors which are not a power of 2
+
+    @property
+    def hist(self):
+        return self.levels[0]
+
+    def add(self, hist_tmp):
+        delta = np.asarray(hist_tmp, dtype=np.int64)
+        for level in self.levels:
+            level += delta
+            delta = _pair_sums(delta)
+        self._cum = None
+
+    def set(self, hist):
+        """ Replace the histogram, e.g. restored or cleared. """
+        self.levels[0][:] = hist
+        for k in range(1, len(self.levels)):
+            self.levels[k][:] = _pair_sums(self.levels[k - 1])
+        self._cum = None
+
+    def edges(self, factor):
+        """ The first bin of each group of factor bins, and size_bins. """
+        return np.append(np.arange(0, self.size_bins, factor), self.size_bins)
+
+    def rebin(self, factor):
+        """ The sums of groups of factor neighbour bins, as rebin(hist, factor), in O(size_bins / factor). Do not modify it. """
+        factor = max(1, int(factor))
+        k = factor.bit_length() - 1
+        if (factor == 1 << k and k < len(self.levels)):
+            return self.levels[k]
+        if (self._cum is None):
+            self._cum = np.concatenate(([0], np.cumsum(self.levels[0])))
+        edges = self.edges(factor)
+        return self._cum[edges[1:]] - self._cum[edges[:-1]]
+
+class HistogramCorrector:
+    """ 
+    Dead time correction and background subtraction of a histogram, along with its accumulation.
+    The background (beam blocked) is accumulated by add_background() at each update tick, correct() is O(size_bins) at any tick.
+    ttl_seconds: the RF trigger TTL period, unit: s. dead_bins: the dead time in histogram bins, 0 for no dead time correction.
+    """
+    def __init__(self, size_bins, ttl_seconds, dead_bins=0):
+        self.size_bins = size_bins
+        self.ttl_seconds = ttl_seconds
+        self.dead_bins = dead_bins
+        self.clear_background()
+
+    def clear_background(self):
+        self.background = np.zeros(self.size_bins, dtype=np.int64)
+        self.background_time = 0. # unit: s
+
+    def add_background(self, hist_tmp, seconds):
+        """ Add the counts of an update tick while the beam is blocked (dark counts and stray light). """
+        self.background = self.background + hist_tmp
+        self.background_time = self.background_time + seconds
+
+    def background_rate(self):
+        """ The dead time corrected background, unit: photons per bin per second. """
+        if (self.background_time <= 0):
+            return np.zeros(self.size_bins)
+        return dead_time_correct(self.background, self.background_time / self.ttl_seconds, self.dead_bins) / self.background_time
+
+    def correct(self, hist, seconds):
+        """ The dead time corrected histogram of seconds of detecting, minus the background of that time. """
+        corrected = dead_time_correct(hist, seconds / self.ttl_seconds, self.dead_bins)
+        return corrected - self.background_rate() * seconds
+
+    def fit(self, hist, seconds, n_period=5):
+        """ fit_modulation() of the corrected histogram. """
+        return fit_modulation(self.correct(hist, seconds), n_period)
+
+class ModulationEstimator:
+    """ 
+    The micromotion modulation of an accumulating histogram, updated in O(size_bins) per update, with its standard error.
+    The counts of bin k follow mean * (1 + Re(z exp(-i w_k))), w_k = 2 pi n_period k / size_bins: z = x + i y, x and y the
+    modulation along cos and sin, |z| the modulation and arg(z) the phase of fit_modulation().
+    background_rate: unit: photons per bin per second, subtracted from the mean (a flat background has no modulation).
+    """
+    def __init__(self, size_bins, n_period=5, background_rate=0.):
+        self.size_bins = size_bins
+        self.background_rate = background_rate
+        w = 2 * np.pi * n_period * np.arange(size_bins) / size_bins
+        c, s = np.cos(w), np.sin(w)
+        self._basis = np.column_stack((np.ones(size_bins), c, s, c * c, s * s, c * s))
+        self.clear()
+
+    def clear(self):
+        self._sums = np.zeros(6) # counts times 1, cos, sin, cos^2, sin^2, cos sin
+        self.seconds = 0.
+
+    def add(self, hist_tmp, seconds=0.):
+        """ Add the histogram of an update of seconds of detecting. """
+        self._sums = self._sums + np.asarray(hist_tmp, dtype=np.float64) @ self._basis
+        self.seconds = self.seconds + seconds
+
+    def estimate(self):
+        """ 
+        A dict: photons, signal (photons minus the background), amplitude (complex z), modulation |z|, phase arg(z) (unit: rad),
+        and error, the standard error of x and of y (the larger one), from the Poisson noise of the counts. inf before any signal.
+        """
+        n, c, s, cc, ss, cs = self._sums
+        signal = n - self.background_rate * self.size_bins * self.seconds
+        if (signal <= 0):
+            return {'photons': n, 'signal': signal, 'amplitude': 0j, 'modulation': 0., 'phase': 0., 'error': np.inf}
+        z = 2 * complex(c, s) / signal
+        return {'photons': n, 'signal': signal, 'amplitude': z, 'modulation': abs(z), 'phase': np.angle(z),
+                'error': 2 * np.sqrt(max(cc, ss)) / signal}
+
+class DeltaPublisher:
+    """ Turn the histogram of each update into a keyframe or a sparse delta packet, and emit it to the subscribers. """
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        self._keyframe_interval = keyframe_interval
+        self._subscribers = []
+        self._hist = None # the histogram of the last packet
+        self._seq = 0
+        self._force_keyframe = True
+
+    @property
+    def seq(self):
+        return self._seq
+
+    @property
+    def hist(self):
+        return self._hist
+
+    def add_subscriber(self, fn):
+        """ fn(seq, packet, hist) is called for each packet. hist is a new array for each packet, never modified afterwards. """
+        self._subscribers.append(fn)
+
+    def remove_subscriber(self, fn):
+        self._subscribers.remove(fn)
+
+    def has_subscribers(self):
+        return len(self._subscribers) > 0
+
+    def request_keyframe(self):
+        """ Make the next packet a keyframe, e.g. when the histogram is restarted. """
+        self._force_keyframe = True
+
+    def keyframe(self):
+        """ A keyframe of the last published histogram, e.g. for a new subscriber. """
+        if (self._hist is None):
+            return None
+        return encode_keyframe(self._seq, self._hist)
+
+    def publish(self, hist):
+        hist = np.array(hist, dtype=np.int64)
+        self._seq = self._seq + 1
+        pre_hist = self._hist
+        if (self._force_keyframe or pre_hist is None or pre_hist.size != hist.size or self._seq % self._keyframe_interval == 0):
+            packet = encode_keyframe(self._seq, hist)
+            self._force_keyframe = False
+        else:
+            diff = hist - pre_hist
+            bins = np.flatnonzero(diff)
+            packet = encode_delta(self._seq, hist.size, bins, diff[bins])
+        self._hist = hist
+        for fn in self._subscribers:
+            fn(self._seq, packet, hist)
+        return packet
+
+class DeltaDecoder:
+    """ Rebuild the histogram of a DeltaPublisher from its packets. """
+    def __init__(self):
+        self.hist = None
+        self.seq = -1
+        self.synced = False # False until a keyframe, or after a missed packet
+
+    def apply(self, packet):
+        """ Apply a packet. Return True if self.hist is now the histogram of the publisher at packet seq. """
+        kind = packet[:1]
+        v = unpack_varints(packet, 1)
+        seq, size_bins = int(v[0]), int(v[1])
+        if (kind == KEYFRAME):
+            self.hist = zigzag_decode(v[2:2 + size_bins])
+            self.synced = True
+        elif (kind == DELTA):
+            if (not self.synced or seq != self.seq + 1 or self.hist is None or self.hist.size != size_bins):
+                self.synced = False # wait for the next keyframe
+                return False
+            n = int(v[2])
+            bins = np.cumsum(v[3:3 + n].astype(np.int64)) - 1
+            self.hist[bins] += zigzag_decode(v[3 + n:3 + 2 * n])
+        else:
+            raise ValueError("unknown packet type %r" % kind)
+        self.seq = seq
+        return True
+
+
+# here is a demo of this module.
+if __name__ == '__main__':
+    values = np.array([0, 1, 127, 128, 300, 16383, 16384, 2**32, 2**63 - 1], dtype=np.uint64)
+    assert np.array_equal(unpack_varints(pack_varints(values)), values)
+    incr = np.array([0, 1, -1, 5, -300, 2**40, -2**40])
+    assert np.array_equal(zigzag_decode(zigzag_encode(incr)), incr)
+
+    pub = DeltaPublisher()
+    dec = DeltaDecoder()
+    sizes = []
+    pub.add_subscriber(lambda seq, packet, hist: (dec.apply(packet), sizes.append(len(packet))))
+    hist = np.zeros(107, dtype=np.int64)
+    for k in range(200):
+        hist = hist + np.bincount(np.random.randint(0, 107, 10), minlength=107)
+        pub.publish(hist)
+        assert np.array_equal(dec.hist, hist)
+    pyramid = HistogramPyramid(107)
+    pyramid.add(hist)
+    for factor in (1, 2, 3, 4, 10, 64, 107, 200):
+        assert np.array_equal(pyramid.rebin(factor), rebin(hist, factor))
+    estimator = ModulationEstimator(107)
+    estimator.add(hist)
+    assert np.isclose(estimator.estimate()['modulation'], fit_modulation(hist)['modulation'])
+    print("200 ticks rebuilt exactly. mean packet %.1f bytes, keyframe %d bytes, full int64 array %d bytes"
+          % (np.mean(sizes), len(pub.keyframe()), hist.nbytes))
@@ -0,0 +1,121 @@
+"""
+Module MMD_Logging
+
+Logging of the Micro-Motion Detector, cheap enough to stay on while detecting.
+- Messages are formatted lazily: logger.debug("fifo_cnt %d", fifo_cnt) costs almost nothing if DEBUG is off.
+- Every message template is rate limited, so a message logged in each update tick can't flood the console.
+- Records are put into a queue and written by a background thread, so the console I/O and the
+  formatting of big values (e.g. arrays of time differences) are not done in the update tick.
+
+Usage:
+    import MMD_Logging
+    MMD_Logging.setup_logging(logging.DEBUG)
+    logger = logging.getLogger('MMD.GUI')
+    logger.debug("update # %d", n)
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import time
+
+LOGGER_NAME = 'MMD' # parent of the loggers of all modules, e.g. 'MMD.GUI'
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+RATE_LIMIT_COUNT = 5 # at most 5 records of the same message template ...
+RATE_LIMIT_PERIOD = 1.0 # ... per 1 s (unit: s)
+QUEUE_SIZE = 10000 # records waiting for the background thread. Records are dropped if it is full.
+
+_listener = None
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per message template (logger name + unformatted message).
+    The number of suppressed records is reported by the next record passing the filter.
+    """
+    def __init__(self, count=RATE_LIMIT_COUNT, period=RATE_LIMIT_PERIOD):
+        super(RateLimitFilter, self).__init__()
+        self._count = count
+        self._period = period
+        self._buckets = {} # key: (name, msg), value: [tokens, time of the last refill, suppressed records]
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if (bucket is None):
+            bucket = self._buckets[key] = [self._count, now, 0]
+        else:
+            bucket[0] = min(self._count, bucket[0] + (now - bucket[1]) * self._count / self._period)
+            bucket[1] = now
+        if (bucket[0] < 1):
+            bucket[2] = bucket[2] + 1
+            return False
+        bucket[0] = bucket[0] - 1
+        if (bucket[2] > 0):
+            record.msg = "%s  (%d similar messages suppressed)" % (record.msg, bucket[2])
+            bucket[2] = 0
+        return True
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Put records into the queue without formatting them, the background thread formats them.
+    The arguments of a record must not be modified after the logging call.
+    If the queue is full, the record is dropped and counted.
+    """
+    def __init__(self, q):
+        super(LazyQueueHandler, self).__init__(q)
+        self.n_dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.n_dropped = self.n_dropped + 1
+
+def setup_logging(level=logging.INFO, count=RATE_LIMIT_COUNT, period=RATE_LIMIT_PERIOD, handler=None):
+    """
+    Route the 'MMD' loggers through a rate limited queue to a background thread.
+    handler: the handler writing the records, a console handler by default.
+    """
+    global _listener
+    stop_logging()
+    if (handler is None):
+        handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    q = queue.Queue(QUEUE_SIZE)
+    queue_handler = LazyQueueHandler(q)
+    queue_handler.addFilter(RateLimitFilter(count, period))
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.handlers = [queue_handler]
+    logger.setLevel(level)
+    logger.propagate = False
+    _listener = logging.handlers.QueueListener(q, handler)
+    _listener.start()
+    return logger
+
+def stop_logging():
+    """ Flush the queue and stop the background thread. """
+    global _listener
+    if (_listener is not None):
+        _listener.stop()
+        _listener = None
+
+atexit.register(stop_logging)
+
+
+# here is a demo of this module.
+if __name__ == '__main__':
+    setup_logging(logging.DEBUG)
+    logger = logging.getLogger(LOGGER_NAME + '.demo')
+    t0 = time.perf_counter()
+    for k in range(100000):
+        logger.debug("update # %d", k)
+    t1 = time.perf_counter()
+    logger.info("100000 debug calls took %.1f ms", (t1 - t0) * 1000.)
+    time.sleep(1.1)
+    logger.debug("update # %d", -1)
+    stop_logging()
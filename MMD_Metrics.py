@@ -0,0 +1,178 @@
+"""
+Module MMD_Metrics
+
+Live statistics of the Micro-Motion Detector, published in the Prometheus text format.
+The detector updates a MetricsRegistry in each update tick (cheap: a few dict writes under a lock),
+and a MetricsServer answers HTTP requests (GET /metrics) from its own thread, on localhost or a Unix socket,
+so that scraping never runs in, or waits for, the GUI thread.
+
+Usage:
+    registry = MetricsRegistry()
+    registry.update(mmd_photon_rate=1000., mmd_ttl_period=107)
+    server = MetricsServer(registry, port=9105)   # or MetricsServer(registry, unix_socket='/tmp/mmd.sock')
+    server.start()
+    ...                                          # curl http://127.0.0.1:9105/metrics
+    server.stop()
+"""
+
+import os
+import socket
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_HOST = '127.0.0.1' # local only
+METRICS_PORT_DEFAULT = 9105
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# name, type, help
+METRICS = (
+    ('mmd_photon_rate', 'gauge', 'PMT photons per second, from the photon counter.'),
+    ('mmd_tdiff_rate', 'gauge', 'Time differences (photons with a RF trigger TTL) per second.'),
+    ('mmd_ttl_period', 'gauge', 'RF trigger TTL period in sampling clocks.'),
+    ('mmd_fifo_occupancy', 'gauge', 'Words (4 bytes) in the FIFO ready to pipe out.'),
+    ('mmd_read_bytes_per_second', 'gauge', 'Pipe-out throughput in the last update.'),
+    ('mmd_read_bytes_total', 'counter', 'Bytes piped out since the detector started.'),
+    ('mmd_dropped_events_total', 'counter', 'Time differences counted by the FPGA but never read out.'),
+    ('mmd_tick_seconds', 'gauge', 'Duration of the last update tick.'),
+    ('mmd_updates_total', 'counter', 'Update ticks since the detector started.'),
+    ('mmd_detecting', 'gauge', '1 while the detector is updating the histogram, 0 otherwise.'),
+    ('mmd_signals_ok', 'gauge', '1 while the RF trigger TTL period and the counters look right (MMD_Health), 0 otherwise.'),
+    ('mmd_reconnects_total', 'counter', 'Reconnects after the device was disconnected while detecting.'),
+)
+
+class MetricsRegistry:
+    """ Thread-safe values of the metrics, rendered in the Prometheus text format. """
+    def __init__(self, metrics=METRICS):
+        self._lock = threading.Lock()
+        self._kinds = {}
+        self._helps = {}
+        self._values = {}
+        for name, kind, help_text in metrics:
+            self.define(name, kind, help_text)
+
+    def define(self, name, kind='gauge', help_text=''):
+        with self._lock:
+            self._kinds[name] = kind
+            self._helps[name] = help_text
+            self._values[name] = 0
+
+    def set(self, name, value):
+        with self._lock:
+            self._values[name] = value
+
+    def inc(self, name, n=1):
+        with self._lock:
+            self._values[name] = self._values[name] + n
+
+    def update(self, **values):
+        """ Set several metrics at once, e.g. at the end of an update tick. """
+        with self._lock:
+            self._values.update(values)
+
+    def get(self, name):
+        with self._lock:
+            return self._values[name]
+
+    def reset(self):
+        with self._lock:
+            for name in self._values:
+                self._values[name] = 0
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = []
+        for name, value in values.items():
+            lines.append("# HELP %s %s" % (name, self._helps[name]))
+            lines.append("# TYPE %s %s" % (name, self._kinds[name]))
+            lines.append("%s %s" % (name, float(value)))
+        return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if (self.path.split('?')[0] not in ('/', '/metrics')):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # no console output for each scrape
+
+    def address_string(self):
+        return str(self.client_address) # a Unix socket has no (host, port) address
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name, self.server_port = 'localhost', 0 # needed by BaseHTTPRequestHandler
+
+class MetricsServer:
+    """ Serve a MetricsRegistry over HTTP, on localhost:port or on a Unix socket, from a daemon thread. """
+    def __init__(self, registry, port=METRICS_PORT_DEFAULT, unix_socket=None, host=METRICS_HOST):
+        self._registry = registry
+        self._port = port
+        self._unix_socket = unix_socket
+        self._host = host
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def address(self):
+        if (self._httpd is None):
+            return None
+        return self._unix_socket if self._unix_socket else self._httpd.server_address
+
+    def start(self):
+        if (self._httpd is not None):
+            return
+        if (self._unix_socket):
+            if (os.path.exists(self._unix_socket)):
+                os.remove(self._unix_socket) # left by a previous run
+            self._httpd = _UnixHTTPServer(self._unix_socket, _MetricsHandler)
+        else:
+            self._httpd = ThreadingHTTPServer((self._host, self._port), _MetricsHandler)
+            self._httpd.daemon_threads = True
+        self._httpd.registry = self._registry
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='MMD metrics', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if (self._httpd is None):
+            return
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+        if (self._unix_socket and os.path.exists(self._unix_socket)):
+            os.remove(self._unix_socket)
+        self._httpd = None
+        self._thread = None
+
+
+# here is a demo of this module.
+if __name__ == '__main__':
+    import urllib.request
+    registry = MetricsRegistry()
+    registry.update(mmd_photon_rate=12345., mmd_ttl_period=107, mmd_detecting=1)
+    registry.inc('mmd_updates_total')
+    server = MetricsServer(registry, port=0) # port 0: any free port
+    server.start()
+    host, port = server.address
+    print(urllib.request.urlopen('http://%s:%d/metrics' % (host, port)).read().decode())
+    server.stop()
+    if (hasattr(socket, 'AF_UNIX')):
+        server = MetricsServer(registry, unix_socket='mmd_metrics_demo.sock')
+        server.start()
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect('mmd_metrics_demo.sock')
+        client.sendall(b'GET /metrics HTTP/1.0\r\n\r\n')
+        print(client.makefile('rb').read().decode().splitlines()[0])
+        client.close()
+        server.stop()
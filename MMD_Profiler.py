@@ -0,0 +1,156 @@
+"""
+Module MMD_Profiler
+
+Low-overhead per-stage timing of the Micro-Motion Detector acquisition loop.
+Each update tick is split into stages (wire-out read, pipe-out, decode, accumulate, render).
+The duration of every stage is recorded into a fixed-size ring buffer, so that the memory
+and the cost per tick stay constant however long the detector runs.
+
+Usage:
+    prof = StageProfiler()
+    prof.begin_tick()
+    ...                      # read wire-outs
+    prof.mark('wireout')
+    ...                      # pipe out
+    prof.mark('pipeout')
+    prof.end_tick()
+    print(prof.report())
+"""
+
+import time
+import numpy as np
+
+STAGES = ('wireout', 'pipeout', 'decode', 'accumulate', 'render')
+RING_SIZE_DEFAULT = 1024 # the number of ticks kept in the ring buffer
+PERCENTILES = (50, 90, 99)
+
+class StageProfiler:
+    """
+    Per-stage timers of the acquisition loop.
+    A tick is started by begin_tick(), every mark(stage) closes the stage started by the previous mark,
+    and end_tick() stores the whole tick. Only one time.perf_counter() call is spent per stage.
+    """
+    def __init__(self, stages=STAGES, size=RING_SIZE_DEFAULT, enabled=True):
+        self._stages = tuple(stages)
+        self._rows = {stage: i for i, stage in enumerate(self._stages)}
+        self._size = size
+        self._enabled = enabled
+        self._ring = np.zeros((len(self._stages) + 1, size)) # unit: s. The last row is the whole tick.
+        self._n_tick = 0 # the number of ticks recorded since the last clear
+        self._t_start = 0.0
+        self._t_last = 0.0
+        self._cost_per_mark = self._measure_cost()
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, en):
+        self._enabled = en
+
+    @property
+    def stages(self):
+        return self._stages
+
+    @property
+    def n_tick(self):
+        return self._n_tick
+
+    def clear(self):
+        self._ring[:] = 0
+        self._n_tick = 0
+
+    def begin_tick(self):
+        if (not self._enabled):
+            return
+        self._ring[:, self._n_tick % self._size] = 0 # the column of this tick may hold an old one
+        self._t_start = self._t_last = time.perf_counter()
+
+    def mark(self, stage):
+        """ Close the stage which began at the previous begin_tick() or mark(). """
+        if (not self._enabled):
+            return
+        t = time.perf_counter()
+        self._ring[self._rows[stage], self._n_tick % self._size] += t - self._t_last # += : a stage may be marked more than once in a tick
+        self._t_last = t
+
+    def end_tick(self):
+        if (not self._enabled):
+            return
+        col = self._n_tick % self._size
+        self._ring[-1, col] = time.perf_counter() - self._t_start
+        self._n_tick = self._n_tick + 1
+
+    def samples(self, stage=None):
+        """ Durations (unit: s) of the recorded ticks, oldest first. stage=None gives the whole ticks. """
+        row = self._ring[-1] if stage is None else self._ring[self._rows[stage]]
+        if (self._n_tick < self._size):
+            return row[:self._n_tick].copy()
+        col = self._n_tick % self._size
+        return np.roll(row, -col)
+
+    def summary(self):
+        """ Percentiles, mean and max (unit: ms) of every stage and of the whole tick. """
+        result = {}
+        for stage in self._stages + ('tick',):
+            data = self.samples(None if stage == 'tick' else stage) * 1000.
+            if (len(data) == 0):
+                data = np.zeros(1)
+            stat = {'p%d' % p: v for p, v in zip(PERCENTILES, np.percentile(data, PERCENTILES))}
+            stat['mean'] = data.mean()
+            stat['max'] = data.max()
+            result[stage] = stat
+        return result
+
+    def overhead(self):
+        """ Fraction of the mean tick time spent by the profiler itself. """
+        tick = self.samples().mean() if self._n_tick > 0 else 0.
+        if (tick <= 0):
+            return 0.
+        return (len(self._stages) + 2) * self._cost_per_mark / tick
+
+    def report(self):
+        """ A short text table of the summary, used by the overlay and the dump file. """
+        n = min(self._n_tick, self._size)
+        lines = ["ticks: %d (last %d)   profiler overhead: %.3f %%" % (self._n_tick, n, 100. * self.overhead())]
+        lines.append("%-10s %8s %8s %8s %8s %8s" % (('stage (ms)', 'mean') + tuple('p%d' % p for p in PERCENTILES) + ('max',)))
+        for stage, stat in self.summary().items():
+            lines.append("%-10s %8.3f %8.3f %8.3f %8.3f %8.3f" % ((stage, stat['mean']) + tuple(stat['p%d' % p] for p in PERCENTILES) + (stat['max'],)))
+        return "\n".join(lines)
+
+    def dump(self, file_name):
+        """ Write the summary and the raw samples (unit: ms, one tick per line) to a text file. """
+        header = self.report() + "\n" + " ".join(self._stages + ('tick',))
+        data = np.column_stack([self.samples(stage) for stage in self._stages] + [self.samples()]) * 1000.
+        np.savetxt(file_name, data, fmt='%.4f', header=header)
+
+    def _measure_cost(self, n=1000):
+        """ Estimate the cost of a mark(), to report the overhead of the profiler. """
+        enabled = self._enabled
+        self._enabled = True
+        self._t_last = t0 = time.perf_counter()
+        for i in range(n):
+            self.mark(self._stages[0])
+        cost = (time.perf_counter() - t0) / n
+        self._enabled = enabled
+        self._ring[:] = 0
+        return cost
+
+
+# here is a demo of this module.
+if __name__ == '__main__':
+    prof = StageProfiler()
+    for k in range(2000):
+        prof.begin_tick()
+        time.sleep(0.0002)
+        prof.mark('wireout')
+        time.sleep(0.0005)
+        prof.mark('pipeout')
+        np.frombuffer(bytearray(4096), dtype=np.uint8)
+        prof.mark('decode')
+        np.histogram(np.zeros(4096), 107)
+        prof.mark('accumulate')
+        prof.mark('render')
+        prof.end_tick()
+    print(prof.report())
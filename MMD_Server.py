@@ -0,0 +1,367 @@
+"""
+Module MMD_Server
+
+Remote control of the Micro-Motion Detector, so that experiment control software (e.g. a sequencer)
+can drive the detector without clicking the GUI.
+
+The server runs an asyncio event loop in a daemon thread and listens on a local TCP port or a Unix socket.
+Messages are JSON objects, one per line.
+  request:  {"id": 1, "cmd": "start", "args": {"update_interval": 200, "use_cond_cnt": true, "cond_cnt": 50000}}
+  reply:    {"id": 1, "ok": true, "result": ...}   or   {"id": 1, "ok": false, "error": "..."}
+  commands: ping, status, histogram, start, stop, set_conditions, subscribe, unsubscribe, select_channel, channels,
+            set_background, corrected, segments
+  histogram {"factor": 4} returns the histogram rebinned by 4 ({"seq", "factor", "edges", "hist"}), from the histogram pyramid of
+  the detector, O(size_bins / factor). Without a factor, the last published histogram at full resolution.
+  select_channel {"channel": "gate off"} (a label or an index) sends the next updates to that histogram channel,
+  channels returns {"channels": [labels], "hists": [[counters], ...]}, the histogram of each channel.
+  set_background {"blocked": true} sends the next updates to the background while the beam is blocked,
+  corrected returns {"hist": [...], "background_time": s, "fit": {"modulation": ...}}, dead time corrected and background subtracted.
+  segments returns {"segments": [{"ttl_period": 107, "hist": [...], "channel_hists": [[...], ...]}, ...], "channels": [labels]},
+  the previous histograms, one per RF trigger TTL period (new histogram on TTL period change), oldest first.
+Subscribers get the packets of the histogram DeltaPublisher (see MMD_Histogram), base64 encoded:
+a keyframe (the full histogram) first, then one sparse delta per update tick with only the changed bins.
+  {"event": "packet", "seq": 13, "data": "RA0BawIDJQIE"}
+A subscriber too slow to read its packets is resynchronized by a new keyframe instead of buffering without limit.
+
+The controller (the GUI main window) implements remote_start(**settings), remote_stop(), remote_set_conditions(**conditions),
+remote_status(), remote_histogram(factor), remote_select_channel(channel), remote_channels(), remote_set_background(blocked), remote_corrected() and remote_segments(). They are called through invoke(fn), which returns a concurrent.futures.Future, so that the GUI
+can run them in its own thread.
+
+Usage:
+    server = ControlServer(controller, port=9106, invoke=invoker)
+    server.start()
+    mmd.publisher.add_subscriber(server.publish)   # publish(seq, packet, hist) after each update tick
+    ...
+    server.stop()
+"""
+
+import asyncio
+import base64
+import concurrent.futures
+import json
+import os
+import socket
+import threading
+import numpy as np
+import MMD_Histogram
+
+CONTROL_HOST = '127.0.0.1' # local only
+CONTROL_PORT_DEFAULT = 9106
+MAX_WRITE_BUFFER = 1 << 20 # unit: bytes. A subscriber with more unsent data gets a keyframe instead of more deltas.
+SETTING_NAMES = ('update_interval', 'use_cond_cnt', 'cond_cnt', 'use_cond_time', 'cond_time', 'cond_or')
+
+def _call_directly(fn):
+    """ The default invoke: run fn in the server thread. """
+    future = concurrent.futures.Future()
+    try:
+        future.set_result(fn())
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+class _Client:
+    def __init__(self, writer):
+        self.writer = writer
+        self.subscribed = False
+        self.need_keyframe = True
+
+    def send(self, message):
+        self.writer.write((json.dumps(message) + "\n").encode('utf-8'))
+
+    def congested(self):
+        return self.writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER
+
+class ControlServer:
+    """ Asyncio JSON-lines control server of a detector, running in its own thread. """
+    def __init__(self, controller, port=CONTROL_PORT_DEFAULT, unix_socket=None, host=CONTROL_HOST, invoke=None):
+        self._controller = controller
+        self._port = port
+        self._unix_socket = unix_socket
+        self._host = host
+        self._invoke = invoke if invoke is not None else _call_directly
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+        self._clients = set()
+        self._seq = 0
+        self._hist = None # the last published histogram, owned by the event loop thread
+
+    @property
+    def address(self):
+        if (self._server is None):
+            return None
+        return self._unix_socket if self._unix_socket else self._server.sockets[0].getsockname()[:2]
+
+    def start(self):
+        if (self._thread is not None):
+            return
+        self._started.clear()
+        self._thread = threading.Thread(target=self._run, name='MMD control', daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self):
+        if (self._thread is None):
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+
+    def publish(self, seq, packet, hist):
+        """
+        A subscriber of MMD_Histogram.DeltaPublisher, called after each update tick in the thread of the detector.
+        The packet is already encoded there once; the event loop only sends it to the subscribed clients.
+        """
+        loop = self._loop
+        if (loop is None):
+            return
+        if (self._clients):
+            loop.call_soon_threadsafe(self._broadcast, seq, packet, hist)
+        else:
+            loop.call_soon_threadsafe(self._store, seq, hist) # nobody to send to, keep it for 'histogram' and keyframes
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        if (self._unix_socket):
+            if (os.path.exists(self._unix_socket)):
+                os.remove(self._unix_socket) # left by a previous run
+            coro = asyncio.start_unix_server(self._handle_client, path=self._unix_socket)
+        else:
+            coro = asyncio.start_server(self._handle_client, self._host, self._port)
+        self._server = self._loop.run_until_complete(coro)
+        self._started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            for client in list(self._clients):
+                client.writer.close()
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+            self._server = None
+            self._loop = None
+            if (self._unix_socket and os.path.exists(self._unix_socket)):
+                os.remove(self._unix_socket)
+
+    def _store(self, seq, hist):
+        self._seq, self._hist = seq, hist
+
+    def _broadcast(self, seq, packet, hist):
+        self._store(seq, hist)
+        message = None
+        for client in list(self._clients):
+            if (not client.subscribed):
+                continue
+            if (client.congested()):
+                client.need_keyframe = True # skip packets until the client catches up
+            elif (client.need_keyframe and packet[:1] != MMD_Histogram.KEYFRAME):
+                self._send_keyframe(client)
+            else:
+                if (message is None):
+                    message = {'event': 'packet', 'seq': seq, 'data': base64.b64encode(packet).decode('ascii')} # encoded once for all clients
+                client.send(message)
+                client.need_keyframe = False
+
+    def _send_keyframe(self, client):
+        if (self._hist is None):
+            return
+        packet = MMD_Histogram.encode_keyframe(self._seq, self._hist)
+        client.send({'event': 'packet', 'seq': self._seq, 'data': base64.b64encode(packet).decode('ascii')})
+        client.need_keyframe = False
+
+    async def _handle_client(self, reader, writer):
+        client = _Client(writer)
+        self._clients.add(client)
+        try:
+            while True:
+                line = await reader.readline()
+                if (not line):
+                    break
+                reply = await self._dispatch(client, line)
+                client.send(reply)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._clients.discard(client)
+            writer.close()
+
+    async def _dispatch(self, client, line):
+        req_id = None
+        try:
+            request = json.loads(line)
+            req_id = request.get('id')
+            cmd = request['cmd']
+            args = request.get('args') or {}
+            if (cmd == 'ping'):
+                result = 'pong'
+            elif (cmd == 'histogram' and 'factor' in args):
+                factor = int(args['factor'])
+                if (factor < 1):
+                    raise ValueError("factor must be 1 or more")
+                result = await asyncio.wrap_future(self._invoke(lambda: self._controller.remote_histogram(factor)))
+            elif (cmd == 'histogram'):
+                result = {'seq': self._seq, 'hist': [] if self._hist is None else self._hist.tolist()}
+            elif (cmd == 'subscribe'):
+                client.subscribed = True
+                client.need_keyframe = True
+                self._send_keyframe(client)
+                result = True
+            elif (cmd == 'unsubscribe'):
+                client.subscribed = False
+                result = True
+            elif (cmd in ('start', 'set_conditions')):
+                unknown = set(args) - set(SETTING_NAMES)
+                if (unknown):
+                    raise ValueError("unknown settings: %s" % ", ".join(sorted(unknown)))
+                fn = self._controller.remote_start if cmd == 'start' else self._controller.remote_set_conditions
+                result = await asyncio.wrap_future(self._invoke(lambda: fn(**args)))
+            elif (cmd == 'stop'):
+                result = await asyncio.wrap_future(self._invoke(self._controller.remote_stop))
+            elif (cmd == 'status'):
+                result = await asyncio.wrap_future(self._invoke(self._controller.remote_status))
+            elif (cmd == 'select_channel'):
+                result = await asyncio.wrap_future(self._invoke(lambda: self._controller.remote_select_channel(args['channel'])))
+            elif (cmd == 'channels'):
+                result = await asyncio.wrap_future(self._invoke(self._controller.remote_channels))
+            elif (cmd == 'set_background'):
+                result = await asyncio.wrap_future(self._invoke(lambda: self._controller.remote_set_background(args['blocked'])))
+            elif (cmd == 'corrected'):
+                result = await asyncio.wrap_future(self._invoke(self._controller.remote_corrected))
+            elif (cmd == 'segments'):
+                result = await asyncio.wrap_future(self._invoke(self._controller.remote_segments))
+            else:
+                raise ValueError("unknown command: %s" % cmd)
+            return {'id': req_id, 'ok': True, 'result': result}
+        except Exception as e:
+            return {'id': req_id, 'ok': False, 'error': "%s: %s" % (type(e).__name__, e)}
+
+class ControlClient:
+    """ A blocking client of the ControlServer, e.g. for a sequencer script. """
+    def __init__(self, port=CONTROL_PORT_DEFAULT, unix_socket=None, host=CONTROL_HOST, timeout=30.):
+        if (unix_socket):
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(unix_socket)
+        else:
+            self._sock = socket.create_connection((host, port))
+        self._sock.settimeout(timeout)
+        self._file = self._sock.makefile('rb')
+        self._id = 0
+        self._events = [] # events received while waiting for a reply
+        self._decoder = MMD_Histogram.DeltaDecoder() # rebuilds the histogram from the packets
+
+    @property
+    def hist(self):
+        return self._decoder.hist
+
+    @property
+    def seq(self):
+        return self._decoder.seq
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+    def request(self, cmd, **args):
+        self._id = self._id + 1
+        self._sock.sendall((json.dumps({'id': self._id, 'cmd': cmd, 'args': args}) + "\n").encode('utf-8'))
+        while True:
+            message = self._read()
+            if ('event' in message):
+                self._events.append(message)
+            elif (message.get('id') == self._id):
+                if (not message['ok']):
+                    raise RuntimeError(message['error'])
+                return message['result']
+
+    def start(self, **settings):
+        return self.request('start', **settings)
+
+    def stop(self):
+        return self.request('stop')
+
+    def set_conditions(self, **conditions):
+        return self.request('set_conditions', **conditions)
+
+    def status(self):
+        return self.request('status')
+
+    def histogram(self, factor=None):
+        """ The histogram, or rebinned by factor neighbour bins per bin. """
+        if (factor is None):
+            return self.request('histogram')['hist']
+        return self.request('histogram', factor=factor)['hist']
+
+    def select_channel(self, channel):
+        return self.request('select_channel', channel=channel)
+
+    def channels(self):
+        return self.request('channels')
+
+    def set_background(self, blocked):
+        return self.request('set_background', blocked=blocked)
+
+    def corrected(self):
+        return self.request('corrected')
+
+    def segments(self):
+        return self.request('segments')['segments']
+
+    def subscribe(self):
+        return self.request('subscribe')
+
+    def next_event(self):
+        """ 
+        Wait for the next packet and apply it to self.hist. 
+        Return False if the histogram is out of sync (a packet was missed), it will be resynchronized by a keyframe.
+        """
+        message = self._events.pop(0) if self._events else self._read()
+        return self._decoder.apply(base64.b64decode(message['data']))
+
+    def _read(self):
+        line = self._file.readline()
+        if (not line):
+            raise ConnectionError("connection closed by the server")
+        return json.loads(line)
+
+
+# here is a demo of this module, with a fake controller.
+if __name__ == '__main__':
+    class FakeController:
+        def __init__(self):
+            self.settings = {}
+            self.detecting = False
+        def remote_start(self, **settings):
+            self.settings.update(settings)
+            self.detecting = True
+            return True
+        def remote_stop(self):
+            self.detecting = False
+            return True
+        def remote_set_conditions(self, **conditions):
+            self.settings.update(conditions)
+            return True
+        def remote_status(self):
+            return {'detecting': self.detecting, 'settings': self.settings}
+
+    server = ControlServer(FakeController(), port=0)
+    server.start()
+    host, port = server.address
+    client = ControlClient(port=port)
+    print(client.start(update_interval=200, use_cond_cnt=True, cond_cnt=50000))
+    print(client.status())
+    client.subscribe()
+    hist = np.zeros(107, dtype=np.int64)
+    pub = MMD_Histogram.DeltaPublisher()
+    pub.add_subscriber(server.publish)
+    for seq in range(1, 6):
+        hist[np.random.randint(0, 107, 20)] += 1
+        pub.publish(hist)
+    for k in range(5):
+        client.next_event()
+    print("rebuilt histogram equal:", np.array_equal(client.hist, hist), "seq", client.seq)
+    print(client.stop(), client.status())
+    client.close()
+    server.stop()
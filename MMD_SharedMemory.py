@@ -0,0 +1,238 @@
+"""
+Module MMD_SharedMemory
+
+The live histogram of the detector for the other processes of the lab (feedback loops, dashboards), in a shared memory
+block (multiprocessing.shared_memory): no socket, no pickling, a reader maps the block and copies what it needs.
+The writer (the GUI, python MMD_GUI.py SHARE) never waits for the readers: the block is guarded by a seqlock.
+Its sequence number is odd while an update is being written, and incremented again when it is done. A reader copies
+the histogram and the counters between two reads of an even, equal sequence number, else it tries again, so a
+snapshot is never half of one update and half of the next. The stores are in program order on x86-64 (aligned 8-byte
+words), the platforms of the GUI.
+Block layout: HEADER_FIELDS int64 words, the histogram (size_bins int64), and the channel histograms
+(n_channels x size_bins int64) if there are more than one channel.
+A new histogram of other bins or channels (a new start) is a new block of the same name: the old one is marked closed,
+and a reader of a closed block opens the new one (reopen()).
+
+Usage:
+    writer = SharedHistogramWriter(size_bins=107, n_channels=1)        # in the GUI process
+    writer.publish(hist, n_update=5, time_detected=1000, cnt_detected=52000)
+    reader = SharedHistogramReader()                                  # in another process
+    snapshot = reader.snapshot()        # dict: seq, hist, channel_hist, the counters, updated (time.time()), None if closed
+    snapshot = reader.wait(snapshot['seq'], timeout=1.)               # the next update
+    python MMD_SharedMemory.py                                        # demo: a writer and a reader process
+    python MMD_SharedMemory.py --watch mmd_histogram                  # print the snapshots of a running GUI
+"""
+
+import time
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+SHM_NAME_DEFAULT = 'mmd_histogram'
+MAGIC = 0x4D4D4448 # 'MMDH'
+HEADER_FIELDS = ('magic', 'seq', 'closed', 'size_bins', 'n_channels', 'n_update', 'time_detected', 'cnt_detected',
+                 'channel', 'background', 'fine_bits', 'updated_ns', 'detecting', 'reserved0', 'reserved1', 'reserved2')
+COUNTERS = ('n_update', 'time_detected', 'cnt_detected', 'channel', 'background', 'fine_bits', 'detecting') # set by publish()
+SNAPSHOT_RETRIES = 1000 # a reader gives up after this many updates written meanwhile
+WAIT_POLL = 0.002 # unit: s. wait() checks the sequence number at this interval.
+
+_FIELD = {name: k for k, name in enumerate(HEADER_FIELDS)}
+
+def _attach(name):
+    """ Open an existing block, not tracked: the resource tracker of this process must not unlink it at exit. """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) # Python 3.13
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+def _views(shm, size_bins, n_channels):
+    """ The header, the histogram and the channel histograms (None with one channel) of a block, as numpy arrays. """
+    header = np.ndarray((len(HEADER_FIELDS),), dtype=np.int64, buffer=shm.buf)
+    offset = header.nbytes
+    hist = np.ndarray((size_bins,), dtype=np.int64, buffer=shm.buf, offset=offset)
+    channel_hist = None
+    if (n_channels > 1):
+        channel_hist = np.ndarray((n_channels, size_bins), dtype=np.int64, buffer=shm.buf, offset=offset + hist.nbytes)
+    return header, hist, channel_hist
+
+class SharedHistogramWriter:
+    """ Publish the histogram and the counters into a shared memory block name, without waiting for the readers. """
+    def __init__(self, size_bins, n_channels=1, name=SHM_NAME_DEFAULT):
+        self.name = name
+        self.size_bins = size_bins
+        self.n_channels = n_channels
+        size = 8 * (len(HEADER_FIELDS) + size_bins * (1 + (n_channels if n_channels > 1 else 0)))
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError: # of a previous writer which did not close it (a crash): closed for its readers, and replaced
+            old = shared_memory.SharedMemory(name=name)
+            if (old.size >= 8 * len(HEADER_FIELDS)):
+                np.ndarray((len(HEADER_FIELDS),), dtype=np.int64, buffer=old.buf)[_FIELD['closed']] = 1
+            old.close()
+            old.unlink()
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self._header, self._hist, self._channel_hist = _views(self._shm, size_bins, n_channels)
+        self._header[:] = 0
+        self._header[_FIELD['size_bins']] = size_bins
+        self._header[_FIELD['n_channels']] = n_channels
+        self._header[_FIELD['magic']] = MAGIC # last: the block is ready
+
+    def publish(self, hist, channel_hist=None, **counters):
+        """ Write an update: hist (size_bins counts), channel_hist (n_channels x size_bins), counters of COUNTERS. """
+        header = self._header
+        seq = int(header[_FIELD['seq']]) + 1
+        header[_FIELD['seq']] = seq # odd: being written
+        self._hist[:] = hist
+        if (channel_hist is not None and self._channel_hist is not None):
+            self._channel_hist[:] = channel_hist
+        for name, value in counters.items():
+            header[_FIELD[name]] = value
+        header[_FIELD['updated_ns']] = time.time_ns()
+        header[_FIELD['seq']] = seq + 1 # even: done
+
+    def close(self):
+        """ Mark the block closed for its readers, and remove it. """
+        if (self._shm is None):
+            return
+        self._header[_FIELD['closed']] = 1
+        del self._header, self._hist, self._channel_hist
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+class SharedHistogramReader:
+    """ Consistent snapshots of the block of a SharedHistogramWriter. FileNotFoundError if there is none. """
+    def __init__(self, name=SHM_NAME_DEFAULT):
+        self.name = name
+        self.retries = 0 # snapshots tried again, an update was written meanwhile
+        self._shm = None
+        self.reopen()
+
+    def reopen(self):
+        """ Open the current block of the name, e.g. after the writer started a new histogram (closed). """
+        self.close()
+        self._shm = _attach(self.name)
+        header = np.ndarray((len(HEADER_FIELDS),), dtype=np.int64, buffer=self._shm.buf)
+        if (int(header[_FIELD['magic']]) != MAGIC):
+            del header
+            self.close()
+            raise FileNotFoundError("%s is not a histogram block, or not ready" % self.name)
+        self.size_bins = int(header[_FIELD['size_bins']])
+        self.n_channels = int(header[_FIELD['n_channels']])
+        del header
+        self._header, self._hist, self._channel_hist = _views(self._shm, self.size_bins, self.n_channels)
+
+    @property
+    def closed(self):
+        return self._shm is None or bool(self._header[_FIELD['closed']])
+
+    def seq(self):
+        """ The sequence number of the last update, even (odd while one is being written). """
+        return int(self._header[_FIELD['seq']])
+
+    def snapshot(self, retries=SNAPSHOT_RETRIES):
+        """
+        A copy of the last update: dict of seq, hist, channel_hist (None with one channel), the counters of COUNTERS and
+        updated (time.time() of the update). None if the block is closed (reopen() for the new one).
+        """
+        header = self._header
+        for k in range(retries):
+            if (header[_FIELD['closed']]):
+                return None
+            seq = int(header[_FIELD['seq']])
+            if (seq & 1): # being written
+                self.retries = self.retries + 1
+                time.sleep(0)
+                continue
+            hist = self._hist.copy()
+            channel_hist = self._channel_hist.copy() if self._channel_hist is not None else None
+            values = header.copy()
+            if (int(header[_FIELD['seq']]) != seq): # written meanwhile
+                self.retries = self.retries + 1
+                continue
+            snapshot = {name: int(values[_FIELD[name]]) for name in COUNTERS}
+            snapshot.update(seq=seq, hist=hist, channel_hist=channel_hist, updated=values[_FIELD['updated_ns']] * 1e-9)
+            return snapshot
+        raise TimeoutError("no consistent snapshot of %s in %d tries" % (self.name, retries))
+
+    def wait(self, seq, timeout=None):
+        """ The snapshot of the first update after seq, or None after timeout (unit: s) or if the block is closed. """
+        t_end = None if timeout is None else time.monotonic() + timeout
+        while (not self.closed and self.seq() <= seq):
+            if (t_end is not None and time.monotonic() > t_end):
+                return None
+            time.sleep(WAIT_POLL)
+        return self.snapshot()
+
+    def close(self):
+        if (self._shm is not None):
+            self._header = self._hist = self._channel_hist = None
+            self._shm.close()
+            self._shm = None
+
+
+def _demo_reader(name, n_updates):
+    """ Demo: check that every snapshot is one whole update (all the bins of update k are k). Return (snapshots, torn, retries). """
+    reader = SharedHistogramReader(name)
+    n, torn, seq = 0, 0, 0
+    while (True):
+        snapshot = reader.wait(seq, timeout=5.)
+        if (snapshot is None):
+            break
+        seq = snapshot['seq']
+        n = n + 1
+        if (np.any(snapshot['hist'] != snapshot['n_update']) or snapshot['cnt_detected'] != snapshot['n_update'] * snapshot['hist'].size):
+            torn = torn + 1
+        if (snapshot['n_update'] >= n_updates):
+            break
+    reader.close()
+    return n, torn, reader.retries
+
+
+# here is a demo of this module: a writer publishing as fast as it can, and a reader process (another interpreter,
+# as the other programs of the lab) checking every snapshot.
+if __name__ == '__main__':
+    import argparse
+    import subprocess
+    import sys
+    parser = argparse.ArgumentParser(description="Shared memory histogram of the Micro-Motion Detector.")
+    parser.add_argument('--watch', default=None, help="print the snapshots of this block (python MMD_GUI.py SHARE: %s)" % SHM_NAME_DEFAULT)
+    parser.add_argument('--check', nargs=2, default=None, help=argparse.SUPPRESS) # the reader process of the demo: name, updates
+    args = parser.parse_args()
+    if (args.check is not None):
+        print("%d %d %d" % _demo_reader(args.check[0], int(args.check[1])))
+        sys.exit(0)
+    if (args.watch is not None):
+        reader = SharedHistogramReader(args.watch)
+        seq = 0
+        while (True):
+            snapshot = reader.wait(seq, timeout=1.)
+            if (reader.closed):
+                print("closed, waiting for the next histogram")
+                while (True):
+                    time.sleep(1.)
+                    try:
+                        reader.reopen()
+                        break
+                    except FileNotFoundError:
+                        pass
+                seq = 0
+            elif (snapshot is not None):
+                seq = snapshot['seq']
+                print("update %d: %d photons, %d ms, %d bins, peak bin %d" % (snapshot['n_update'], snapshot['cnt_detected'],
+                      snapshot['time_detected'], reader.size_bins, int(np.argmax(snapshot['hist']))))
+    name = 'mmd_histogram_demo'
+    size_bins, n_updates = 4096, 20000
+    writer = SharedHistogramWriter(size_bins, name=name)
+    proc = subprocess.Popen([sys.executable, __file__, '--check', name, str(n_updates)], stdout=subprocess.PIPE, text=True)
+    time.sleep(1.) # the reader attaches
+    hist = np.zeros(size_bins, dtype=np.int64)
+    t0 = time.perf_counter()
+    for k in range(1, n_updates + 1):
+        hist[:] = k
+        writer.publish(hist, n_update=k, cnt_detected=k * size_bins)
+    t_publish = (time.perf_counter() - t0) / n_updates
+    n, torn, retries = map(int, proc.communicate(timeout=30)[0].split())
+    writer.close()
+    print("publish() %.1f us per update of %d bins; the reader took %d snapshots, %d torn, %d retries" % (t_publish * 1e6, size_bins, n, torn, retries))
@@ -0,0 +1,180 @@
+"""
+Module XEM7305_Benchmark
+
+Microbenchmark of the USB link to the detector, to tell the USB time of an update tick from the time of the Python code.
+Measured through the driver (XEM7305_MicroMotion_Detector), REPEATS times each:
+    pipe out of the FIFO, ReadFromPipeOut and ReadFromBlockPipeOut, from 16 bytes to the full FIFO (FIFO_BYTES):
+        the latency of a transfer (mean, min, median, max) and its throughput. Before each transfer the FIFO is let fill
+        with the photons of the experiment (the board needs its PMT and RF trigger signals), this wait is not timed.
+    the fixed cost of a transfer and the bandwidth of the link, fitted to the median latencies (latency = overhead + size / bandwidth)
+    a wire out round trip (UpdateWireOuts, probe_dev), a wire in one (UpdateWireIns, set_modes) and reset_dev()
+The report is a text table, or a JSON file of the same numbers.
+Against the emulator with injected latency and bandwidth (--emulate --latency --bandwidth), --check compares the fit with
+what was injected and exits with 1 if they differ, a test of the benchmark itself without a board, e.g. on Linux.
+The emulator then runs its firmware only while the FIFO fills (realtime=False, fill = emu.advance), so that its
+photons are not generated inside the timed transactions.
+
+Usage:
+    python XEM7305_Benchmark.py                                       # the board
+    python XEM7305_Benchmark.py --emulate --latency 0.0005 --bandwidth 2e8 --check --json bench.json
+    report = run(dev, sizes=(16, 4096, 65536), repeats=10); print(format_report(report))
+"""
+
+import argparse
+import json
+import sys
+import time
+import numpy as np
+import XEM7305_MicroMotion_Detector
+import XEM7305_Emulator
+
+FIFO_BYTES = 131072 - 128 # the FIFO writes stop at this count
+SIZES = (16, 64, 256, 1024, 4096, 16384, 65536, FIFO_BYTES) # unit: bytes, multiples of 16 (USB 3.0)
+REPEATS = 20 # timed transfers per size, after one untimed
+FILL_TIMEOUT = 5. # unit: s. A size is skipped if the FIFO does not fill in this time (too few photons).
+BLOCK_MAX = 16384 # unit: bytes, the largest block of ReadFromBlockPipeOut
+CHECK_TOLERANCE = 0.25 # --check: the fitted overhead and bandwidth within this of the injected ones
+
+def block_size(n_bytes):
+    """ The largest block of a block pipe transfer of n_bytes: a power of 2 dividing it, up to BLOCK_MAX. """
+    return min(n_bytes & -n_bytes, BLOCK_MAX)
+
+def _stats(times):
+    times = np.asarray(times)
+    return {'mean': float(times.mean()), 'min': float(times.min()), 'median': float(np.median(times)), 'max': float(times.max())}
+
+def _fill(dev, n_bytes, fill=None, timeout=FILL_TIMEOUT):
+    """ Wait until the FIFO has n_bytes, calling fill() meanwhile if not None. False if it does not in time. """
+    t0 = time.perf_counter()
+    while (dev.fifo_r_count() * 4 < n_bytes):
+        if (time.perf_counter() - t0 > timeout):
+            return False
+        if (fill is not None):
+            fill()
+        else:
+            time.sleep(0.001)
+    return True
+
+def time_pipe(dev, sizes=SIZES, repeats=REPEATS, block=False, fill=None):
+    """
+    The latency of pipe outs of each size. A list of dicts: size, latency (stats, s), throughput (bytes/s), or skipped.
+    fill: called while the FIFO fills, e.g. the advance of an emulator which is not realtime.
+    """
+    results = []
+    for size in sizes:
+        buff = bytearray(size)
+        times = []
+        for k in range(repeats + 1):
+            if (not _fill(dev, size, fill)):
+                break
+            t = time.perf_counter()
+            n = dev.pipe_out_block(buff, block_size(size)) if block else dev.pipe_out(buff)
+            t = time.perf_counter() - t
+            if (n < 0):
+                raise XEM7305_MicroMotion_Detector.DetectorError("pipe out of %d bytes failed: %d" % (size, n))
+            if (k > 0): # the first one warms up the buffers
+                times.append(t)
+        if (len(times) < repeats):
+            results.append({'size': size, 'skipped': "the FIFO did not fill in %g s" % FILL_TIMEOUT})
+            continue
+        latency = _stats(times)
+        results.append({'size': size, 'latency': latency, 'throughput': size / latency['mean']})
+    return results
+
+def fit_link(results):
+    """
+    The fixed cost of a transfer (s) and the bandwidth (bytes/s), least squares of the median latencies (robust to the
+    scheduling noise of the host). None if under 2 sizes.
+    """
+    timed = [r for r in results if 'latency' in r]
+    if (len(timed) < 2):
+        return None
+    size = np.array([r['size'] for r in timed], dtype=float)
+    latency = np.array([r['latency']['median'] for r in timed])
+    slope, overhead = np.polyfit(size, latency, 1)
+    return {'overhead': float(overhead), 'bandwidth': float(1. / slope) if slope > 0 else float('inf')}
+
+def time_call(call, repeats=REPEATS):
+    times = []
+    for k in range(repeats + 1):
+        t = time.perf_counter()
+        call()
+        if (k > 0):
+            times.append(time.perf_counter() - t)
+    return _stats(times)
+
+def run(dev, sizes=SIZES, repeats=REPEATS, fill=None):
+    """ The whole benchmark, in the 8-bit FIFO mode. Return the report, a dict. fill: see time_pipe(). """
+    dev.set_modes()
+    report = {'wire_out': time_call(dev.probe_dev, repeats), 'wire_in': time_call(dev.set_modes, repeats),
+              'reset': time_call(dev.reset_dev, repeats)}
+    dev.reset_dev()
+    report['pipe'] = time_pipe(dev, sizes, repeats, False, fill)
+    report['block_pipe'] = time_pipe(dev, sizes, repeats, True, fill)
+    report['fit'] = fit_link(report['pipe'])
+    report['block_fit'] = fit_link(report['block_pipe'])
+    return report
+
+def format_report(report):
+    lines = []
+    for name, title in (('wire_out', "wire out round trip"), ('wire_in', "wire in round trip"), ('reset', "reset_dev")):
+        s = report[name]
+        lines.append("%-20s mean %8.3f ms, min %8.3f, median %8.3f, max %8.3f" % (title, s['mean'] * 1e3, s['min'] * 1e3, s['median'] * 1e3, s['max'] * 1e3))
+    for name, fit_name, title in (('pipe', 'fit', "ReadFromPipeOut"), ('block_pipe', 'block_fit', "ReadFromBlockPipeOut")):
+        lines.append(title + ":")
+        for r in report[name]:
+            if ('skipped' in r):
+                lines.append("  %7d B: skipped, %s" % (r['size'], r['skipped']))
+                continue
+            s = r['latency']
+            lines.append("  %7d B: mean %8.3f ms, min %8.3f, median %8.3f, max %8.3f, %9.3f MB/s"
+                         % (r['size'], s['mean'] * 1e3, s['min'] * 1e3, s['median'] * 1e3, s['max'] * 1e3, r['throughput'] * 1e-6))
+        fit = report[fit_name]
+        if (fit is not None):
+            lines.append("  fit: %.3f ms per transfer + %.3f MB/s" % (fit['overhead'] * 1e3, fit['bandwidth'] * 1e-6))
+    return "\n".join(lines)
+
+def check(report, latency, bandwidth):
+    """ The problems of the fit against the injected latency (s) and bandwidth (bytes/s, None: unlimited). An empty list if none. """
+    problems = []
+    for name in ('fit', 'block_fit'):
+        fit = report[name]
+        if (fit is None):
+            problems.append("%s: too few sizes timed" % name)
+            continue
+        if (abs(fit['overhead'] - latency) > CHECK_TOLERANCE * latency + 0.0002): # + the time of Python and of the emulated firmware
+            problems.append("%s: overhead %.3f ms, injected %.3f ms" % (name, fit['overhead'] * 1e3, latency * 1e3))
+        if (bandwidth is not None and abs(fit['bandwidth'] / bandwidth - 1.) > CHECK_TOLERANCE):
+            problems.append("%s: bandwidth %.3f MB/s, injected %.3f MB/s" % (name, fit['bandwidth'] * 1e-6, bandwidth * 1e-6))
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the USB link of the Micro-Motion Detector.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help="pipe out sizes, unit: bytes, multiples of 16")
+    parser.add_argument('--repeats', type=int, default=REPEATS, help="timed transfers per size")
+    parser.add_argument('--json', default=None, help="also write the report into this JSON file")
+    parser.add_argument('--emulate', action='store_true', help="an emulated board (XEM7305_Emulator) instead of the board")
+    parser.add_argument('--photon-rate', type=float, default=5e6, help="emulated photons per second, to fill the FIFO")
+    parser.add_argument('--latency', type=float, default=0.0005, help="emulated latency of a USB transaction, unit: s")
+    parser.add_argument('--bandwidth', type=float, default=2e8, help="emulated pipe bandwidth, unit: bytes/s")
+    parser.add_argument('--check', action='store_true', help="with --emulate, compare the fit with the injected latency and bandwidth")
+    args = parser.parse_args()
+    fill = None
+    if (args.emulate):
+        emu = XEM7305_Emulator.FrontPanelEmulator(photon_rate=args.photon_rate, latency=args.latency, bandwidth=args.bandwidth, realtime=False)
+        dev = XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=emu)
+        fill = lambda: emu.advance(0.01)
+    else:
+        dev = XEM7305_MicroMotion_Detector.get_detector()
+    report = run(dev, args.sizes, args.repeats, fill)
+    print(format_report(report))
+    if (args.json is not None):
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=4)
+    dev.close()
+    if (args.check and args.emulate):
+        problems = check(report, args.latency, args.bandwidth)
+        for problem in problems:
+            print("check failed: " + problem)
+        sys.exit(1 if problems else 0)
@@ -0,0 +1,254 @@
+"""
+Module XEM7305_Cosim
+
+Co-simulation of the detector firmware with the Python driver, without a bitstream or a board.
+The RTL of firmware/mmd_core.v (the datapath of top_mmd: micromotion_detect, CDC, FIFO, timestamp_tagger,
+histogram_accum, reset_sequencer) is compiled by Verilator with the harness firmware/sim/cosim_main.cpp, which drives it with
+synthetic PMT pulses and RF trigger TTLs. FrontPanelCosim runs that program and has the methods of
+ok.okCFrontPanel used by XEM7305_MicroMotion_Detector, so the same driver code runs against the firmware:
+    wireIn 0x00 / 0x01, triggerIn 0x40, wireOut 0x20 ~ 0x24, pipeOut 0xA0 / 0xA1
+Unlike XEM7305_Emulator (a behavioral model), it validates firmware and host changes together.
+
+The simulation is slower than the board: time_scale is the simulated time per wall clock time when realtime=True.
+With realtime=False the firmware only runs by advance(seconds).
+fine_bits and data_bits build the firmware with FINE_BITS (sub-clock time resolution, 0 ~ 2) and DATASIZE (time difference
+counter, 8 ~ 16 - fine_bits), each build in its own directory.
+
+Usage:
+    python XEM7305_Cosim.py                  # build if needed, run the driver and print throughput
+    dev = XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=FrontPanelCosim(photon_rate=1e6))
+Requirement: verilator 5 and a C++ compiler.
+"""
+
+import os
+import shutil
+import subprocess
+import time
+import numpy as np
+from XEM7305_Emulator import NoError, Failed, Timeout, FileError, DeviceNotOpen, InvalidEndpoint
+
+FIRMWARE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'firmware')
+RTL_SOURCES = ('mmd_core.v', 'micromotion_detect.v', 'multiphase_capture.v', 'photon_counter.v', 'cdc_c2g.v', 'cdc_g2ram.v', 'sync2ff.v', 'sync3ff.v',
+               'edge_detect.v', 'timestamp_tagger.v', 'histogram_accum.v', 'reset_sequencer.v',
+               'sim/fifo_generator_0.v', 'sim/cosim_main.cpp')
+BUILD_DIR = os.path.join(FIRMWARE_DIR, 'sim', 'obj_dir')
+BINARY_NAME = 'mmd_cosim'
+TIME_SCALE_DEFAULT = 0.02 # simulated seconds per wall clock second in realtime mode
+TRANSACTION_TIME = 1e-6 # unit: s. The firmware runs at least this long in each USB transaction, e.g. a reset is seen by the clocks.
+
+def find_verilator():
+    for name in ('verilator', 'verilator-cli'): # verilator-cli: the pip package
+        path = shutil.which(name)
+        if (path):
+            return path
+    return None
+
+def build(build_dir=BUILD_DIR, force=False, fine_bits=0, data_bits=8):
+    """ Compile the harness with Verilator, if a source is newer than the binary. Return the path of the binary. """
+    if (fine_bits):
+        build_dir = "%s_fine%d" % (build_dir, fine_bits)
+    if (data_bits != 8):
+        build_dir = "%s_data%d" % (build_dir, data_bits)
+    binary = os.path.join(build_dir, BINARY_NAME)
+    sources = [os.path.join(FIRMWARE_DIR, f) for f in RTL_SOURCES]
+    if (not force and os.path.exists(binary) and os.path.getmtime(binary) >= max(os.path.getmtime(f) for f in sources)):
+        return binary
+    verilator = find_verilator()
+    if (verilator is None):
+        raise RuntimeError("verilator not found, it is needed to build the co-simulation")
+    cmd = [verilator, '--cc', '--exe', '--build', '-O3', '-Wno-fatal', '-Wno-WIDTH', '-Wno-CASEINCOMPLETE',
+           '-GFINE_BITS=%d' % fine_bits, '-GDATASIZE=%d' % data_bits, '--top-module', 'mmd_core', '-Mdir', build_dir, '-o', BINARY_NAME] + sources
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+    return binary
+
+class FrontPanelCosim:
+    """ An okCFrontPanel look-alike, running the firmware RTL in a Verilator simulation. """
+    NoError = NoError
+    Failed = Failed
+    Timeout = Timeout
+
+    def __init__(self, photon_rate=1e5, rf_freq=21.5e6, n_period=5, modulation=0.8, pulse_width=20e-9,
+                 serial='COSIM', realtime=True, time_scale=TIME_SCALE_DEFAULT, seed=1, fine_bits=0, data_bits=8, binary=None):
+        self.serial = serial
+        self.realtime = realtime
+        self.time_scale = time_scale
+        self.n_transactions = 0 # USB transactions so far, to compare host code paths
+        self._binary = binary if binary is not None else build(fine_bits=fine_bits, data_bits=data_bits)
+        self._proc = None
+        self._open = False
+        self._wire_in = {}
+        self._wire_in_pending = {}
+        self._wire_out = {0x20: 0, 0x21: 0, 0x22: 0, 0x23: 0, 0x24: 0}
+        self._stimulus = {'photon_rate': photon_rate, 'rf_freq': rf_freq, 'n_period': n_period, 'modulation': modulation,
+                          'pulse_width': pulse_width, 'seed': seed}
+        self._t_last = time.monotonic()
+        self.sim_time = 0 # unit: ns
+
+    # ---- the simulation ----
+    def _start(self):
+        self._close_proc()
+        self._proc = subprocess.Popen([self._binary], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                      universal_newlines=True, bufsize=1)
+        self.sim_time = 0
+        for name, value in self._stimulus.items():
+            self._command("set %s %r" % (name, value))
+        for ep, value in self._wire_in.items():
+            self._command("wi %d %d" % (ep, value))
+
+    def _close_proc(self):
+        if (self._proc is not None):
+            self._proc.stdin.write("quit\n")
+            self._proc.stdin.close()
+            self._proc.wait()
+            self._proc = None
+
+    def _command(self, line):
+        self._proc.stdin.write(line + "\n")
+        reply = self._proc.stdout.readline().split()
+        if (not reply):
+            raise RuntimeError("co-simulation exited")
+        if (reply[0] == 'error'):
+            raise RuntimeError("co-simulation: %s" % " ".join(reply[1:]))
+        return reply
+
+    def set_stimulus(self, **stimulus):
+        """ Change photon_rate, rf_freq, n_period, modulation, pulse_width or seed, also while running. """
+        self._stimulus.update(stimulus)
+        if (self._proc is not None):
+            for name, value in stimulus.items():
+                self._command("set %s %r" % (name, value))
+
+    def advance(self, seconds):
+        """ Let the firmware run for a simulated time. """
+        ns = int(seconds * 1e9)
+        if (ns > 0 and self._proc is not None):
+            self.sim_time = int(self._command("run %d" % ns)[1])
+
+    def _run(self):
+        """ Called by every USB transaction: in realtime mode, catch up with the scaled wall clock. """
+        self.n_transactions = self.n_transactions + 1
+        seconds = TRANSACTION_TIME
+        if (self.realtime):
+            seconds = max(seconds, (time.monotonic() - self._t_last) * self.time_scale)
+        self.advance(seconds)
+        self._t_last = time.monotonic() # the simulation time itself is not counted
+
+    # ---- okCFrontPanel ----
+    def GetDeviceCount(self):
+        return 1
+
+    def GetDeviceListSerial(self, num):
+        return self.serial if num == 0 else ''
+
+    def GetSerialNumber(self):
+        return self.serial
+
+    def OpenBySerial(self, serial=''):
+        if (serial not in ('', self.serial)):
+            return Failed
+        self._open = True
+        return NoError
+
+    def IsOpen(self):
+        return self._open
+
+    def Close(self):
+        self._close_proc()
+        self._open = False
+
+    def ConfigureFPGA(self, strFilename):
+        if (not self._open):
+            return DeviceNotOpen
+        if (not os.path.exists(strFilename)):
+            return FileError
+        self._wire_in = {}
+        self._start() # a configured FPGA starts from its initial state
+        self._t_last = time.monotonic()
+        return NoError
+
+    def SetWireInValue(self, epAddr, val, mask=0xFFFFFFFF):
+        old = self._wire_in_pending.get(epAddr, self._wire_in.get(epAddr, 0))
+        self._wire_in_pending[epAddr] = (old & ~mask) | (val & mask)
+        return NoError
+
+    def UpdateWireIns(self):
+        if (self._proc is None):
+            return DeviceNotOpen
+        self._run()
+        for ep, value in self._wire_in_pending.items():
+            self._command("wi %d %d" % (ep, value))
+        self._wire_in.update(self._wire_in_pending)
+        self._wire_in_pending = {}
+        return NoError
+
+    def UpdateWireOuts(self):
+        if (self._proc is None):
+            return DeviceNotOpen
+        self._run()
+        values = self._command("wo")[1:]
+        for ep, value in zip((0x20, 0x21, 0x22, 0x23, 0x24), values):
+            self._wire_out[ep] = int(value)
+        return NoError
+
+    def GetWireOutValue(self, epAddr):
+        return self._wire_out.get(epAddr, 0)
+
+    def ActivateTriggerIn(self, epAddr, bit):
+        if (self._proc is None):
+            return DeviceNotOpen
+        self._run()
+        self._command("ti %d %d" % (epAddr, bit))
+        return NoError
+
+    def ReadFromPipeOut(self, epAddr, data):
+        if (self._proc is None):
+            return DeviceNotOpen
+        if (epAddr not in (0xA0, 0xA1)):
+            return InvalidEndpoint
+        self._run()
+        n = len(data)
+        reply = self._command("po %d %d" % (epAddr, n // 4))
+        if (reply[0] == 'timeout'):
+            return Timeout
+        words = np.frombuffer(bytes.fromhex(reply[1]) if n > 0 else b'', dtype='>u4') # printed as hex numbers
+        data[:n] = words.astype('<u4').tobytes() # the 32-bit pipe sends a word LSB first
+        return n
+
+    def ReadFromBlockPipeOut(self, epAddr, blockSize, data):
+        return self.ReadFromPipeOut(epAddr, data)
+
+    ReadFromPipeOutThr = ReadFromPipeOut # the simulation runs in its own process, waiting for it releases the GIL
+    ReadFromBlockPipeOutThr = ReadFromBlockPipeOut
+
+    def EnableAsynchronousTransfers(self, enable):
+        pass
+
+
+# here is a demo of this module: the driver against the RTL, and the throughput of the simulation.
+if __name__ == '__main__':
+    import XEM7305_MicroMotion_Detector
+    cosim = FrontPanelCosim(photon_rate=1e6, realtime=False)
+    dev = XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=cosim, bit_file=os.path.join(FIRMWARE_DIR, '..', 'micromotion_detector.bit'))
+    dev.reset_dev()
+    n_events, hist = 0, np.zeros(256, dtype=np.int64)
+    t0 = time.perf_counter()
+    for k in range(10):
+        cosim.advance(0.001)
+        photon_cnt, tdiff_cnt, TTL_prd, fifo_cnt = dev.probe_dev()
+        buff = bytearray(4 * (fifo_cnt // 4 * 4))
+        dev.pipe_out(buff)
+        diff = np.frombuffer(buff, dtype=np.uint8)
+        n_events = n_events + diff.size
+        hist = hist + np.bincount(diff, minlength=256)
+    wall = time.perf_counter() - t0
+    print("photon, tdiff, TTL period: %d %d %d, read %d events" % (photon_cnt, tdiff_cnt, TTL_prd, n_events))
+    print("c_diff histogram 1~%d:" % TTL_prd, hist[1:TTL_prd + 1])
+    print("simulated %.3f ms in %.2f s wall (%.1fx slower than the board), %d USB transactions"
+          % (cosim.sim_time * 1e-6, wall, wall / (cosim.sim_time * 1e-9), cosim.n_transactions))
+    dev.set_histogram_mode(True)
+    dev.reset_dev()
+    cosim.advance(0.002)
+    counters = dev.read_histogram()
+    tdiff_cnt = dev.tdiff_count()
+    print("histogram mode: %d counted by the FPGA, tdiff count %d" % (counters.sum(), tdiff_cnt))
+    cosim.Close()
@@ -0,0 +1,330 @@
+"""
+Module XEM7305_Emulator
+
+A host-side emulator of the XEM7305 board running micromotion_detector.bit.
+FrontPanelEmulator has the methods of ok.okCFrontPanel used by XEM7305_MicroMotion_Detector,
+and a behavioral model of the firmware (firmware/top_mmd.v) behind the same endpoints:
+    wireIn  0x00: bit0 reset, bit1 reset_fifo
+    wireIn  0x01: bit0 histogram mode (histogram_accum instead of the FIFO), bit1 timestamped event mode (timestamp_tagger),
+                  bit2 16-bit mode
+    trigIn  0x40: bit0 swap the histogram banks, bit1 self-timed reset (as the wireIn 0x00 sequence)
+    wireOut 0x20: photon count, 0x21: time difference count, 0x22: RF trigger TTL period, 0x23: FIFO words ready
+    wireOut 0x24: build parameters {self-timed reset, HISTSIZE, FINE_BITS, DATASIZE}
+    pipeOut 0xA0: FIFO, one byte per time difference, 4 bytes per word (first written byte in the MSB),
+                  or in timestamped event mode one word per time difference: timestamp[23:16], [15:8], [7:0], diff
+                  or in 16-bit mode 2 bytes per time difference, high byte first
+    pipeOut 0xA1: the frozen histogram bank, 2^HISTSIZE 32-bit counters
+PMT photons are a Poisson process with a sine modulated arrival phase, RF trigger TTLs are periodic.
+A photon arriving within the hold time of cdc_c2g after the previous one is lost, as on the board.
+fine_bits emulates a firmware built with sub-clock resolution (multiphase_capture): the histogram and the 16-bit mode
+count c_clk / 2^fine_bits, the 8-bit mode still gets c_clk periods. data_bits is DATASIZE, for TTL periods of 256 clocks or more.
+unplug() and plug() emulate a USB disconnect, for the reconnect of the driver and the GUI.
+So the driver, the GUI (python MMD_GUI.py EMULATE) and the tools can run without a board, e.g. on Linux.
+latency and bandwidth make every USB transaction take time (time.sleep, which releases the GIL like the *Thr
+methods of the FrontPanel API), to compare synchronous and threaded readouts (XEM7305_MicroMotion_Detector.PipeReader).
+
+Usage:
+    dev = XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=FrontPanelEmulator(photon_rate=1e5))
+    emu = FrontPanelEmulator(realtime=False)   # deterministic: time only moves by emu.advance(seconds)
+"""
+
+import os
+import time
+import numpy as np
+
+# error codes of okCFrontPanel
+NoError = 0
+Failed = -1
+Timeout = -2
+FileError = -7
+DeviceNotOpen = -8
+InvalidEndpoint = -9
+
+CLOCK_PERIOD = 2.173913 # unit: ns. c_clk 460 MHz
+OK_CLOCK_PERIOD = 9.92 # unit: ns. g_clk (okClk) 100.8 MHz
+TIMESTAMP_SHIFT = 7 # the timestamp counts 2^7 g_clk
+TIMESTAMP_MASK = (1 << 24) - 1
+FIFO_DEPTH = 131072 - 128 # unit: bytes. FIFO writes stop at this count (g_goot_to_wr in top_mmd.v).
+CDC_HOLD_CLOCKS = 14 # c_clk. cdc_c2g holds a detection high 7 clocks and low 7 clocks, photons meanwhile are lost.
+HIST_BINS = 256
+HIST_BITS_MAX = 12 # HISTSIZE of mmd_core.v is DATASIZE + FINE_BITS, up to 12
+
+class FrontPanelEmulator:
+    """ An okCFrontPanel look-alike, emulating the micromotion detector firmware. """
+    NoError = NoError
+    Failed = Failed
+    Timeout = Timeout
+
+    def __init__(self, photon_rate=10000., ttl_period=107, n_period=5, modulation=0.8,
+                 serial='EMULATED', realtime=True, seed=None, fine_bits=0, data_bits=8,
+                 latency=0., bandwidth=None):
+        self.photon_rate = photon_rate # unit: photons/s
+        self.ttl_period = ttl_period # unit: c_clk
+        self.n_period = n_period # RF sine waves per RF trigger TTL
+        self.modulation = modulation # 0 ~ 1, the micromotion modulation depth of the arrival phase
+        self.fine_bits = fine_bits # FINE_BITS of the firmware, 0 ~ 2
+        self.data_bits = data_bits # DATASIZE of the firmware, 8 ~ 16 - fine_bits
+        self.serial = serial
+        self.realtime = realtime
+        self.n_transactions = 0 # USB transactions so far, to compare host code paths
+        self.latency = latency # unit: s, per USB transaction
+        self.bandwidth = bandwidth # unit: bytes/s of the pipes. None: no transfer time.
+        self._rng = np.random.default_rng(seed)
+        self._open = False
+        self._plugged = True
+        self._configured = False
+        self._wire_in = {}
+        self._wire_in_pending = {}
+        self._wire_out = {0x20: 0, 0x21: 0, 0x22: 0, 0x23: 0, 0x24: 0}
+        self._t_last = time.monotonic()
+        self._carry = -float(CDC_HOLD_CLOCKS) # unit: c_clk. Time of the last detection, relative to the start of the next step, for the dead time.
+        self._reset_state()
+
+    # ---- the emulated firmware ----
+    def _reset_state(self):
+        self._photon_cnt = 0
+        self._tdiff_cnt = 0
+        self._ttl_seen = False
+        self._t_clk = 0 # unit: c_clk. Time since the reset, for the timestamps.
+        self._fifo = bytearray()
+        self._hist = [np.zeros(self._hist_bins(), dtype=np.uint32), np.zeros(self._hist_bins(), dtype=np.uint32)] # accumulating, frozen
+
+    def _hist_bits(self):
+        return min(self.data_bits + self.fine_bits, HIST_BITS_MAX)
+
+    def _hist_bins(self):
+        return 1 << self._hist_bits()
+
+    def _wire(self, ep):
+        return self._wire_in.get(ep, 0)
+
+    def _phase_density(self):
+        """ Probability of each c_diff value 1 ~ ttl_period. The histogram bin is ttl_period - c_diff. """
+        k = self.ttl_period - np.arange(1, self.ttl_period + 1)
+        density = 1. + self.modulation * np.sin(self.n_period * 2 * np.pi * k / self.ttl_period)
+        return density / density.sum()
+
+    def advance(self, seconds):
+        """ Let the firmware run for a time: photons are counted, and written into the FIFO or the histogram. """
+        if (seconds <= 0 or self._wire(0x00) & 0x01): # held in reset
+            return
+        self._ttl_seen = True
+        n_clk = seconds * 1e9 / CLOCK_PERIOD
+        n = self._rng.poisson(self.photon_rate * seconds)
+        if (n == 0):
+            return
+        self._photon_cnt = (self._photon_cnt + n) & 0xFFFFFFFF
+        n_ttl = max(1, int(n_clk // self.ttl_period))
+        diff = self._rng.choice(np.arange(1, self.ttl_period + 1), size=n, p=self._phase_density())
+        t = self._rng.integers(0, n_ttl, size=n) * self.ttl_period + diff # arrival time, unit: c_clk
+        order = np.argsort(t)
+        t, diff = t[order], diff[order]
+        # dead time: lost if it arrives within the hold time of the previous photon (a good approximation while rate * hold << 1)
+        gaps = np.diff(t, prepend=self._carry)
+        kept = gaps >= CDC_HOLD_CLOCKS
+        diff = diff[kept]
+        if (diff.size > 0):
+            self._carry = float(t[kept][-1])
+        self._carry = self._carry - n_ttl * self.ttl_period
+        t_kept = self._t_clk + t[kept]
+        self._t_clk = self._t_clk + n_ttl * self.ttl_period
+        self._tdiff_cnt = (self._tdiff_cnt + diff.size) & 0xFFFFFFFF
+        # c_diff: the sub-clock part, the photon arrives uniformly within the clock period which counts it. The counter wraps at data_bits.
+        fine = diff << self.fine_bits
+        if (self.fine_bits):
+            fine = fine - self._rng.integers(0, 1 << self.fine_bits, size=diff.size)
+        fine = fine & ((1 << (self.data_bits + self.fine_bits)) - 1)
+        diff = (fine >> self.fine_bits) & 0xFF # the 8-bit mode and the timestamped events get c_clk periods
+        if (self._wire(0x01) & 0x01): # histogram mode, larger time differences in the last counter
+            self._hist[0] += np.bincount(np.minimum(fine, self._hist_bins() - 1), minlength=self._hist_bins()).astype(np.uint32)
+        elif (self._wire(0x00) & 0x02): # FIFO in reset
+            pass
+        elif (self._wire(0x01) & 0x02): # timestamped event mode: whole events only
+            n_fit = max(FIFO_DEPTH - len(self._fifo), 0) // 4
+            ts = (t_kept[:n_fit] * CLOCK_PERIOD / OK_CLOCK_PERIOD).astype(np.int64) >> TIMESTAMP_SHIFT & TIMESTAMP_MASK
+            events = np.stack((ts >> 16, ts >> 8, ts, diff[:n_fit]), axis=1) & 0xFF # in the order of writing
+            self._fifo += events.astype(np.uint8).tobytes()
+        elif (self._wire(0x01) & 0x04): # 16-bit mode: whole time differences only
+            n_fit = max(FIFO_DEPTH - len(self._fifo), 0) // 2
+            self._fifo += fine[:n_fit].astype('>u2').tobytes() # high byte first
+        else:
+            room = FIFO_DEPTH - len(self._fifo)
+            self._fifo += diff[:max(room, 0)].astype(np.uint8).tobytes()
+
+    def _run(self):
+        """ Catch up with the wall clock, called by every USB transaction. """
+        self.n_transactions = self.n_transactions + 1
+        if (self.latency > 0):
+            time.sleep(self.latency)
+        now = time.monotonic()
+        if (self.realtime):
+            self.advance(now - self._t_last)
+        self._t_last = now
+
+    def unplug(self):
+        """ Emulate a USB disconnect: the device is closed, and the FPGA loses its configuration. """
+        self._plugged = False
+        self._open = False
+        self._configured = False
+
+    def plug(self):
+        """ The device is back, it can be opened and configured again. """
+        self._plugged = True
+
+    # ---- okCFrontPanel ----
+    def GetDeviceCount(self):
+        return 1 if self._plugged else 0
+
+    def GetDeviceListSerial(self, num):
+        return self.serial if num == 0 else ''
+
+    def GetSerialNumber(self):
+        return self.serial
+
+    def OpenBySerial(self, serial=''):
+        if (serial not in ('', self.serial) or not self._plugged):
+            return Failed
+        self._open = True
+        return NoError
+
+    def IsOpen(self):
+        return self._open
+
+    def Close(self):
+        self._open = False
+
+    def ConfigureFPGA(self, strFilename):
+        if (not self._open):
+            return DeviceNotOpen
+        if (not os.path.exists(strFilename)):
+            return FileError
+        self._configured = True
+        self._wire_in = {}
+        self._reset_state()
+        self._t_last = time.monotonic()
+        return NoError
+
+    def SetWireInValue(self, epAddr, val, mask=0xFFFFFFFF):
+        old = self._wire_in_pending.get(epAddr, self._wire_in.get(epAddr, 0))
+        self._wire_in_pending[epAddr] = (old & ~mask) | (val & mask)
+        return NoError
+
+    def UpdateWireIns(self):
+        if (not self._open):
+            return DeviceNotOpen
+        self._run()
+        self._wire_in.update(self._wire_in_pending)
+        self._wire_in_pending = {}
+        if (self._wire(0x00) & 0x01):
+            self._reset_state()
+        if (self._wire(0x00) & 0x02):
+            self._fifo = bytearray()
+        return NoError
+
+    def UpdateWireOuts(self):
+        if (not self._open):
+            return DeviceNotOpen
+        self._run()
+        self._wire_out[0x20] = self._photon_cnt
+        self._wire_out[0x21] = self._tdiff_cnt
+        self._wire_out[0x22] = (self.ttl_period & ((1 << self.data_bits) - 1)) if self._ttl_seen else 0 # data_bits bits, c_ch2_period
+        self._wire_out[0x23] = len(self._fifo) // 4
+        self._wire_out[0x24] = (1 << 24) | (self._hist_bits() << 16) | (self.fine_bits << 8) | self.data_bits # {self-timed reset, HISTSIZE, FINE_BITS, DATASIZE}
+        return NoError
+
+    def GetWireOutValue(self, epAddr):
+        return self._wire_out.get(epAddr, 0)
+
+    def ActivateTriggerIn(self, epAddr, bit):
+        if (not self._open):
+            return DeviceNotOpen
+        self._run()
+        if (epAddr == 0x40 and bit == 0):
+            frozen = self._hist[0]
+            self._hist[0] = np.zeros(self._hist_bins(), dtype=np.uint32)
+            self._hist[1] = frozen
+        elif (epAddr == 0x40 and bit == 1): # self-timed reset (reset_sequencer), over before the next transaction
+            self._reset_state()
+        return NoError
+
+    def ReadFromPipeOut(self, epAddr, data):
+        if (not self._open):
+            return DeviceNotOpen
+        self._run()
+        n = len(data)
+        if (epAddr == 0xA0):
+            if (n > len(self._fifo) - len(self._fifo) % 4):
+                return Timeout # the board would stall until the FIFO has the data
+            t = time.perf_counter()
+            words = np.frombuffer(bytes(self._fifo[:n]), dtype=np.uint8).reshape(-1, 4)
+            data[:] = words[:, ::-1].tobytes() # the first written byte is the MSB of the 32-bit word, which is sent LSB first
+            del self._fifo[:n]
+            if (self.bandwidth): # the transfer time, the copy above included
+                time.sleep(max(n / self.bandwidth - (time.perf_counter() - t), 0.))
+            return n
+        if (epAddr == 0xA1):
+            out = self._hist[1].astype('<u4').tobytes()[:n]
+            data[:len(out)] = out
+            self._hist[1] = np.zeros(self._hist_bins(), dtype=np.uint32) # cleared after readout
+            return n
+        return InvalidEndpoint
+
+    def ReadFromBlockPipeOut(self, epAddr, blockSize, data):
+        return self.ReadFromPipeOut(epAddr, data)
+
+    # the thread-friendly variants of the FrontPanel API. The emulator releases the GIL only while sleeping.
+    ReadFromPipeOutThr = ReadFromPipeOut
+    ReadFromBlockPipeOutThr = ReadFromBlockPipeOut
+
+    def EnableAsynchronousTransfers(self, enable):
+        pass
+
+
+# here is a demo of this module.
+if __name__ == '__main__':
+    emu = FrontPanelEmulator(photon_rate=100000., realtime=False, seed=1)
+    emu.OpenBySerial('')
+    emu.ConfigureFPGA(__file__) # any existing file
+    emu.advance(0.1)
+    emu.UpdateWireOuts()
+    print("photon, tdiff, TTL period, fifo words:", [emu.GetWireOutValue(ep) for ep in (0x20, 0x21, 0x22, 0x23)])
+    buff = bytearray(4 * (emu.GetWireOutValue(0x23) // 4 * 4))
+    emu.ReadFromPipeOut(0xA0, buff)
+    print("time differences:", np.frombuffer(buff, dtype=np.uint8)[:16])
+    emu.SetWireInValue(0x01, 0x01)
+    emu.UpdateWireIns()
+    emu.advance(0.1)
+    emu.ActivateTriggerIn(0x40, 0)
+    buff = bytearray(4 * HIST_BINS)
+    emu.ReadFromPipeOut(0xA1, buff)
+    counters = np.frombuffer(buff, dtype='<u4')
+    print("histogram mode: %d photons, counters[1:12] = %s ..." % (counters.sum(), counters[1:12]))
+    print("USB transactions:", emu.n_transactions)
+
+    # the FIFO readout over a slow USB link (2 ms per transaction, 1.25 MB/s), with 0.5 us of decoding per time difference:
+    # synchronous reads wait for each other, PipeReader fills the next buffer while the previous one is decoded.
+    import XEM7305_MicroMotion_Detector
+    for threaded in (False, True):
+        emu = FrontPanelEmulator(photon_rate=1e6, seed=1, latency=0.002, bandwidth=1.25e6)
+        dev = XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=emu, bit_file=__file__)
+        dev.reset_dev()
+        reader = XEM7305_MicroMotion_Detector.PipeReader(dev) if threaded else None
+        if (threaded):
+            reader.start()
+        n_events, t0 = 0, time.perf_counter()
+        while (time.perf_counter() - t0 < 2):
+            if (threaded):
+                chunk = reader.get(timeout=0.1)
+                buff = chunk[0] if chunk is not None else b''
+            else:
+                fifo_cnt = dev.probe_dev()[3]
+                buff = bytearray(4 * (fifo_cnt // 4 * 4))
+                dev.pipe_out(buff)
+            diff = np.frombuffer(buff, dtype=np.uint8)
+            np.histogram(107 - diff, 107)
+            time.sleep(diff.size * 0.5e-6) # the rest of the decoding and the rendering
+            n_events = n_events + diff.size
+        if (threaded):
+            reader.stop()
+        print("%s readout: %.2f M time differences/s of 1 M photons/s, %d USB transactions"
+              % ("threaded" if threaded else "synchronous", n_events / (time.perf_counter() - t0) * 1e-6, emu.n_transactions))
@@ -3,20 +3,119 @@ Module XEM7305_MicroMotion_Detector
 
 Usage: 
   todo
+  dev = XEM7305_MicroMotion_Detector(device=XEM7305_Emulator.FrontPanelEmulator())   # without a board
+  reader = PipeReader(dev); reader.start()   # the FIFO is read in a thread, reader.get_all() returns the filled buffers
+  dev = get_detector('2104000VK5')   # the open detector of a serial number, shared by the sessions of a process
   
+Errors of opening and configuring the device raise DetectorError subclasses. Transient ones (no device yet, open failure)
+are retried with backoff by init_dev().
 """
 
-import ok
+try:
+    import ok
+except ImportError: # no FrontPanel API, e.g. on Linux. A device (e.g. XEM7305_Emulator.FrontPanelEmulator) must be given.
+    ok = None
 import time
-import sys
 import ctypes
+import collections
+import threading
+import logging
 import numpy as np
+import MMD_Logging
+
+HIST_BINS = 256 # counters of the on-FPGA histogram, one per 8-bit time difference (the firmware may have more, see hist_bins)
+BYTES_PER_WIDE_DIFF = 2 # 16-bit mode: two time differences per 32-bit word
+WIDE_DTYPE = np.dtype('<u2') # 16-bit mode. The two time differences of a word come in the reverse order, which a histogram ignores.
+TIMESTAMP_BITS = 24
+TIMESTAMP_TICK = 128 * 9.92 # unit: ns. The timestamp counts 2^7 periods of okClk (100.8 MHz), it wraps every 21.3 s.
+BYTES_PER_EVENT = 4 # timestamped event mode: one 32-bit word per time difference
+DEAD_TIME_CLOCKS = 14 # unit: c_clk. cdc_c2g holds a detection 14 clocks, the photons meanwhile are lost (piled-up photons count as one).
+# a timestamped event word is (timestamp << 8) | diff, little-endian. Both fields are views of the same 4 bytes, no copy.
+PIPE_WORDS_MIN = 4 # a pipe out is a multiple of 16 bytes (USB 3.0), 4 words of the 32-bit FIFO
+READER_MAX_BYTES = 1 << 24 # unit: bytes. PipeReader reads ahead of the caller up to this much (128 FIFOs), more waits in the FIFO.
+READER_POLL = 0.005 # unit: s. PipeReader waits this long when the FIFO has less than PIPE_WORDS_MIN words.
+OPEN_RETRIES = 3 # init_dev() tries to open and configure the device 1 + OPEN_RETRIES times
+OPEN_BACKOFF = 0.5 # unit: s. The wait before the first retry, doubled for each next one
+OPEN_BACKOFF_MAX = 4. # unit: s
+FILE_ERROR = -7 # okCFrontPanel.FileError, returned by ConfigureFPGA for a missing or bad bit file
+# endpoint addresses of the firmware (top_mmd.v), replaced by the endpoints of a configuration profile (MMD_Config) for other builds
+ENDPOINTS = {'reset': 0x00, 'modes': 0x01, 'trigger': 0x40, 'photon_count': 0x20, 'tdiff_count': 0x21, 'ttl_period': 0x22,
+             'fifo_count': 0x23, 'build': 0x24, 'fifo_pipe': 0xA0, 'histogram_pipe': 0xA1}
+EVENT_DTYPE = np.dtype({'names': ['word', 'diff'], 'formats': ['<u4', 'u1'], 'offsets': [0, 0], 'itemsize': BYTES_PER_EVENT})
+RESTARTS_SUFFIX = '.restarts' # beside an event file: the events where the timestamps restart from 0 (a reset_dev, e.g. of a resume or a reconnect), one per line
+
+logger = logging.getLogger(MMD_Logging.LOGGER_NAME + '.Driver')
+
+class DetectorError(Exception):
+    """ Base class of the errors of the detector device. transient: the same call may succeed later (e.g. after a USB glitch). """
+    transient = False
+
+class FrontPanelMissingError(DetectorError):
+    """ The Opal Kelly FrontPanel API (ok) is not installed, and no device was given. """
+
+class DeviceNotFoundError(DetectorError):
+    """ No Opal Kelly device is connected. """
+    transient = True
+
+class DeviceOpenError(DetectorError):
+    """ The device of the serial number can't be opened, e.g. it is used by another process. """
+    transient = True
+
+class ConfigureError(DetectorError):
+    """ The FPGA can't be configured with the bit file. code: the error code of ConfigureFPGA. """
+    transient = True
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+        self.transient = code != FILE_ERROR # a bad bit file stays bad
+
+def unwrap_timestamps(ts, last=0):
+    """ 
+    Turn the wrapping TIMESTAMP_BITS-bit timestamps of consecutive events into int64 ticks, from the last tick of the previous call. 
+    Right as long as two consecutive events are less than one wrap (21.3 s) apart.
+    """
+    mask = (1 << TIMESTAMP_BITS) - 1
+    steps = np.diff(np.asarray(ts, dtype=np.int64), prepend=last & mask) & mask
+    return last + np.cumsum(steps)
+
+def load_restarts(path):
+    """ The events of an event file where the timestamps restart from 0, sorted, from path + RESTARTS_SUFFIX. [] without that file. """
+    try:
+        with open(path + RESTARTS_SUFFIX) as f:
+            return sorted({int(line) for line in f if line.strip()})
+    except FileNotFoundError:
+        return []
+
+def load_events(path):
+    """ 
+    Read the raw event words written in timestamped event mode (e.g. by MMD_GUI), return (ticks, diff). 
+    Each part after a restart (load_restarts()) continues from the last tick of the part before: the time in between is not counted.
+    """
+    events = np.fromfile(path, dtype=EVENT_DTYPE)
+    ts = events['word'] >> 8
+    bounds = [0] + [n for n in load_restarts(path) if 0 < n < ts.size] + [ts.size]
+    ticks = np.zeros(ts.size, dtype=np.int64)
+    last = 0
+    for begin, end in zip(bounds[:-1], bounds[1:]):
+        ticks[begin:end] = last + unwrap_timestamps(ts[begin:end])
+        if (end > begin):
+            last = int(ticks[end - 1])
+    return ticks, events['diff']
 
 class XEM7305_MicroMotion_Detector:
-    def __init__(self, dev_serial='', bit_file='micromotion_detector.bit', clock_period=2.173913):
+    def __init__(self, dev_serial='', bit_file='micromotion_detector.bit', clock_period=2.173913, device=None, endpoints=None):
+        self._device = device # an ok.okCFrontPanel, or an object with the same methods. Created by init_dev() if None.
+        self._ep = dict(ENDPOINTS, **(endpoints or {})) # endpoint addresses, by name
+        self._ts_last = 0 # the unwrapped timestamp of the last decoded event, unit: TIMESTAMP_TICK
         self._dev_serial = dev_serial # device serial of our FPGA is '2104000VK5'. Open the first FPGA if given a empty serial number ''. Get serial by _device.GetDeviceListSerial(0). 0 ~ the first device.
         self._bit_file = bit_file
         self._clock_period = clock_period
+        # the build of the firmware (top_mmd.v), read from wireOut 0x24 by init_dev()
+        self._data_bits = 8 # DATASIZE, bits of the time difference counter
+        self._fine_bits = 0 # FINE_BITS, sub-clock resolution
+        self._hist_bits = 8 # bits of the histogram counter address
+        self._trigger_reset = False # the firmware resets itself by triggerIn 0x40 bit1 (reset_sequencer.v)
+        self._wire_reset = False # reset held by wireIn 0x00 (clear_dev)
         self.init_dev()
 
     @property
@@ -35,69 +134,350 @@ class XEM7305_MicroMotion_Detector:
     def bit_file(self, bit_f):
         self._bit_file = bit_f
 
-    def init_dev(self):
-        self._device = ok.okCFrontPanel()
+    @property
+    def data_bits(self):
+        return self._data_bits
+
+    @property
+    def fine_bits(self):
+        return self._fine_bits
+
+    @property
+    def sampling_period(self):
+        """ unit: ns. The time resolution of the time differences in the histogram mode and the 16-bit mode, clock_period / 2^fine_bits. """
+        return self._clock_period / (1 << self._fine_bits)
+
+    @property
+    def hist_bins(self):
+        return 1 << self._hist_bits
+
+    def init_dev(self, retries=OPEN_RETRIES, backoff=OPEN_BACKOFF):
+        """ 
+        Open the device and configure the FPGA. Transient errors are retried up to retries times, waiting backoff seconds,
+        then twice as long each time (up to OPEN_BACKOFF_MAX). Raise a DetectorError if it still fails.
+        """
+        if (self._device is None):
+            if (ok is None):
+                raise FrontPanelMissingError("Opal Kelly FrontPanel API (ok) not found.")
+            self._device = ok.okCFrontPanel()
+        for attempt in range(retries + 1):
+            try:
+                self._open_dev()
+                return
+            except DetectorError as e:
+                if (not e.transient or attempt == retries):
+                    raise
+                logger.warning("%s Retry in %.1f s", e, backoff)
+            time.sleep(backoff)
+            backoff = min(2 * backoff, OPEN_BACKOFF_MAX)
+
+    def _open_dev(self):
+        """ Open the device by serial number and configure the FPGA, once. """
         if (self._device.GetDeviceCount() < 1):
-            sys.exit("Error: no Opal Kelly FPGA device.")
+            raise DeviceNotFoundError("No Opal Kelly FPGA device.")
         try: 
-            self._device.OpenBySerial(self.dev_serial)
-            error = self._device.ConfigureFPGA(self.bit_file)
-        except:
-            sys.exit("Error: can't open Opal Kelly FPGA device by serial number %s" % self.dev_serial)
+            error = self._device.OpenBySerial(self.dev_serial)
+        except Exception as e:
+            raise DeviceOpenError("Can't open Opal Kelly FPGA device by serial number %s: %s" % (self.dev_serial, e))
+        if ((error is not None and error < 0) or not self._device.IsOpen()):
+            raise DeviceOpenError("Can't open Opal Kelly FPGA device by serial number %s" % self.dev_serial)
+        error = self._device.ConfigureFPGA(self.bit_file)
         if (error != 0):
-            sys.exit("Error: can't program Opal Kelly FPGA device by file %s" % self.bit_file)
+            raise ConfigureError("Can't program Opal Kelly FPGA device by file %s (error %d)" % (self.bit_file, error), error)
+        self._device.UpdateWireOuts()
+        build = self._device.GetWireOutValue(self._ep['build']) # {self-timed reset, HISTSIZE, FINE_BITS, DATASIZE}. 0 from bitstreams without wireOut 0x24.
+        if (build != 0):
+            self._data_bits, self._fine_bits, self._hist_bits = build & 0xFF, (build >> 8) & 0xFF, (build >> 16) & 0xFF
+        self._trigger_reset = bool((build >> 24) & 0x01)
+        self._wire_reset = False # a configured FPGA starts with wireIn 0x00 = 0
+
+    def is_open(self):
+        """ False after the device is unplugged or has failed, until reconnect(). No USB transaction. """
+        return self._device.IsOpen()
+
+    def reconnect(self):
+        """ 
+        Open the device again after a disconnect (e.g. a cable glitch), and configure the FPGA, which restarts its counters.
+        Return True if it is open, False if the device is not back yet. The modes (set_*_mode) must be set again.
+        """
+        self.close()
+        try:
+            self._open_dev()
+        except DetectorError:
+            return False
+        self._ts_last = 0
+        return self.is_open()
+
+    def close(self):
+        try:
+            self._device.Close()
+        except Exception: # already gone
+            pass
 
     def reset_dev(self):
         """ 
         Set reset signals of fifo and counting circuits to 1s, to reset those circuits,
         then, de-assert the reset signals to 0s, to restart those circuits.
+        A firmware with reset_sequencer does the sequence by itself, in one USB transaction (two after clear_dev).
         """
-        self._device.SetWireInValue(0x00, 0x01) # reset = 1. To reset other circuits.
+        if (self._trigger_reset):
+            if (self._wire_reset): # release the reset held by clear_dev
+                self._device.SetWireInValue(self._ep['reset'], 0x00)
+                self._device.UpdateWireIns()
+                self._wire_reset = False
+            self._device.ActivateTriggerIn(self._ep['trigger'], 1) # reset and reset_fifo, then reset alone for 64 clocks (0.6 us), done before the next transaction
+            self._ts_last = 0 # the timestamp restarts from 0
+            return
+        self._device.SetWireInValue(self._ep['reset'], 0x01) # reset = 1. To reset other circuits.
         self._device.UpdateWireIns()
-        self._device.SetWireInValue(0x00, 0x02) # reset_fifo = 1. To reset FIFO only
+        self._device.SetWireInValue(self._ep['reset'], 0x03) # reset_fifo = 1. To reset FIFO, reset kept at 1: nothing is written into the FIFO before the last de-assertion, so no event is timestamped before the restart.
         self._device.UpdateWireIns()
-        self._device.SetWireInValue(0x00, 0x00) # de-assertion reset_fifo signal
+        self._device.SetWireInValue(self._ep['reset'], 0x01) # de-assertion reset_fifo signal
         self._device.UpdateWireIns()
         time.sleep(0.001) # After Reset de-assertion, wait at least 30 clock cycles before asserting WE/RE signals.
-        self._device.SetWireInValue(0x00, 0x01) # reset = 1. To reset other circuits.
-        self._device.UpdateWireIns()
-        self._device.SetWireInValue(0x00, 0x00) # de-assertion reset signal
+        self._device.SetWireInValue(self._ep['reset'], 0x00) # de-assertion reset signal
         self._device.UpdateWireIns()
+        self._wire_reset = False
+        self._ts_last = 0 # the timestamp restarts from 0
         
     def clear_dev(self):
         """ 
         Set reset signals of fifo and counting circuits to 1s, to reset those circuits,
         without de-asserting the reset signals to 0s. Those circuits are reset without restart.
         """
-        self._device.SetWireInValue(0x00, 0x02) # reset_fifo = 1. To reset FIFO only
+        self._device.SetWireInValue(self._ep['reset'], 0x02) # reset_fifo = 1. To reset FIFO only
         self._device.UpdateWireIns()
-        self._device.SetWireInValue(0x00, 0x01) # reset = 1. To reset other circuits.
+        self._device.SetWireInValue(self._ep['reset'], 0x01) # reset = 1. To reset other circuits.
         self._device.UpdateWireIns()
+        self._wire_reset = True # until reset_dev()
         
         
         
     def pipe_out(self, buff):
-        self._device.ReadFromPipeOut(0xA0, buff) 
-        
+        """ Return the number of bytes read, or a negative error code of okCFrontPanel (e.g. the device is unplugged). """
+        return self._device.ReadFromPipeOut(self._ep['fifo_pipe'], buff)
+
+    def pipe_out_block(self, buff, block_size):
+        """ As pipe_out(), in blocks of block_size bytes (a power of 2, 16 ~ 16384, dividing len(buff)), the pipe is an okBTPipeOut. """
+        return self._device.ReadFromBlockPipeOut(self._ep['fifo_pipe'], block_size, buff)
+
     def photon_count(self):
         self._device.UpdateWireOuts()
-        return self._device.GetWireOutValue(0x20)
+        return self._device.GetWireOutValue(self._ep['photon_count'])
     
     def tdiff_count(self):
         self._device.UpdateWireOuts()
-        return self._device.GetWireOutValue(0x21)
+        return self._device.GetWireOutValue(self._ep['tdiff_count'])
     
     def TTL_period(self):
         self._device.UpdateWireOuts()
-        return self._device.GetWireOutValue(0x22)
+        return self._device.GetWireOutValue(self._ep['ttl_period'])
 
     def fifo_r_count(self):
         self._device.UpdateWireOuts()
-        return self._device.GetWireOutValue(0x23)
+        return self._device.GetWireOutValue(self._ep['fifo_count'])
         
     def probe_dev(self):
         self._device.UpdateWireOuts()
-        return self._device.GetWireOutValue(0x20), self._device.GetWireOutValue(0x21), self._device.GetWireOutValue(0x22), self._device.GetWireOutValue(0x23)
+        return self._device.GetWireOutValue(self._ep['photon_count']), self._device.GetWireOutValue(self._ep['tdiff_count']), self._device.GetWireOutValue(self._ep['ttl_period']), self._device.GetWireOutValue(self._ep['fifo_count'])
+
+    def set_modes(self, histogram=False, timestamp=False, wide=False):
+        """ Set the histogram mode, the timestamp mode and the 16-bit mode in one USB transaction. See set_*_mode(). """
+        self._device.SetWireInValue(self._ep['modes'], (0x01 if histogram else 0x00) | (0x02 if timestamp else 0x00) | (0x04 if wide else 0x00), 0x07)
+        self._device.UpdateWireIns()
+
+    def set_histogram_mode(self, enable):
+        """ 
+        enable = True: time differences are accumulated in the histogram counters on the FPGA (firmware/histogram_accum.v), 
+        the FIFO gets nothing. enable = False: time differences go through the FIFO, read by pipe_out().
+        """
+        self._device.SetWireInValue(self._ep['modes'], 0x01 if enable else 0x00, 0x01)
+        self._device.UpdateWireIns()
+
+    def set_timestamp_mode(self, enable):
+        """ 
+        enable = True: each time difference goes through the FIFO as a 32-bit word with a coarse timestamp (firmware/timestamp_tagger.v),
+        decoded by decode_events(). Set it before reset_dev(), which aligns the FIFO to whole events. The histogram mode has priority.
+        """
+        self._device.SetWireInValue(self._ep['modes'], 0x02 if enable else 0x00, 0x02)
+        self._device.UpdateWireIns()
+
+    def set_wide_mode(self, enable):
+        """ 
+        enable = True: each time difference goes through the FIFO as 16 bits, all the data_bits + fine_bits bits, read as WIDE_DTYPE.
+        For TTL periods of 256 clocks or more, and for the sub-clock bits. enable = False: 8 bits, the most time differences per USB byte.
+        Set it before reset_dev(), which aligns the FIFO to whole time differences. The histogram mode and the timestamp mode have priority.
+        """
+        self._device.SetWireInValue(self._ep['modes'], 0x04 if enable else 0x00, 0x04)
+        self._device.UpdateWireIns()
+
+    def decode_events(self, buff):
+        """ 
+        Decode the pipe out data of the timestamped event mode: return (ticks, diff), 
+        the unwrapped timestamps (int64, unit: TIMESTAMP_TICK, from the last reset_dev) and the time differences (uint8 view of buff).
+        Consecutive buffers must be decoded in order.
+        """
+        events = np.frombuffer(buff, dtype=EVENT_DTYPE)
+        ticks = unwrap_timestamps(events['word'] >> 8, self._ts_last)
+        if (ticks.size > 0):
+            self._ts_last = int(ticks[-1])
+        return ticks, events['diff']
+
+    def read_histogram(self, buff=None):
+        """ 
+        Swap the histogram banks and pipe out the frozen one: hist_bins 32-bit counters, counters[d] photons with c_diff == d,
+        d in units of sampling_period.
+        The swap is atomic on the FPGA, no photon is lost or counted twice between two readouts, and the frozen bank
+        is cleared after readout, so each readout holds the photons since the previous one.
+        The cost is 2 USB transactions and 4*hist_bins bytes, whatever the photon rate.
+        Return None if the readout failed (e.g. the device is unplugged).
+        """
+        if (buff is None):
+            buff = bytearray(4 * self.hist_bins)
+        if (self._device.ActivateTriggerIn(self._ep['trigger'], 0) < 0): # swap. Without it the pipe would give the bank read last time again.
+            return None
+        if (self._device.ReadFromPipeOut(self._ep['histogram_pipe'], buff) < 0):
+            return None
+        return np.frombuffer(buff, dtype='<u4')
+
+
+_registry = {} # serial number: the open XEM7305_MicroMotion_Detector, shared in this process
+_registry_lock = threading.Lock()
+
+def get_detector(dev_serial='', bit_file='micromotion_detector.bit', **kwargs):
+    """ 
+    Return the detector of a serial number from the registry, opened and configured once per process, so sessions
+    (e.g. MMD runs, or the instruments of a control service) reuse the handle instead of reopening and reprogramming.
+    A registered detector which was disconnected is reconnected. kwargs (e.g. device) are for a new detector.
+    """
+    with _registry_lock:
+        det = _registry.get(dev_serial)
+        if (det is None):
+            det = XEM7305_MicroMotion_Detector(dev_serial=dev_serial, bit_file=bit_file, **kwargs)
+            _registry[dev_serial] = det
+        elif (det.bit_file != bit_file): # another firmware on the same board
+            det.bit_file = bit_file
+            det.close()
+            det.init_dev()
+        elif (not det.is_open() and not det.reconnect()):
+            det.init_dev() # with retries, raise if the device is still not back
+        return det
+
+def release_detector(det):
+    """ Close the device of a detector, and remove it from the registry. """
+    with _registry_lock:
+        for serial in [s for s, d in _registry.items() if d is det]:
+            del _registry[serial]
+    det.close()
+
+
+class PipeReader:
+    """ 
+    Multi-buffered readout of the FIFO (pipeOut 0xA0): a thread probes the FIFO and pipes its words out,
+    so one buffer is filled over USB while the previous ones are decoded and histogrammed by the caller.
+    The transfers use ReadFromPipeOutThr (which releases the GIL) when the device has it.
+    The look-ahead is capped in bytes, not in buffers: the thread keeps reading while fewer than max_bytes are waiting,
+    so a caller behind by a few updates is absorbed by the host memory instead of the FIFO. Beyond max_bytes the thread
+    waits and the FIFO keeps the data, as with synchronous reads.
+    While the reader runs, the device must not be used by other threads: stop() it before changing modes or resetting.
+    min_words: the thread waits until the FIFO has at least this many words, fewer and larger transfers (a multiple of PIPE_WORDS_MIN).
+    The transfers are counted (n_transfers, bytes_read, transfer_time, transfer_time_max, fifo_max, queued_max), e.g. for a calibration.
+    lost: the device was found closed (unplugged, or failed) by the thread, which then ends. Its caller must not use the
+    device to find that out while the thread runs.
+    """
+    def __init__(self, detector, max_bytes=READER_MAX_BYTES, poll=READER_POLL, min_words=PIPE_WORDS_MIN):
+        self._detector = detector
+        self._device = detector._device
+        self._read = getattr(self._device, 'ReadFromPipeOutThr', self._device.ReadFromPipeOut)
+        self._filled = collections.deque() # (buff, status), in order
+        self._queued = 0 # unit: bytes, in self._filled
+        self._cond = threading.Condition()
+        self._max_bytes = max_bytes
+        self._poll = poll
+        self._min_words = max(PIPE_WORDS_MIN, min_words // PIPE_WORDS_MIN * PIPE_WORDS_MIN)
+        self._stop = threading.Event()
+        self._thread = None
+        self.status = (0, 0, 0, 0) # the last probe: photon count, tdiff count, TTL period, fifo words
+        self.n_errors = 0 # failed transfers (e.g. Timeout)
+        self.n_transfers = 0
+        self.bytes_read = 0
+        self.transfer_time = 0. # unit: s. The sum of the transfers, and the longest one.
+        self.transfer_time_max = 0.
+        self.fifo_max = 0 # unit: words. The most probed in the FIFO.
+        self.queued_max = 0 # unit: bytes. The most read and waiting for the caller.
+        self.lost = False
+
+    def start(self):
+        if (hasattr(self._device, 'EnableAsynchronousTransfers')):
+            self._device.EnableAsynchronousTransfers(True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='PipeReader', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the thread after its current transfer. Return the filled buffers not yet taken, a list of (buff, status). """
+        if (self._thread is not None):
+            self._stop.set()
+            with self._cond:
+                self._cond.notify_all() # wake a thread waiting for the caller
+            self._thread.join()
+            self._thread = None
+        return self.get_all()
+
+    def is_running(self):
+        return self._thread is not None
+
+    def _run(self):
+        while (not self._stop.is_set()):
+            with self._cond:
+                while (self._queued >= self._max_bytes and not self._stop.is_set()): # the caller is far behind: the FIFO keeps the data
+                    self._cond.wait(self._poll)
+            if (self._stop.is_set()):
+                break
+            if (not self._device.IsOpen()): # no USB transaction
+                self.lost = True
+                break
+            self.status = self._detector.probe_dev()
+            self.fifo_max = max(self.fifo_max, self.status[3])
+            words = self.status[3] // PIPE_WORDS_MIN * PIPE_WORDS_MIN
+            if (words < self._min_words):
+                self._stop.wait(self._poll)
+                continue
+            buff = bytearray(4 * words)
+            t = time.perf_counter()
+            if (self._read(self._detector._ep['fifo_pipe'], buff) < 0):
+                self.n_errors = self.n_errors + 1
+                self._stop.wait(self._poll)
+                continue
+            t = time.perf_counter() - t
+            self.n_transfers = self.n_transfers + 1
+            self.bytes_read = self.bytes_read + len(buff)
+            self.transfer_time = self.transfer_time + t
+            self.transfer_time_max = max(self.transfer_time_max, t)
+            with self._cond:
+                self._filled.append((buff, self.status))
+                self._queued = self._queued + len(buff)
+                self.queued_max = max(self.queued_max, self._queued)
+                self._cond.notify_all()
+
+    def get(self, timeout=None):
+        """ Return the next filled buffer and the probe before its transfer, (buff, status), or None after timeout. """
+        with self._cond:
+            if (not self._cond.wait_for(lambda: self._filled, timeout)):
+                return None
+            buff, status = self._filled.popleft()
+            self._queued = self._queued - len(buff)
+            self._cond.notify_all()
+            return buff, status
+
+    def get_all(self):
+        """ Return the filled buffers so far, in order, without waiting. A list of (buff, status). """
+        with self._cond:
+            chunks = list(self._filled)
+            self._filled.clear()
+            self._queued = 0
+            self._cond.notify_all()
+            return chunks
 
 
 # here are demos for the using this module.        
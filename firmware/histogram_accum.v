@@ -0,0 +1,133 @@
+`timescale 1ns / 1ps
+//////////////////////////////////////////////////////////////////////////////////
+// Company:
+// Engineer:
+//
+// Create Date: 10/19/2026 10:00:00 AM
+// Design Name:
+// Module Name: histogram_accum
+// Project Name:
+// Target Devices:
+// Tool Versions:
+// Description:
+//   Histogram accumulation on the FPGA, an alternative to sending every time difference through the FIFO.
+//   Each time difference (c_diff, synchronized to the global domain) increments one of 2^DATASIZE
+//   32-bit counters in a block RAM, so the host reads 2^DATASIZE words per update whatever the photon rate.
+//   The RAM holds two banks. One bank accumulates (port A, read-modify-write), the other one is frozen
+//   for the host to pipe out (port B). g_swap exchanges the banks in one clock, so no photon is lost or
+//   counted twice. After the frozen bank is read out, port B clears it, ready for the next swap.
+//   Photons are at least 14 c_clk (~3 g_clk) apart (cdc_c2g hold time), the 2-clock read-modify-write
+//   of port A is always finished before the next g_valid.
+//   This module runs in global clock domain, using g_ prefix.
+// Dependencies:
+//
+// Revision:
+// Revision 0.01 - File Created
+// Additional Comments:
+//   Pipe out timing (okPipeOut): like a standard FIFO read, the word is on g_rd_data the clock after g_rd_strobe.
+//////////////////////////////////////////////////////////////////////////////////
+
+
+module histogram_accum #(parameter DATASIZE = 8, COUNTSIZE = 32)
+(
+  input g_clk,
+  input g_rst,
+  input g_valid, // one clock pulse for each time difference
+  input [ DATASIZE-1 : 0 ] g_diff, // the bin to increment
+  input g_swap, // one clock pulse: freeze the accumulating bank for readout, accumulate in the cleared bank
+  input g_rd_strobe, // ep_read of the pipe out
+  output reg [ COUNTSIZE-1 : 0 ] g_rd_data,
+  output g_busy // 1 while clearing, a swap is delayed until the clear is done
+    );
+
+localparam NBINS = 1 << DATASIZE;
+localparam IDLE = 2'd0,
+           READ = 2'd1, // host is reading the frozen bank out
+           CLEAR = 2'd2; // zeroing a bank through port B
+
+(* ram_style = "block" *) reg [ COUNTSIZE-1 : 0 ] g_mem [ 0 : 2*NBINS-1 ];
+
+reg g_bank; // the accumulating bank. The frozen bank is ~g_bank.
+reg g_swap_pending;
+
+reg g_clear_all; // clearing both banks after a reset, no accumulation meanwhile
+wire g_acc = g_valid && !g_clear_all;
+
+// port A: read-modify-write of the accumulating bank. One address: g_acc and g_inc are never in the same clock.
+reg g_inc; // second clock of the read-modify-write
+reg [ DATASIZE-1 : 0 ] g_inc_addr;
+reg [ COUNTSIZE-1 : 0 ] g_a_data;
+wire [ DATASIZE : 0 ] g_a_addr = g_inc ? {g_bank, g_inc_addr} : {g_bank, g_diff};
+always @(posedge g_clk) begin
+  if (g_inc) g_mem[g_a_addr] <= g_a_data + 1; // write
+  else g_a_data <= g_mem[g_a_addr]; // read, used in the next clock if g_acc
+end
+
+always @(posedge g_clk, posedge g_rst) begin
+  if (g_rst) begin
+    g_inc <= 0;
+    g_inc_addr <= 0;
+  end
+  else begin
+    g_inc <= g_acc;
+    if (g_acc) g_inc_addr <= g_diff;
+  end
+end
+
+// port B: readout and clear of the frozen bank (both banks after a reset)
+reg [1:0] g_state;
+reg [ DATASIZE : 0 ] g_b_addr; // DATASIZE+1 bits: a reset clears 2 banks
+wire [ DATASIZE : 0 ] g_b_mem_addr = (g_state == CLEAR && g_clear_all) ? g_b_addr : {~g_bank, g_b_addr[ DATASIZE-1 : 0 ]};
+always @(posedge g_clk) begin
+  if (g_state == CLEAR) g_mem[g_b_mem_addr] <= 0;
+  else if (g_rd_strobe) g_rd_data <= g_mem[g_b_mem_addr];
+end
+
+always @(posedge g_clk, posedge g_rst) begin
+  if (g_rst) begin
+    g_state <= CLEAR;
+    g_clear_all <= 1;
+    g_b_addr <= 0;
+    g_bank <= 0;
+    g_swap_pending <= 0;
+  end
+  else begin
+    if (g_swap) g_swap_pending <= 1;
+    case (g_state)
+      IDLE: begin
+        if ((g_swap || g_swap_pending) && !g_inc && !g_acc) begin // not in the middle of a read-modify-write
+          g_bank <= ~g_bank;
+          g_swap_pending <= 0;
+          g_b_addr <= 0;
+          g_state <= READ;
+        end
+      end
+      READ: begin
+        if (g_rd_strobe) begin
+          if (g_b_addr[ DATASIZE-1 : 0 ] == NBINS - 1) begin // last word read out
+            g_b_addr <= 0;
+            g_state <= CLEAR;
+          end
+          else g_b_addr <= g_b_addr + 1;
+        end
+        else if (g_swap) begin // the host gave up reading, the frozen bank is cleared before the next swap
+          g_b_addr <= 0;
+          g_state <= CLEAR;
+        end
+      end
+      CLEAR: begin
+        if ((g_clear_all && g_b_addr == 2*NBINS - 1) || (!g_clear_all && g_b_addr == NBINS - 1)) begin
+          g_b_addr <= 0;
+          g_clear_all <= 0;
+          g_state <= IDLE;
+        end
+        else g_b_addr <= g_b_addr + 1;
+      end
+      default: g_state <= IDLE;
+    endcase
+  end
+end
+
+assign g_busy = (g_state == CLEAR);
+
+endmodule
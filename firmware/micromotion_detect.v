@@ -10,9 +10,11 @@
 // Target Devices: 
 // Tool Versions: 
 // Description: 
-// 
+//   FINE_BITS = 0: the time difference is counted in c_clk periods, by edge_detect.
+//   FINE_BITS = 1 or 2: the edges are captured by multiphase_capture, c_diff has FINE_BITS more bits,
+//     counted in c_clk period / 2^FINE_BITS. c_ch2_period is in c_clk periods in any case.
 // Dependencies: 
-// 
+//   edge_detect.v, multiphase_capture.v
 // Revision:
 // Revision 0.01 - File Created
 // Additional Comments:
@@ -20,23 +22,39 @@
 //////////////////////////////////////////////////////////////////////////////////
 
 
-module micromotion_detect #(parameter DATASIZE = 8, COUNTSIZE = 32)
+module micromotion_detect #(parameter DATASIZE = 8, COUNTSIZE = 32, FINE_BITS = 0)
 (
   input c_clk,
+  input c_clk90, // c_clk shifted by 90 degrees, used if FINE_BITS == 2
   input c_rst,
   input c_ch1, //ch1 is the photon pulses from PMT, 
   input c_ch2, //ch2 is the Square Wave trig'd by the Sin Wave.
   output reg c_detect,
   output reg [ DATASIZE-1 : 0 ] c_ch2_period,
-  output reg [ DATASIZE-1 : 0 ] c_diff,
+  output reg [ DATASIZE+FINE_BITS-1 : 0 ] c_diff,
   output reg [ COUNTSIZE-1 : 0 ] c_diff_count 
     );
   
 reg [ DATASIZE-1 : 0 ] c_count;
 reg c_start_count;
 wire c_ch1_pedge, c_ch2_pedge; 
-edge_detect ed1(.clk(c_clk), .trig(c_ch1), .pos_edge(c_ch1_pedge), .neg_edge());
-edge_detect ed2(.clk(c_clk), .trig(c_ch2), .pos_edge(c_ch2_pedge), .neg_edge());
+wire [ DATASIZE+FINE_BITS-1 : 0 ] c_ch1_fine, c_ch2_fine; // phase of the edges in the clock, 0 if FINE_BITS == 0
+reg [ DATASIZE+FINE_BITS-1 : 0 ] c_ch2_fine_reg; // phase of the last ch2 edge
+generate
+  if (FINE_BITS == 0) begin : coarse
+    edge_detect ed1(.clk(c_clk), .trig(c_ch1), .pos_edge(c_ch1_pedge), .neg_edge());
+    edge_detect ed2(.clk(c_clk), .trig(c_ch2), .pos_edge(c_ch2_pedge), .neg_edge());
+    assign c_ch1_fine = 0;
+    assign c_ch2_fine = 0;
+  end
+  else begin : fine
+    wire [ FINE_BITS-1 : 0 ] c_ch1_ph, c_ch2_ph;
+    multiphase_capture #(FINE_BITS) mc1(.c_clk(c_clk), .c_clk90(c_clk90), .c_in(c_ch1), .c_pos_edge(c_ch1_pedge), .c_fine(c_ch1_ph));
+    multiphase_capture #(FINE_BITS) mc2(.c_clk(c_clk), .c_clk90(c_clk90), .c_in(c_ch2), .c_pos_edge(c_ch2_pedge), .c_fine(c_ch2_ph));
+    assign c_ch1_fine = c_ch1_ph;
+    assign c_ch2_fine = c_ch2_ph;
+  end
+endgenerate
 
 always @(posedge c_clk, posedge c_rst) begin
   if (c_rst) begin
@@ -46,6 +64,7 @@ always @(posedge c_clk, posedge c_rst) begin
     c_count <= 0; 
     c_start_count <= 0;
     c_ch2_period <= 0;
+    c_ch2_fine_reg <= 0;
   end 
   else begin
     if (c_ch2_pedge) begin
@@ -53,12 +72,13 @@ always @(posedge c_clk, posedge c_rst) begin
         c_ch2_period <= c_count; // output ch2 period in the number of clocks
       end
       c_count <= 1; //restart counter for each ch2 rising edge.
+      c_ch2_fine_reg <= c_ch2_fine;
       c_start_count <= 1;
     end 
     else if (c_start_count) c_count <= c_count + 1;
     if (c_ch1_pedge && c_start_count) begin
       c_detect <= 1'b1; // a ch1 (photon)  pulse detected
-      c_diff <= c_count; // output the number of clocks from ch1 rising to ch2 rising, it should be converted to the number of clocks from ch2 to ch1.
+      c_diff <= (c_count << FINE_BITS) + c_ch1_fine - c_ch2_fine_reg; // output the number of clocks (or 1/2^FINE_BITS clocks) from ch1 rising to ch2 rising, it should be converted to the number of clocks from ch2 to ch1.
       c_diff_count <= c_diff_count + 1; // increase the number of photon detected.
     end
     if (c_detect) c_detect <= 0; //make the c_detect signal as a one-clock pulse.
@@ -0,0 +1,186 @@
+`timescale 1ns / 1ps
+//////////////////////////////////////////////////////////////////////////////////
+// Company:
+// Engineer:
+//
+// Create Date: 10/19/2026 02:00:00 PM
+// Design Name:
+// Module Name: mmd_core
+// Project Name:
+// Target Devices:
+// Tool Versions:
+// Description:
+//   The datapath of the MicroMotion Detector, between the clocks and the Opal Kelly endpoints:
+//   photon counter, micromotion_detect, CDC, FIFO, timestamp_tagger and histogram_accum.
+//   top_mmd connects it to okHost. The co-simulation harness (sim/cosim_main.cpp) drives it directly,
+//   with the same endpoint signals, so the Python driver can run against the RTL.
+//   FINE_BITS > 0: sub-clock time differences (micromotion_detect, multiphase_capture), DATASIZE+FINE_BITS bits wide.
+//     The histogram and the 16-bit mode get all the bits, the 8-bit mode and the timestamped events get the time difference
+//     in c_clk periods (rounded down, so 0 ~ ch2 period instead of 1 ~ ch2 period).
+//   16-bit mode (wireIn 0x01 bit2): each time difference is written into the FIFO as 2 bytes, high byte first,
+//     so a FIFO read word holds 2 time differences. It carries all DATASIZE+FINE_BITS bits (up to 16), for TTL periods
+//     of 256 clocks or more (DATASIZE > 8) and for the sub-clock bits. The 8-bit mode writes the low 8 bits of the
+//     c_clk periods, 4 per word, the most time differences per USB byte.
+//   The histogram has 2^HISTSIZE counters, HISTSIZE = DATASIZE+FINE_BITS up to 12 (block RAM), larger time
+//     differences are counted in the last counter.
+//   triggerIn 0x40 bit1 starts a self-timed reset (reset_sequencer), the same as the wireIn 0x00 sequence in one USB transaction.
+//   wireOut 0x24 tells the host the build: {7'd0, self-timed reset, HISTSIZE, FINE_BITS, DATASIZE}.
+// Dependencies:
+//   micromotion_detect.v, multiphase_capture.v, photon_counter.v, cdc_c2g.v, cdc_g2ram.v, sync2ff.v, sync3ff.v, edge_detect.v,
+//   timestamp_tagger.v, histogram_accum.v, reset_sequencer.v, fifo_generator_0 (IP, or sim/fifo_generator_0.v in simulation)
+// Revision:
+// Revision 0.01 - File Created (moved from top_mmd)
+// Additional Comments:
+//
+//////////////////////////////////////////////////////////////////////////////////
+
+module mmd_core #(parameter DATASIZE = 8, COUNTSIZE = 32, FINE_BITS = 0)
+(
+  input c_clk,
+  input c_clk90, // c_clk shifted by 90 degrees, used if FINE_BITS == 2
+  input g_clk,
+  input c_ch1,
+  input c_ch2,
+  input [31:0] ep00wire, // wireIn 0x00: bit0 reset, bit1 reset_fifo
+  input [31:0] ep01wire, // wireIn 0x01: bit0 histogram mode, bit1 timestamped event mode, bit2 16-bit mode
+  input [31:0] ep40trig, // triggerIn 0x40: bit0 histogram swap, bit1 self-timed reset
+  output [31:0] ep20wire, // photon count
+  output [31:0] ep21wire, // diff count
+  output [31:0] ep22wire, // ch2 period
+  output reg [31:0] ep23wire, // FIFO words ready to pipe out
+  output [31:0] ep24wire, // build parameters
+  input g_piperead, // pipeOut 0xA0
+  output [31:0] pipeO_data,
+  output reg g_pipeO_ready,
+  input g_hist_read, // pipeOut 0xA1
+  output [31:0] g_hist_data
+    );
+
+localparam DIFFSIZE = DATASIZE + FINE_BITS; // bits of a time difference, up to 16
+localparam HISTSIZE = (DIFFSIZE > 12) ? 12 : DIFFSIZE; // bits of a histogram counter address
+
+wire c_rst;
+wire g_rst, g_rst_fifo;
+
+localparam [7:0] HISTSIZE_8 = HISTSIZE, FINE_BITS_8 = FINE_BITS, DATASIZE_8 = DATASIZE;
+assign ep24wire = {7'd0, 1'b1, HISTSIZE_8, FINE_BITS_8, DATASIZE_8}; // bit24: triggerIn 0x40 bit1 resets
+
+wire g_seq_rst, g_seq_rst_fifo;
+reset_sequencer #(16, 64) reset_seq(.g_clk(g_clk), .g_start(ep40trig[1]), .g_rst(g_seq_rst), .g_rst_fifo(g_seq_rst_fifo));
+
+assign g_rst = ep00wire[0] | g_seq_rst;
+assign g_rst_fifo = ep00wire[1] | g_seq_rst_fifo; //FIFO reset signal receive from PC. After FIFO reset, waiting for 30 clcoks to allow asserting WE/RE signals. On PC, first reset FIFO, then wait 0.001 s, then reset.
+assign c_rst = g_rst;
+
+// Mode (wireIn 0x01) and triggers (triggerIn 0x40) from PC
+wire g_hist_mode, g_ts_mode, g_wide_mode, g_hist_swap;
+assign g_hist_mode = ep01wire[0]; // 1: time differences are histogrammed on the FPGA (histogram_accum), not written into the FIFO
+assign g_ts_mode = ep01wire[1]; // 1: a 32-bit word per time difference, with a coarse timestamp (timestamp_tagger)
+assign g_wide_mode = ep01wire[2]; // 1: 2 bytes per time difference in the FIFO. The histogram mode and the timestamp mode have priority.
+assign g_hist_swap = ep40trig[0]; // freeze the accumulated histogram for the pipe out 0xA1
+
+// Photon Counter
+wire [ COUNTSIZE-1 : 0 ] g_photon_cnt;
+assign ep20wire = g_photon_cnt; // for wireOut photon count
+photon_counter #(COUNTSIZE) photon_counter(.g_rst(g_rst), .g_clk(g_clk), .g_ch1(c_ch1), .g_photon_cnt(g_photon_cnt));
+
+// MicroMotion Detector
+wire g_valid;
+wire c_detect, c_detect_c2g;
+wire [ DIFFSIZE-1 : 0 ] c_diff, c_diff_c2g;
+wire [ DATASIZE-1 : 0 ] c_ch2_period, c_ch2_period_sync2ff;
+wire [ COUNTSIZE-1 : 0 ] c_diff_count, c_diff_count_c2g;
+micromotion_detect #(DATASIZE, COUNTSIZE, FINE_BITS) mmd(.c_clk(c_clk), .c_clk90(c_clk90), .c_rst(c_rst), .c_ch1(c_ch1), .c_ch2(c_ch2),
+    .c_detect(c_detect), .c_ch2_period(c_ch2_period), .c_diff(c_diff), .c_diff_count(c_diff_count));
+
+sync2ff #(.N(DATASIZE)) sync_ch2_period(.clk(g_clk), .rst(g_rst), .d(c_ch2_period), .q(c_ch2_period_sync2ff)); //sync 2 flip_flops to deal metastablility problem
+assign ep22wire = {{(32-DATASIZE){1'b0}}, c_ch2_period_sync2ff}; // for wireOut ch2 period
+
+// CDC (Clock Domain Crossing)
+wire [ DIFFSIZE-1 : 0 ] g_sync2_diff;
+wire [ DATASIZE-1 : 0 ] g_sync2_diff_clk = g_sync2_diff >> FINE_BITS; // in c_clk periods, for the 8-bit FIFO and the timestamped events
+wire [15:0] g_wide_diff = g_sync2_diff; // for the 16-bit mode
+wire [ COUNTSIZE-1 : 0 ] g_sync2_diff_count;
+
+cdc_c2g #(DIFFSIZE, COUNTSIZE) cdc_c2g(.c_clk(c_clk), .c_rst(c_rst),
+    .c_detect(c_detect), .c_diff(c_diff), .c_diff_count(c_diff_count),
+    .c_detect_c2g(c_detect_c2g), .c_diff_c2g(c_diff_c2g), .c_diff_count_c2g(c_diff_count_c2g));
+cdc_g2ram #(DIFFSIZE, COUNTSIZE) cdc_g2ram(.g_clk(g_clk), .g_rst(g_rst),
+    .c_detect_c2g(c_detect_c2g), .c_diff_c2g(c_diff_c2g), .c_diff_count_c2g(c_diff_count_c2g),
+    .g_valid(g_valid), .g_sync2_diff(g_sync2_diff), .g_sync2_diff_count(g_sync2_diff_count));
+
+assign ep21wire = g_sync2_diff_count;  // for wireOut diff count
+
+// FIFO
+wire g_fifofull, g_fifoempty;
+wire [17:0] g_fifodatacount_w;
+wire [15:0] g_fifodatacount_r;
+wire [31:0] g_fifo_out;
+
+wire g_goot_to_wr, g_good_to_rd;
+assign g_goot_to_wr = (g_fifodatacount_w < 131072 - 128); //HARD CODING. Write data bus is 8 bits.
+assign g_good_to_rd = (g_fifodatacount_r > 0); // HARD CODING. Read data bus is 32 bits.
+
+// Timestamped events: 4 bytes per time difference
+wire g_ts_wren;
+wire [7:0] g_ts_byte;
+timestamp_tagger #(8, 24, 7) ts_tagger(.g_clk(g_clk), .g_rst(g_rst),
+    .g_valid(g_valid && g_ts_mode && !g_hist_mode), .g_diff(g_sync2_diff_clk[7:0]), .g_good_to_wr(g_goot_to_wr),
+    .g_wren(g_ts_wren), .g_byte(g_ts_byte), .g_lost());
+
+reg g_wren; // For FIFO write
+reg [7:0] g_reg_fifo_in;
+reg g_low_pending; // 16-bit mode: the low byte is written in the clock after the high byte
+reg [7:0] g_low_byte;
+always @(posedge g_clk, posedge g_rst_fifo) begin
+  if (g_rst_fifo) begin
+    g_wren <= 0;
+    g_pipeO_ready <= 0;
+    g_low_pending <= 0;
+  end
+  else begin
+    if (g_ts_mode) begin
+      g_wren <= g_ts_wren && !g_hist_mode;
+      g_reg_fifo_in <= g_ts_byte; // timestamp and time difference, a byte per clock
+    end
+    else if (g_low_pending) begin
+      g_wren <= 1;
+      g_reg_fifo_in <= g_low_byte;
+      g_low_pending <= 0;
+    end
+    else if (g_valid && g_goot_to_wr && !g_hist_mode) begin // photons are at least ~3 g_clk apart, after the low byte
+      g_wren <= 1;
+      if (g_wide_mode) begin
+        g_reg_fifo_in <= g_wide_diff[15:8];
+        g_low_byte <= g_wide_diff[7:0];
+        g_low_pending <= 1;
+      end
+      else g_reg_fifo_in <= g_sync2_diff_clk[7:0]; // data to be written into FIFO
+    end
+    else g_wren <= 0;
+
+    if (g_good_to_rd) g_pipeO_ready <= 1;
+    else g_pipeO_ready <= 0;
+  end
+end
+
+
+fifo_generator_0 fifo(.clk(g_clk), .srst(g_rst_fifo),
+    .din(g_reg_fifo_in), .wr_en(g_wren), .rd_en(g_piperead), .dout(g_fifo_out),
+    .full(g_fifofull), .empty(g_fifoempty), .wr_data_count(g_fifodatacount_w),
+    .rd_data_count(g_fifodatacount_r));
+
+always @(posedge g_clk) begin
+  ep23wire <= {16'd0, g_fifodatacount_r}; // store in reg for output
+end
+
+assign pipeO_data = g_fifo_out;
+
+// Histogram on the FPGA: 2^HISTSIZE 32-bit counters, read out by pipeOut 0xA1 after a swap.
+wire g_hist_busy;
+wire [ HISTSIZE-1 : 0 ] g_hist_bin = (g_sync2_diff >> HISTSIZE) ? {HISTSIZE{1'b1}} : g_sync2_diff; // the last counter for the overflow
+histogram_accum #(HISTSIZE, 32) hist_accum(.g_clk(g_clk), .g_rst(g_rst),
+    .g_valid(g_valid && g_hist_mode), .g_diff(g_hist_bin), .g_swap(g_hist_swap),
+    .g_rd_strobe(g_hist_read), .g_rd_data(g_hist_data), .g_busy(g_hist_busy));
+
+endmodule
@@ -0,0 +1,83 @@
+`timescale 1ns / 1ps
+//////////////////////////////////////////////////////////////////////////////////
+// Company:
+// Engineer:
+//
+// Create Date: 10/19/2026 03:00:00 PM
+// Design Name:
+// Module Name: multiphase_capture
+// Project Name:
+// Target Devices:
+// Tool Versions:
+// Description:
+//   Rising edge detection with sub-clock time resolution, an alternative to edge_detect.
+//   The input is sampled 2^FINE_BITS times per c_clk period:
+//     FINE_BITS = 1: rising and falling edges of c_clk (0, 180 degrees)
+//     FINE_BITS = 2: rising and falling edges of c_clk and c_clk90 (0, 90, 180, 270 degrees)
+//   c_pos_edge is a one-clock pulse for each rising edge of c_in, as in edge_detect, and c_fine is the phase
+//   of the first sample seeing the input high, so the edge time is (clock << FINE_BITS) + c_fine in units of
+//   c_clk period / 2^FINE_BITS (0.54 ns for 460 MHz and FINE_BITS = 2).
+//   This module runs in count clock domain, using c_ prefix.
+// Dependencies:
+//
+// Revision:
+// Revision 0.01 - File Created
+// Additional Comments:
+//   Behavioral model, validated by tb_multiphase_capture.v. For implementation, the samples should be
+//   placed in the input flip-flops (IDDR, or ISERDESE2 in OVERSAMPLE mode with c_clk and c_clk90),
+//   the sample of the 270-degree phase has only 1/4 clock to reach the c_clk domain otherwise.
+//////////////////////////////////////////////////////////////////////////////////
+
+
+module multiphase_capture #(parameter FINE_BITS = 2)
+(
+  input c_clk,
+  input c_clk90, // c_clk shifted by 90 degrees, used if FINE_BITS == 2
+  input c_in,
+  output reg c_pos_edge,
+  output reg [ FINE_BITS-1 : 0 ] c_fine
+    );
+
+localparam NPHASE = 1 << FINE_BITS;
+
+// samples of the phases. s_ph[k] is sampled k/NPHASE of a period after the rising edge of c_clk.
+wire [ NPHASE-1 : 0 ] s_ph;
+reg s_0, s_90, s_180, s_270;
+always @(posedge c_clk) s_0 <= c_in;
+always @(negedge c_clk) s_180 <= c_in;
+generate
+  if (FINE_BITS == 2) begin : four_phases
+    always @(posedge c_clk90) s_90 <= c_in;
+    always @(negedge c_clk90) s_270 <= c_in;
+    assign s_ph = {s_270, s_180, s_90, s_0};
+  end
+  else begin : two_phases
+    assign s_ph = {s_180, s_0};
+  end
+endgenerate
+
+// to the c_clk domain: c_smp holds the samples of one period, oldest in bit 0
+reg [ NPHASE-1 : 0 ] c_smp0, c_smp;
+reg c_last; // the last sample of the previous period
+always @(posedge c_clk) begin
+  c_smp0 <= s_ph;
+  c_smp <= c_smp0; // one more ff for metastability, as in edge_detect
+  c_last <= c_smp[NPHASE-1];
+end
+
+// the first sample which is high after a low one
+wire [ NPHASE-1 : 0 ] c_rise = c_smp & ~{c_smp[ NPHASE-2 : 0 ], c_last};
+integer k;
+reg [ FINE_BITS-1 : 0 ] c_first;
+always @(*) begin
+  c_first = 0;
+  for (k = NPHASE - 1; k >= 0; k = k - 1)
+    if (c_rise[k]) c_first = k;
+end
+
+always @(posedge c_clk) begin
+  c_pos_edge <= |c_rise;
+  c_fine <= c_first;
+end
+
+endmodule
@@ -0,0 +1,62 @@
+`timescale 1ns / 1ps
+//////////////////////////////////////////////////////////////////////////////////
+// Company:
+// Engineer:
+//
+// Create Date: 10/19/2026 06:00:00 PM
+// Design Name:
+// Module Name: reset_sequencer
+// Project Name:
+// Target Devices:
+// Tool Versions:
+// Description:
+//   Self-timed reset, started by a one-clock pulse (triggerIn 0x40 bit1), so the host restarts the detector in one
+//   USB transaction instead of a sequence of wireIn updates and a sleep:
+//     g_rst and g_rst_fifo high for FIFO_CLOCKS clocks, then g_rst alone for WAIT_CLOCKS more clocks
+//     (the FIFO needs 30 clocks after its reset before WE/RE), then both low.
+//   A pulse during the sequence starts it again. ORed with the wireIn 0x00 resets in mmd_core.
+//   This module runs in okClk clock domain, using g_ prefix.
+// Dependencies:
+//
+// Revision:
+// Revision 0.01 - File Created
+// Additional Comments:
+//   Validated by tb_reset_sequencer.v.
+//////////////////////////////////////////////////////////////////////////////////
+
+
+module reset_sequencer #(parameter FIFO_CLOCKS = 16, WAIT_CLOCKS = 64)
+(
+  input g_clk,
+  input g_start,
+  output reg g_rst,
+  output reg g_rst_fifo
+    );
+
+localparam TOTAL = FIFO_CLOCKS + WAIT_CLOCKS;
+
+reg [ $clog2(TOTAL+1)-1 : 0 ] g_cnt; // clocks left in the sequence
+initial begin
+  g_cnt = 0;
+  g_rst = 0;
+  g_rst_fifo = 0;
+end
+
+always @(posedge g_clk) begin
+  if (g_start) begin
+    g_cnt <= TOTAL - 1;
+    g_rst <= 1;
+    g_rst_fifo <= 1;
+  end
+  else if (g_cnt != 0) begin
+    g_cnt <= g_cnt - 1;
+    g_rst <= 1;
+    g_rst_fifo <= (g_cnt > WAIT_CLOCKS);
+  end
+  else begin
+    g_rst <= 0;
+    g_rst_fifo <= 0;
+  end
+end
+
+endmodule
@@ -0,0 +1,200 @@
+//////////////////////////////////////////////////////////////////////////////////
+// Co-simulation harness of mmd_core (Verilator).
+//
+// Drives the RTL with synthetic PMT pulses (ch1, Poisson, sine modulated arrival phase) and
+// RF trigger TTLs (ch2), c_clk 460 MHz (and c_clk90, 90 degrees later) and g_clk 100.8 MHz, and serves the endpoints of top_mmd
+// through a line protocol on stdin/stdout, used by XEM7305_Cosim.FrontPanelCosim:
+//   wi <addr> <value>      set wireIn 0x00 / 0x01                    -> ok
+//   ti <addr> <bit>        one g_clk pulse on triggerIn 0x40 <bit>   -> ok
+//   wo                     read wireOut 0x20 ~ 0x24                  -> ok <20> <21> <22> <23> <24>
+//   po <addr> <nwords>     pipe out 0xA0 (FIFO) or 0xA1 (histogram)  -> ok <hex words> | timeout
+//   run <ns>               let the firmware run                      -> ok <simulated time, ns>
+//   set <name> <value>     photon_rate, rf_freq, n_period, modulation, pulse_width, seed -> ok
+//   quit
+// Words are printed as 8 hex digits each, as read from the 32-bit pipe.
+//
+// Build (see XEM7305_Cosim.build):
+//   verilator --cc --exe --build -O3 -Wno-fatal -Wno-WIDTH --top-module mmd_core \
+//     mmd_core.v ... sim/fifo_generator_0.v sim/cosim_main.cpp -o mmd_cosim
+//////////////////////////////////////////////////////////////////////////////////
+
+#include <cmath>
+#include <cstdint>
+#include <cstdio>
+#include <cstring>
+#include <iostream>
+#include <random>
+#include <string>
+#include "Vmmd_core.h"
+#include "verilated.h"
+
+static const int64_t C_HALF_PS = 1088; // c_clk 460 MHz (2.176 ns), a multiple of 4 ps for c_clk90
+static const int64_t G_HALF_PS = 4960; // g_clk 100.8 MHz (9.92 ns)
+
+struct Stimulus {
+    double photon_rate = 1e5; // photons/s
+    double rf_freq = 21.5e6; // Hz
+    int n_period = 5; // RF sine waves per RF trigger TTL
+    double modulation = 0.8; // micromotion modulation depth of the arrival phase
+    double pulse_width = 20e-9; // s, PMT pulse after the discriminator
+    std::mt19937_64 rng{1};
+    double next_photon_ps = -1; // time of the next photon pulse
+    double pulse_end_ps = -1; // ch1 is high until then
+
+    double ttl_period_ps() const { return 1e12 * n_period / rf_freq; }
+
+    void draw_next(double t_ps) {
+        // thinning: Poisson arrivals at the peak rate, kept with the probability of the modulated density
+        std::exponential_distribution<double> gap(photon_rate * (1 + modulation) * 1e-12);
+        std::uniform_real_distribution<double> u(0, 1);
+        double t = t_ps;
+        for (;;) {
+            t += gap(rng);
+            double phase = std::fmod(t, ttl_period_ps()) / ttl_period_ps();
+            if (u(rng) * (1 + modulation) <= 1 + modulation * std::sin(2 * M_PI * n_period * phase)) break;
+        }
+        next_photon_ps = t;
+    }
+
+    bool ch1(double t_ps) {
+        if (photon_rate <= 0) return false;
+        if (next_photon_ps < 0) draw_next(t_ps);
+        while (next_photon_ps <= t_ps) {
+            pulse_end_ps = std::max(pulse_end_ps, next_photon_ps + pulse_width * 1e12);
+            draw_next(next_photon_ps);
+        }
+        return t_ps < pulse_end_ps;
+    }
+
+    bool ch2(double t_ps) const {
+        return std::fmod(t_ps, ttl_period_ps()) < ttl_period_ps() / 2;
+    }
+};
+
+struct Harness {
+    VerilatedContext ctx;
+    Vmmd_core* top;
+    Stimulus stim;
+    int64_t t_ps = 0;
+    int64_t next_c_ps = C_HALF_PS;
+    int64_t next_c90_ps = C_HALF_PS + C_HALF_PS / 2;
+    int64_t next_g_ps = G_HALF_PS;
+
+    Harness() {
+        top = new Vmmd_core{&ctx};
+        top->c_clk = 0;
+        top->c_clk90 = 0;
+        top->g_clk = 0;
+        top->eval();
+    }
+
+    ~Harness() {
+        top->final();
+        delete top;
+    }
+
+    // advance to the next clock edge. Return true if it is a rising edge of g_clk.
+    bool step() {
+        bool g_rise = false;
+        t_ps = std::min(std::min(next_c_ps, next_c90_ps), next_g_ps);
+        top->c_ch1 = stim.ch1((double)t_ps);
+        top->c_ch2 = stim.ch2((double)t_ps);
+        if (next_c_ps == t_ps) {
+            top->c_clk = !top->c_clk;
+            next_c_ps += C_HALF_PS;
+        }
+        if (next_c90_ps == t_ps) {
+            top->c_clk90 = !top->c_clk90;
+            next_c90_ps += C_HALF_PS;
+        }
+        if (next_g_ps == t_ps) {
+            top->g_clk = !top->g_clk;
+            g_rise = top->g_clk;
+            next_g_ps += G_HALF_PS;
+        }
+        top->eval();
+        return g_rise;
+    }
+
+    void g_cycle() {
+        while (!step()) {}
+    }
+
+    void run(int64_t ns) {
+        int64_t t_end = t_ps + ns * 1000;
+        while (t_ps < t_end) step();
+    }
+};
+
+int main(int argc, char** argv) {
+    Verilated::commandArgs(argc, argv);
+    Harness h;
+    std::string line;
+    std::ios::sync_with_stdio(false);
+    while (std::getline(std::cin, line)) {
+        char cmd[16] = {0}, name[32] = {0};
+        long a = 0, b = 0;
+        double v = 0;
+        if (sscanf(line.c_str(), "%15s", cmd) != 1) continue;
+        std::string c(cmd);
+        if (c == "quit") break;
+        if (c == "wi" && sscanf(line.c_str(), "%*s %li %li", &a, &b) == 2) {
+            if (a == 0x00) h.top->ep00wire = b;
+            else if (a == 0x01) h.top->ep01wire = b;
+            h.top->eval();
+            std::cout << "ok\n";
+        }
+        else if (c == "ti" && sscanf(line.c_str(), "%*s %li %li", &a, &b) == 2) {
+            h.top->ep40trig = (a == 0x40) ? (1u << b) : 0;
+            h.g_cycle();
+            h.top->ep40trig = 0;
+            h.top->eval();
+            std::cout << "ok\n";
+        }
+        else if (c == "wo") {
+            std::cout << "ok " << h.top->ep20wire << " " << h.top->ep21wire << " " << h.top->ep22wire << " " << h.top->ep23wire
+                      << " " << h.top->ep24wire << "\n";
+        }
+        else if (c == "po" && sscanf(line.c_str(), "%*s %li %li", &a, &b) == 2) {
+            if (a == 0xA0 && (long)h.top->ep23wire < b) {
+                std::cout << "timeout\n"; // the board would stall until the FIFO has the data
+            }
+            else if (a == 0xA0 || a == 0xA1) {
+                std::string out = "ok ";
+                out.reserve(3 + 8 * b);
+                char word[9];
+                for (long k = 0; k < b; k++) {
+                    if (a == 0xA0) h.top->g_piperead = 1;
+                    else h.top->g_hist_read = 1;
+                    h.g_cycle(); // the word is registered on this edge
+                    uint32_t d = (a == 0xA0) ? h.top->pipeO_data : h.top->g_hist_data;
+                    snprintf(word, sizeof(word), "%08x", d);
+                    out += word;
+                }
+                h.top->g_piperead = 0;
+                h.top->g_hist_read = 0;
+                h.top->eval();
+                std::cout << out << "\n";
+            }
+            else std::cout << "error invalid endpoint\n";
+        }
+        else if (c == "run" && sscanf(line.c_str(), "%*s %li", &a) == 1) {
+            h.run((int64_t)a);
+            std::cout << "ok " << h.t_ps / 1000 << "\n";
+        }
+        else if (c == "set" && sscanf(line.c_str(), "%*s %31s %lf", name, &v) == 2) {
+            std::string n(name);
+            if (n == "photon_rate") h.stim.photon_rate = v;
+            else if (n == "rf_freq") h.stim.rf_freq = v;
+            else if (n == "n_period") h.stim.n_period = (int)v;
+            else if (n == "modulation") h.stim.modulation = v;
+            else if (n == "pulse_width") h.stim.pulse_width = v;
+            else if (n == "seed") h.stim.rng.seed((uint64_t)v);
+            h.stim.next_photon_ps = -1;
+            std::cout << "ok\n";
+        }
+        else std::cout << "error " << line << "\n";
+        std::cout.flush();
+    }
+    return 0;
+}
@@ -0,0 +1,74 @@
+`timescale 1ns / 1ps
+//////////////////////////////////////////////////////////////////////////////////
+// Company:
+// Engineer:
+//
+// Create Date: 10/19/2026 02:10:00 PM
+// Design Name:
+// Module Name: fifo_generator_0
+// Project Name:
+// Target Devices:
+// Tool Versions:
+// Description:
+//   Behavioral model of the fifo_generator_0 IP (fifo_generator_0.xci) for simulation only, do not add it to the Vivado project.
+//   Common clock standard FIFO, synchronous reset, 8-bit write x 131072, 32-bit read x 32768.
+//   The first written byte is the MSB of the read word, as in the IP.
+//   Read latency is 1 clock: dout is valid the clock after rd_en.
+// Dependencies:
+//
+// Revision:
+// Revision 0.01 - File Created
+// Additional Comments:
+//   The data counts are exact, the IP's may lag a few clocks.
+//////////////////////////////////////////////////////////////////////////////////
+
+
+module fifo_generator_0
+(
+  input clk,
+  input srst,
+  input [7:0] din,
+  input wr_en,
+  input rd_en,
+  output reg [31:0] dout,
+  output full,
+  output empty,
+  output [17:0] wr_data_count,
+  output [15:0] rd_data_count
+    );
+
+localparam DEPTH = 131072; // unit: bytes
+
+reg [7:0] mem [0 : DEPTH-1];
+reg [16:0] wr_ptr, rd_ptr;
+reg [17:0] count; // bytes in the FIFO
+
+wire wr_ok = wr_en && (count < DEPTH);
+wire rd_ok = rd_en && (count >= 4);
+
+always @(posedge clk) begin
+  if (srst) begin
+    wr_ptr <= 0;
+    rd_ptr <= 0;
+    count <= 0;
+    dout <= 0;
+  end
+  else begin
+    if (wr_ok) begin
+      mem[wr_ptr] <= din;
+      wr_ptr <= wr_ptr + 1;
+    end
+    if (rd_ok) begin
+      dout <= {mem[rd_ptr], mem[rd_ptr + 17'd1], mem[rd_ptr + 17'd2], mem[rd_ptr + 17'd3]};
+      rd_ptr <= rd_ptr + 4;
+    end
+    count <= count + (wr_ok ? 18'd1 : 18'd0) - (rd_ok ? 18'd4 : 18'd0);
+  end
+end
+
+assign full = (count >= DEPTH);
+assign empty = (count < 4);
+assign wr_data_count = count;
+assign rd_data_count = count[17:2];
+
+endmodule
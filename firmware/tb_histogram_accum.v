@@ -0,0 +1,122 @@
+`timescale 1ns / 1ps
+//////////////////////////////////////////////////////////////////////////////////
+// Company:
+// Engineer:
+//
+// Create Date: 10/19/2026 10:30:00 AM
+// Design Name:
+// Module Name: tb_histogram_accum
+// Project Name:
+// Target Devices:
+// Tool Versions:
+// Description:
+//   Self-checking testbench of histogram_accum.
+//   Random time differences are accumulated while the previous histogram is read out,
+//   every readout is compared with the expected counts, for several swap rounds.
+//   Run with Icarus Verilog:
+//     iverilog -o tb_histogram_accum tb_histogram_accum.v histogram_accum.v && vvp tb_histogram_accum
+// Dependencies:
+//   histogram_accum.v
+// Revision:
+// Revision 0.01 - File Created
+// Additional Comments:
+//
+//////////////////////////////////////////////////////////////////////////////////
+
+
+module tb_histogram_accum;
+
+localparam DATASIZE = 8, NBINS = 256, NROUNDS = 4, NEVENTS = 3000;
+
+reg g_clk = 0, g_rst = 1;
+reg g_valid = 0, g_swap = 0, g_rd_strobe = 0;
+reg [ DATASIZE-1 : 0 ] g_diff = 0;
+wire [31:0] g_rd_data;
+wire g_busy;
+
+histogram_accum #(DATASIZE, 32) dut(.g_clk(g_clk), .g_rst(g_rst), .g_valid(g_valid), .g_diff(g_diff),
+    .g_swap(g_swap), .g_rd_strobe(g_rd_strobe), .g_rd_data(g_rd_data), .g_busy(g_busy));
+
+always #5 g_clk = ~g_clk; // 100 MHz, like okClk
+
+integer expected [0 : NBINS-1]; // counts of the round being accumulated
+integer frozen [0 : NBINS-1]; // counts of the round being read out
+integer i, round, errors, n_sent;
+
+// photon source: a time difference every 3 to 6 clocks, as after cdc_c2g
+task send_events(input integer n);
+  integer k;
+  begin
+    for (k = 0; k < n; k = k + 1) begin
+      @(posedge g_clk);
+      g_diff <= 1 + ({$random} % 107); // 1 ~ TTL period, as c_diff
+      g_valid <= 1;
+      @(posedge g_clk);
+      g_valid <= 0;
+      repeat (1 + ($random & 3)) @(posedge g_clk);
+    end
+  end
+endtask
+
+// count what the dut sees, at the clock it sees it
+always @(posedge g_clk) begin
+  if (g_valid && !g_rst) expected[g_diff] = expected[g_diff] + 1;
+end
+
+task swap;
+  begin
+    wait (!g_busy);
+    @(posedge g_clk);
+    while (g_valid) @(posedge g_clk); // the swap happens between two photons
+    for (i = 0; i < NBINS; i = i + 1) begin
+      frozen[i] = expected[i];
+      expected[i] = 0;
+    end
+    g_swap <= 1;
+    @(posedge g_clk);
+    g_swap <= 0;
+    repeat (4) @(posedge g_clk);
+  end
+endtask
+
+task read_out;
+  integer k;
+  begin
+    for (k = 0; k < NBINS; k = k + 1) begin
+      @(posedge g_clk);
+      g_rd_strobe <= 1;
+      @(posedge g_clk);
+      g_rd_strobe <= 0;
+      #1;
+      if (g_rd_data !== frozen[k]) begin
+        errors = errors + 1;
+        if (errors < 10) $display("round %0d bin %0d: read %0d, expected %0d", round, k, g_rd_data, frozen[k]);
+      end
+    end
+  end
+endtask
+
+initial begin
+  errors = 0;
+  for (i = 0; i < NBINS; i = i + 1) begin
+    expected[i] = 0;
+    frozen[i] = 0;
+  end
+  repeat (5) @(posedge g_clk);
+  g_rst <= 0;
+  wait (!g_busy); // both banks cleared after the reset
+  send_events(NEVENTS);
+  for (round = 0; round < NROUNDS; round = round + 1) begin
+    swap;
+    fork
+      read_out;
+      send_events(NEVENTS / 4); // photons keep coming during the readout
+    join
+    send_events(NEVENTS);
+  end
+  if (errors == 0) $display("PASS: %0d rounds of %0d bins", NROUNDS, NBINS);
+  else $display("FAIL: %0d errors", errors);
+  $finish;
+end
+
+endmodule
@@ -0,0 +1,114 @@
+`timescale 1ns / 1ps
+//////////////////////////////////////////////////////////////////////////////////
+// Company:
+// Engineer:
+//
+// Create Date: 10/19/2026 04:00:00 PM
+// Design Name:
+// Module Name: tb_micromotion_detect
+// Project Name:
+// Target Devices:
+// Tool Versions:
+// Description:
+//   Self-checking testbench of micromotion_detect with sub-clock resolution (multiphase_capture).
+//   ch2 and ch1 rising edges are placed at random times, away from the sampling instants, and every c_diff
+//   is compared with the number of samples (c_clk period / 2^FINE_BITS) between the two edges.
+//   FINE_BITS = 0, 1 or 2 (default):
+//     iverilog -P tb_micromotion_detect.FINE_BITS=1 -o tb_micromotion_detect tb_micromotion_detect.v micromotion_detect.v multiphase_capture.v edge_detect.v && vvp tb_micromotion_detect
+//     or verilator --binary --timing -Wno-fatal -Wno-WIDTH -GFINE_BITS=1 tb_micromotion_detect.v micromotion_detect.v multiphase_capture.v edge_detect.v --top-module tb_micromotion_detect && ./obj_dir/Vtb_micromotion_detect
+// Dependencies:
+//   micromotion_detect.v, multiphase_capture.v, edge_detect.v
+// Revision:
+// Revision 0.01 - File Created
+// Additional Comments:
+//
+//////////////////////////////////////////////////////////////////////////////////
+
+
+module tb_micromotion_detect;
+
+parameter FINE_BITS = 2;
+localparam DATASIZE = 8, NEVENTS = 500;
+localparam integer PERIOD_PS = 2176; // c_clk, ~460 MHz
+localparam integer SAMPLE_PS = PERIOD_PS >> FINE_BITS; // time between two samples
+localparam integer FIRST_PS = PERIOD_PS / 2; // the first rising edge of c_clk
+
+reg c_clk = 0, c_clk90 = 0, c_rst = 1;
+reg c_ch1 = 0, c_ch2 = 0;
+wire c_detect;
+wire [ DATASIZE-1 : 0 ] c_ch2_period;
+wire [ DATASIZE+FINE_BITS-1 : 0 ] c_diff;
+wire [31:0] c_diff_count;
+
+micromotion_detect #(DATASIZE, 32, FINE_BITS) dut(.c_clk(c_clk), .c_clk90(c_clk90), .c_rst(c_rst), .c_ch1(c_ch1), .c_ch2(c_ch2),
+    .c_detect(c_detect), .c_ch2_period(c_ch2_period), .c_diff(c_diff), .c_diff_count(c_diff_count));
+
+always #(PERIOD_PS / 2000.0) c_clk = ~c_clk;
+initial begin
+  #(PERIOD_PS / 4000.0);
+  forever #(PERIOD_PS / 2000.0) c_clk90 = ~c_clk90;
+end
+
+integer errors, n_checked, k;
+integer t_ps, t2_ps, t1_ps, expected;
+
+// wait until an absolute time, in ps
+task wait_until(input integer t);
+  begin
+    #((t - $realtime * 1000.0) / 1000.0);
+  end
+endtask
+
+// a time in [t, t + span) which is 50 ps or more away from any sampling instant
+function integer off_grid(input integer t, input integer span);
+  integer m;
+  begin
+    m = (t - FIRST_PS) / SAMPLE_PS + 1 + ({$random} % (span / SAMPLE_PS));
+    off_grid = FIRST_PS + m * SAMPLE_PS + 50 + ({$random} % (SAMPLE_PS - 100));
+  end
+endfunction
+
+// index of the first sample at or after a time
+function integer sample_index(input integer t);
+  begin
+    sample_index = (t - FIRST_PS + SAMPLE_PS - 1) / SAMPLE_PS;
+  end
+endfunction
+
+initial begin
+  errors = 0;
+  n_checked = 0;
+  repeat (5) @(posedge c_clk);
+  c_rst <= 0;
+  repeat (5) @(posedge c_clk);
+  for (k = 0; k < NEVENTS; k = k + 1) begin
+    t_ps = $realtime * 1000.0;
+    t2_ps = off_grid(t_ps + 2 * PERIOD_PS, 4 * PERIOD_PS);
+    t1_ps = off_grid(t2_ps + 4 * PERIOD_PS, 60 * PERIOD_PS); // 4 ~ 64 clocks after the ch2 edge
+    expected = sample_index(t1_ps) - sample_index(t2_ps);
+    wait_until(t2_ps);
+    c_ch2 = 1;
+    wait_until(t2_ps + 4 * PERIOD_PS);
+    c_ch2 = 0;
+    wait_until(t1_ps);
+    c_ch1 = 1;
+    fork
+      begin
+        #20 c_ch1 = 0; // PMT pulse width
+      end
+      begin
+        @(posedge c_clk iff c_detect);
+        n_checked = n_checked + 1;
+        if (c_diff !== expected) begin
+          errors = errors + 1;
+          if (errors < 10) $display("event %0d: c_diff %0d, expected %0d (ch2 at %0d ps, ch1 at %0d ps)", k, c_diff, expected, t2_ps, t1_ps);
+        end
+      end
+    join
+  end
+  if (errors == 0 && n_checked == NEVENTS) $display("PASS: %0d time differences, FINE_BITS = %0d", n_checked, FINE_BITS);
+  else $display("FAIL: %0d errors in %0d time differences", errors, n_checked);
+  $finish;
+end
+
+endmodule
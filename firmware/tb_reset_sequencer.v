@@ -0,0 +1,90 @@
+`timescale 1ns / 1ps
+//////////////////////////////////////////////////////////////////////////////////
+// Company:
+// Engineer:
+//
+// Create Date: 10/19/2026 06:00:00 PM
+// Design Name:
+// Module Name: tb_reset_sequencer
+// Project Name:
+// Target Devices:
+// Tool Versions:
+// Description:
+//   Self-checking testbench of reset_sequencer: after a start pulse, g_rst_fifo is high for FIFO_CLOCKS clocks,
+//   g_rst for FIFO_CLOCKS + WAIT_CLOCKS clocks, g_rst_fifo is never high without g_rst, and a pulse during the
+//   sequence starts it again.
+//     iverilog -o tb_reset_sequencer tb_reset_sequencer.v reset_sequencer.v && vvp tb_reset_sequencer
+//     or verilator --binary --timing -Wno-fatal tb_reset_sequencer.v reset_sequencer.v --top-module tb_reset_sequencer && ./obj_dir/Vtb_reset_sequencer
+// Dependencies:
+//   reset_sequencer.v
+// Revision:
+// Revision 0.01 - File Created
+// Additional Comments:
+//
+//////////////////////////////////////////////////////////////////////////////////
+
+
+module tb_reset_sequencer;
+
+localparam FIFO_CLOCKS = 16, WAIT_CLOCKS = 64;
+
+reg g_clk = 0, g_start = 0;
+wire g_rst, g_rst_fifo;
+
+reset_sequencer #(FIFO_CLOCKS, WAIT_CLOCKS) dut(.g_clk(g_clk), .g_start(g_start), .g_rst(g_rst), .g_rst_fifo(g_rst_fifo));
+
+always #4.96 g_clk = ~g_clk; // okClk, 100.8 MHz
+
+integer errors, n_rst, n_rst_fifo, k;
+
+// a start pulse, then count the clocks with each reset high until both are low
+task run_sequence(input integer restart_at);
+  begin
+    n_rst = 0;
+    n_rst_fifo = 0;
+    @(negedge g_clk) g_start = 1;
+    @(negedge g_clk) g_start = 0;
+    k = 0;
+    while (g_rst || g_rst_fifo) begin
+      if (g_rst) n_rst = n_rst + 1;
+      if (g_rst_fifo) n_rst_fifo = n_rst_fifo + 1;
+      if (g_rst_fifo && !g_rst) begin
+        errors = errors + 1;
+        $display("g_rst_fifo without g_rst");
+      end
+      k = k + 1;
+      if (k == restart_at) begin
+        g_start = 1;
+        n_rst = 0;
+        n_rst_fifo = 0;
+        @(negedge g_clk) g_start = 0;
+      end
+      else @(negedge g_clk);
+    end
+  end
+endtask
+
+initial begin
+  errors = 0;
+  repeat (3) @(negedge g_clk);
+  if (g_rst || g_rst_fifo) begin
+    errors = errors + 1;
+    $display("reset high before a start");
+  end
+  run_sequence(-1);
+  if (n_rst != FIFO_CLOCKS + WAIT_CLOCKS || n_rst_fifo != FIFO_CLOCKS) begin
+    errors = errors + 1;
+    $display("g_rst %0d clocks, g_rst_fifo %0d clocks", n_rst, n_rst_fifo);
+  end
+  repeat (5) @(negedge g_clk);
+  run_sequence(40); // started again in the g_rst alone part
+  if (n_rst != FIFO_CLOCKS + WAIT_CLOCKS || n_rst_fifo != FIFO_CLOCKS) begin
+    errors = errors + 1;
+    $display("restarted: g_rst %0d clocks, g_rst_fifo %0d clocks", n_rst, n_rst_fifo);
+  end
+  if (errors == 0) $display("PASS: reset sequence, FIFO_CLOCKS = %0d, WAIT_CLOCKS = %0d", FIFO_CLOCKS, WAIT_CLOCKS);
+  else $display("FAIL: %0d errors", errors);
+  $finish;
+end
+
+endmodule
@@ -0,0 +1,93 @@
+`timescale 1ns / 1ps
+//////////////////////////////////////////////////////////////////////////////////
+// Company:
+// Engineer:
+//
+// Create Date: 10/19/2026 01:00:00 PM
+// Design Name:
+// Module Name: timestamp_tagger
+// Project Name:
+// Target Devices:
+// Tool Versions:
+// Description:
+//   Timestamped event mode. Each time difference is written into the 8-bit FIFO as 4 bytes,
+//   a TSSIZE-bit coarse timestamp and the DATASIZE-bit time difference:
+//     ts[23:16], ts[15:8], ts[7:0], diff (in the order of writing)
+//   The FIFO puts the first written byte in the MSB of its 32-bit read word, so each read word is
+//   {ts, diff}, one event per word, and the host reads it as a little-endian 32-bit integer (ts << 8) | diff.
+//   The timestamp counts g_clk from the reset, in units of 2^TSSHIFT clocks
+//   (2^7 x 9.92 ns = 1.27 us, wrapping every 21.3 s), the host unwraps it.
+//   Photons are at least 14 c_clk (~3 g_clk) apart (cdc_c2g hold time), and writing an event takes 4 clocks,
+//   so one event is kept pending while the previous one is written; an event arriving while both are busy is lost.
+//   This module runs in global clock domain, using g_ prefix.
+// Dependencies:
+//
+// Revision:
+// Revision 0.01 - File Created
+// Additional Comments:
+//   An event is accepted only if g_good_to_wr, and then written whole, so the FIFO never holds a partial event.
+//////////////////////////////////////////////////////////////////////////////////
+
+
+module timestamp_tagger #(parameter DATASIZE = 8, TSSIZE = 24, TSSHIFT = 7)
+(
+  input g_clk,
+  input g_rst, // also restarts the timestamp from 0
+  input g_valid, // one clock pulse for each time difference
+  input [ DATASIZE-1 : 0 ] g_diff,
+  input g_good_to_wr, // the FIFO has room for a whole event
+  output reg g_wren,
+  output reg [7:0] g_byte,
+  output reg g_lost // one clock pulse for each lost event
+    );
+
+localparam NBYTES = (TSSIZE + DATASIZE) / 8; // 4
+
+reg [ TSSIZE+TSSHIFT-1 : 0 ] g_clk_cnt; // free running clock counter, the timestamp is its upper TSSIZE bits
+always @(posedge g_clk, posedge g_rst) begin
+  if (g_rst) g_clk_cnt <= 0;
+  else g_clk_cnt <= g_clk_cnt + 1;
+end
+
+reg [ TSSIZE+DATASIZE-1 : 0 ] g_shift; // the event being written, MSB first
+reg [2:0] g_n_left; // bytes of g_shift not yet written
+reg g_pending;
+reg [ TSSIZE+DATASIZE-1 : 0 ] g_pending_event;
+wire g_load = g_pending && (g_n_left == 0); // start writing the pending event
+wire g_accept = g_valid && g_good_to_wr && (!g_pending || g_load);
+
+always @(posedge g_clk, posedge g_rst) begin
+  if (g_rst) begin
+    g_shift <= 0;
+    g_n_left <= 0;
+    g_pending <= 0;
+    g_pending_event <= 0;
+    g_wren <= 0;
+    g_byte <= 0;
+    g_lost <= 0;
+  end
+  else begin
+    g_lost <= g_valid && !g_accept;
+    if (g_accept) begin
+      g_pending <= 1;
+      g_pending_event <= {g_clk_cnt[ TSSIZE+TSSHIFT-1 : TSSHIFT ], g_diff};
+    end
+    else if (g_load) g_pending <= 0;
+    // write the event byte by byte, 4 clocks per event
+    if (g_n_left != 0) begin
+      g_wren <= 1;
+      g_byte <= g_shift[ TSSIZE+DATASIZE-1 -: 8 ];
+      g_shift <= g_shift << 8;
+      g_n_left <= g_n_left - 1;
+    end
+    else if (g_load) begin
+      g_wren <= 1;
+      g_byte <= g_pending_event[ TSSIZE+DATASIZE-1 -: 8 ];
+      g_shift <= g_pending_event << 8;
+      g_n_left <= NBYTES - 1;
+    end
+    else g_wren <= 0;
+  end
+end
+
+endmodule
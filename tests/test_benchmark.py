@@ -0,0 +1,52 @@
+""" The USB link microbenchmark (XEM7305_Benchmark) against the emulator with an injected latency and bandwidth. """
+
+import pytest
+import XEM7305_Benchmark
+import XEM7305_Emulator
+import XEM7305_MicroMotion_Detector
+
+LATENCY = 0.002 # unit: s, large against the time of Python
+BANDWIDTH = 2e7 # unit: bytes/s
+
+def emulated_detector(**kwargs):
+    emu = XEM7305_Emulator.FrontPanelEmulator(photon_rate=5e6, realtime=False, seed=1, **kwargs)
+    dev = XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=emu, bit_file=XEM7305_Emulator.__file__)
+    return emu, dev
+
+def test_block_size():
+    assert XEM7305_Benchmark.block_size(16) == 16
+    assert XEM7305_Benchmark.block_size(48) == 16
+    assert XEM7305_Benchmark.block_size(65536) == XEM7305_Benchmark.BLOCK_MAX
+    assert XEM7305_Benchmark.block_size(XEM7305_Benchmark.FIFO_BYTES) == 128
+
+def test_fit_link():
+    results = [{'size': size, 'latency': {'median': 0.001 + size / 1e8}} for size in (16, 1024, 65536)]
+    results.append({'size': 131072, 'skipped': "the FIFO did not fill"})
+    fit = XEM7305_Benchmark.fit_link(results)
+    assert fit['overhead'] == pytest.approx(0.001)
+    assert fit['bandwidth'] == pytest.approx(1e8)
+    assert XEM7305_Benchmark.fit_link(results[:1]) is None
+
+def test_the_fit_finds_the_injected_link():
+    emu, dev = emulated_detector(latency=LATENCY, bandwidth=BANDWIDTH)
+    report = XEM7305_Benchmark.run(dev, sizes=(16, 16384, 65536), repeats=3, fill=lambda: emu.advance(0.01))
+    assert XEM7305_Benchmark.check(report, LATENCY, BANDWIDTH) == []
+    for r in report['pipe'] + report['block_pipe']:
+        assert r['latency']['min'] >= LATENCY
+    text = XEM7305_Benchmark.format_report(report)
+    assert "ReadFromBlockPipeOut" in text and "fit:" in text
+    dev.close()
+
+def test_check_reports_a_wrong_link():
+    emu, dev = emulated_detector(latency=LATENCY, bandwidth=BANDWIDTH)
+    report = XEM7305_Benchmark.run(dev, sizes=(16, 65536), repeats=2, fill=lambda: emu.advance(0.01))
+    problems = XEM7305_Benchmark.check(report, 4 * LATENCY, BANDWIDTH / 4)
+    assert len(problems) == 4
+    dev.close()
+
+def test_a_size_is_skipped_without_photons():
+    emu = XEM7305_Emulator.FrontPanelEmulator(photon_rate=0., realtime=False, seed=1)
+    dev = XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=emu, bit_file=XEM7305_Emulator.__file__)
+    results = XEM7305_Benchmark.time_pipe(dev, sizes=(16,), repeats=1)
+    assert 'skipped' in results[0]
+    dev.close()
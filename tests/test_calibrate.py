@@ -0,0 +1,26 @@
+""" Calibration trials against the emulated board. """
+
+import MMD_Calibrate
+import XEM7305_Emulator
+import XEM7305_MicroMotion_Detector
+
+def make_detector():
+    emu = XEM7305_Emulator.FrontPanelEmulator(photon_rate=2e5, latency=0.0005, seed=1)
+    return XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=emu, bit_file=XEM7305_Emulator.__file__)
+
+def test_stalled_reader_is_not_safe():
+    """ A look-ahead too small for the update interval leaves the data in the FIFO: seen by the probe after the trial. """
+    dev = make_detector()
+    result = MMD_Calibrate.run_trial(dev, 200, 4, 1 << 12, trial=0.1)
+    assert result['queued_max'] >= 1 << 12
+    assert result['occupancy'] > 0.1 # 200 ms of photons, in the FIFO at the end
+    assert not MMD_Calibrate.is_safe(result)
+    dev.close()
+
+def test_keeping_up_is_safe():
+    dev = make_detector()
+    result = MMD_Calibrate.run_trial(dev, 200, 4, 1 << 24, trial=0.1) # MIN_TICKS ticks, whatever the trial
+    assert result['lost'] <= MMD_Calibrate.LOST_TOLERANCE
+    assert result['occupancy'] < 0.1
+    assert MMD_Calibrate.is_safe(result)
+    dev.close()
@@ -0,0 +1,69 @@
+""" Labeled histogram channels in the GUI, against the emulator: by the timestamps (GATE) or by select_channel. """
+
+import os
+import shutil
+import time
+import numpy as np
+import pytest
+
+pytest.importorskip('PyQt5')
+pytest.importorskip('pyqtgraph')
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtWidgets import QApplication
+import MMD_GUI
+
+BIT_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'micromotion_detector.bit')
+
+def process(app, seconds):
+    t_end = time.monotonic() + seconds
+    while (time.monotonic() < t_end):
+        app.processEvents()
+        time.sleep(0.005)
+
+@pytest.fixture
+def window(tmp_path, monkeypatch):
+    shutil.copy(BIT_FILE, str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(MMD_GUI, 'SIMULATE', False)
+    monkeypatch.setattr(MMD_GUI, 'EMULATE', True)
+    monkeypatch.setattr(MMD_GUI, 'CHANNELS', ['gate on', 'gate off'])
+    app = QApplication.instance() or QApplication([])
+    w = MMD_GUI.MainWindow()
+    w.ckbCountStop.setChecked(False)
+    w.ckbTimeStop.setChecked(False)
+    yield app, w
+    w.stop()
+    w.close()
+
+def test_gate_windows_by_the_timestamps(window, monkeypatch):
+    app, w = window
+    monkeypatch.setattr(MMD_GUI, 'GATE', 20.)
+    w.ckbTimestamp.setChecked(True)
+    w.start()
+    process(app, 1.)
+    mmd = w.mmd
+    assert mmd.n_update > 0 and mmd.channels == ['gate on', 'gate off']
+    on, off = mmd.channel_hist.sum(axis=1)
+    assert on > 0 and off > 0 and 0.5 < on / off < 2. # the windows alternate every 20 ms
+    assert np.array_equal(mmd.channel_hist.sum(axis=0), mmd.hist)
+
+def test_select_channel(window):
+    app, w = window
+    w.start()
+    process(app, 0.6)
+    mmd = w.mmd
+    assert mmd.channel_hist[1].sum() == 0 # the first channel until another one is selected
+    assert w.remote_select_channel('gate off') == 'gate off'
+    on = mmd.channel_hist[0].sum()
+    process(app, 0.6)
+    assert mmd.channel_hist[0].sum() == on and mmd.channel_hist[1].sum() > 0
+    with pytest.raises(ValueError):
+        w.remote_select_channel(5)
+    with pytest.raises(ValueError):
+        w.remote_select_channel('gate')
+    assert mmd.channel == 1
+    process(app, 0.3) # the updates go on to the selected channel
+    assert mmd.channel_hist[0].sum() == on
+    result = w.remote_channels()
+    assert result['channels'] == ['gate on', 'gate off'] and len(result['hists']) == 2
@@ -0,0 +1,25 @@
+""" The checkpoint of the previous session is kept when a new one starts. """
+
+import os
+import numpy as np
+import MMD_Checkpoint
+
+def test_new_session_keeps_the_previous_checkpoint(tmp_path):
+    path = str(tmp_path / 'mmd_checkpoint.npz')
+    cp = MMD_Checkpoint.Checkpointer(path)
+    cp.save({'hist': np.full(4, 7), 'time_detected': 7200000}) # a long run
+    cp.flush()
+    cp.save({'hist': np.zeros(4), 'time_detected': 0}, rotate=True) # the first checkpoint of a new session
+    cp.save({'hist': np.ones(4), 'time_detected': 200}) # may replace it before it is written: still rotated once
+    cp.flush()
+    previous = MMD_Checkpoint.load(MMD_Checkpoint.previous_path(path))
+    assert int(previous['time_detected']) == 7200000
+    assert int(MMD_Checkpoint.load(path)['time_detected']) == 200
+    cp.save({'hist': np.ones(4), 'time_detected': 400})
+    cp.flush()
+    assert int(MMD_Checkpoint.load(MMD_Checkpoint.previous_path(path))['time_detected']) == 7200000
+
+def test_rotate_without_checkpoint(tmp_path):
+    path = str(tmp_path / 'mmd_checkpoint.npz')
+    assert not MMD_Checkpoint.rotate(path)
+    assert not os.path.exists(MMD_Checkpoint.previous_path(path))
@@ -0,0 +1,75 @@
+""" The incremental modulation estimate (MMD_Histogram.ModulationEstimator) and the compensation controller (MMD_Compensation). """
+
+import numpy as np
+import pytest
+import MMD_Compensation
+import MMD_Histogram
+import MMD_SharedMemory
+
+def test_the_estimate_is_the_fit_of_the_accumulated_histogram():
+    ion = MMD_Compensation.SimulatedIon(optimum=0., slope=0.3, floor=0., phase=0.7, photon_rate=1e6, seed=1)
+    ion.set_voltage(1.)
+    estimator = MMD_Histogram.ModulationEstimator(107)
+    hist = np.zeros(107, dtype=np.int64)
+    for k in range(5):
+        hist_tmp, seconds = ion.next_update()
+        estimator.add(hist_tmp, seconds)
+        hist += hist_tmp
+    estimate = estimator.estimate()
+    assert estimate['photons'] == hist.sum() and estimator.seconds == pytest.approx(1.)
+    assert estimate['modulation'] == pytest.approx(MMD_Histogram.fit_modulation(hist)['modulation'])
+    assert abs(estimate['amplitude'] - ion.amplitude()) < 4 * estimate['error']
+    assert estimate['error'] == pytest.approx(np.sqrt(2. / hist.sum()), rel=0.1) # sqrt(2/N): the Poisson noise of the counts
+
+def test_background_and_no_signal():
+    estimator = MMD_Histogram.ModulationEstimator(107, background_rate=10.)
+    assert estimator.estimate()['error'] == np.inf
+    estimator.add(np.full(107, 10), 1.) # only the background
+    assert estimator.estimate()['modulation'] == 0. and estimator.estimate()['error'] == np.inf
+    estimator.clear()
+    assert estimator.estimate()['photons'] == 0 and estimator.seconds == 0.
+
+def test_the_controller_finds_the_optimum():
+    ion = MMD_Compensation.SimulatedIon(optimum=0.37, slope=0.5, phase=-2., background_rate=1., seed=3)
+    voltages = []
+    output = MMD_Compensation.CallbackOutput(lambda volts: (voltages.append(volts), ion.set_voltage(volts)))
+    result = MMD_Compensation.CompensationController(output, ion, size_bins=107, background_rate=1.).run(v_start=0.)
+    assert result['converged']
+    assert abs(result['voltage'] - ion.optimum) * ion.slope < MMD_Compensation.TARGET_MODULATION
+    assert voltages[-1] == result['voltage'] == ion.volts # the output is left at the result
+    assert result['photons'] == sum(m['photons'] for m in result['measurements'])
+
+def test_the_sequential_stop_takes_fewer_photons():
+    seconds = {}
+    for fixed in (None, 20000):
+        ion = MMD_Compensation.SimulatedIon(optimum=-0.8, slope=0.6, seed=5)
+        result = MMD_Compensation.CompensationController(ion, ion, size_bins=107, fixed_photons=fixed).run(v_start=0.)
+        assert abs(result['voltage'] - ion.optimum) * ion.slope < MMD_Compensation.TARGET_MODULATION
+        seconds[fixed] = result['seconds']
+    assert seconds[None] < seconds[20000]
+
+def test_the_steps_stay_in_the_limits():
+    ion = MMD_Compensation.SimulatedIon(optimum=5., slope=0.1, seed=2)
+    controller = MMD_Compensation.CompensationController(ion, ion, size_bins=107, max_step=1., limits=(-2., 2.))
+    result = controller.run(v_start=0., max_measurements=6)
+    volts = [m['volts'] for m in result['measurements']]
+    assert max(volts) <= 2. and np.all(np.abs(np.diff(volts)) <= 1. + 1e-9)
+    assert result['voltage'] <= 2.
+
+def test_shared_histogram_source():
+    name = 'mmd_test_compensation'
+    writer = MMD_SharedMemory.SharedHistogramWriter(4, name=name)
+    reader = MMD_SharedMemory.SharedHistogramReader(name)
+    source = MMD_Compensation.SharedHistogramSource(reader, timeout=0.05)
+    hist = np.array([1, 2, 3, 4])
+    writer.publish(hist, n_update=1, time_detected=200, detecting=1)
+    with pytest.raises(RuntimeError):
+        source.next_update() # the first update only starts the differences, no second one
+    writer.publish(3 * hist, n_update=2, time_detected=400, detecting=1)
+    hist_tmp, seconds = source.next_update()
+    assert np.array_equal(hist_tmp, 2 * hist) and seconds == pytest.approx(0.2)
+    writer.publish(3 * hist, n_update=2, time_detected=400, detecting=0)
+    with pytest.raises(RuntimeError):
+        source.next_update()
+    reader.close()
+    writer.close()
@@ -0,0 +1,62 @@
+""" MMD_Config: the validation of the profiles and the overrides, and the driver built from a profile. """
+
+import json
+import pytest
+import MMD_Config
+import XEM7305_Emulator
+import XEM7305_MicroMotion_Detector
+
+def test_defaults_and_overrides(tmp_path):
+    path = str(tmp_path / 'lab.json')
+    with open(path, 'w') as f:
+        json.dump({'gui': {'redraw_time': 30}, 'endpoints': {'fifo_pipe': 0xA2}}, f)
+    cfg = MMD_Config.load(path, overrides=['gui.update_interval=300', 'driver.clock_period=2.5'])
+    assert cfg.gui.redraw_time == 30 and cfg.gui.update_interval == 300
+    assert cfg.driver.clock_period == 2.5 and cfg.endpoints.fifo_pipe == 0xA2
+    assert cfg.gui.n_period == MMD_Config.SCHEMA['gui']['n_period'][1] # not in the profile: the default
+
+def test_every_problem_is_reported():
+    with pytest.raises(MMD_Config.ConfigError) as e:
+        MMD_Config.load(overrides=['gui.redraw_tim=30', 'gui.pipeout_length_default=1023', 'endpoints.fifo_pipe=0xA1',
+                                   'driver.clock_period=fast', 'gui.update_interval=5000'])
+    message = str(e.value)
+    assert "unknown setting gui.redraw_tim" in message
+    assert "pipeout_length_default must be a multiple of 4" in message
+    assert "endpoints.fifo_pipe and endpoints.histogram_pipe are both 0xA1" in message
+    assert "driver.clock_period = 'fast' is not a float" in message
+    assert "gui.update_interval = 5000 is out of" in message
+
+def test_types_are_strict(tmp_path):
+    path = str(tmp_path / 'bad.json')
+    with open(path, 'w') as f:
+        json.dump({'gui': {'redraw_time': True, 'update_interval': 200.5}, 'driver': 3}, f)
+    with pytest.raises(MMD_Config.ConfigError) as e:
+        MMD_Config.load(path)
+    message = str(e.value)
+    assert "gui.redraw_time = True is not a int" in message
+    assert "gui.update_interval = 200.5 is not a int" in message
+    assert "[driver] is not a section" in message
+    with pytest.raises(MMD_Config.ConfigError):
+        MMD_Config.load(str(tmp_path / 'missing.json'))
+
+@pytest.mark.parametrize('name', ['lab.json', 'lab.toml'])
+def test_save_and_load(tmp_path, name):
+    if (name.endswith('.toml') and MMD_Config.tomllib is None):
+        pytest.skip("no TOML reader")
+    path = str(tmp_path / name)
+    cfg = MMD_Config.load(overrides=['gui.redraw_time=35', 'endpoints.fifo_pipe=0xA5'])
+    MMD_Config.save(cfg, path)
+    assert MMD_Config.load(path).as_dict() == cfg.as_dict()
+
+def test_option_args():
+    assert MMD_Config.option_args(['EMULATE', 'gui.redraw_time=30', 'CONTROL=9200']) == ['gui.redraw_time=30']
+
+def test_driver_from_a_profile():
+    cfg = MMD_Config.load(overrides=['driver.clock_period=2.0'])
+    emu = XEM7305_Emulator.FrontPanelEmulator(realtime=False, seed=8)
+    dev = XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=emu, bit_file=XEM7305_Emulator.__file__,
+                                                                    clock_period=cfg.driver.clock_period, endpoints=vars(cfg.endpoints))
+    assert dev.sampling_period == 2.0
+    dev.reset_dev()
+    emu.advance(0.01)
+    assert dev.probe_dev()[1] > 0
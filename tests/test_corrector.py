@@ -0,0 +1,48 @@
+""" Dead time correction and background subtraction (HistogramCorrector), against the dead time of the emulator. """
+
+import numpy as np
+import pytest
+import MMD_Histogram
+import XEM7305_Emulator
+import XEM7305_MicroMotion_Detector
+
+TTL_PERIOD = 107
+
+def emulated_histogram(photon_rate, seconds):
+    emu = XEM7305_Emulator.FrontPanelEmulator(photon_rate=photon_rate, ttl_period=TTL_PERIOD, realtime=False, seed=7)
+    dev = XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=emu, bit_file=XEM7305_Emulator.__file__)
+    dev.set_histogram_mode(True)
+    dev.reset_dev()
+    counters = np.zeros(dev.hist_bins, dtype=np.int64)
+    for k in range(int(seconds / 0.01)):
+        emu.advance(0.01)
+        counters += dev.read_histogram()
+    hist = np.bincount(MMD_Histogram.phase_bin_index(dev.hist_bins, TTL_PERIOD), weights=counters, minlength=TTL_PERIOD)
+    return hist, dev.probe_dev()[0]
+
+def test_dead_time_correction_restores_the_photons():
+    seconds = 0.2
+    hist, photon_cnt = emulated_histogram(5e6, seconds) # 15 % of the photons come in the dead time of the previous one
+    assert hist.sum() < 0.9 * photon_cnt
+    ttl_seconds = TTL_PERIOD * XEM7305_Emulator.CLOCK_PERIOD * 1e-9
+    corrector = MMD_Histogram.HistogramCorrector(TTL_PERIOD, ttl_seconds, dead_bins=XEM7305_MicroMotion_Detector.DEAD_TIME_CLOCKS)
+    corrected = corrector.correct(hist, seconds)
+    assert corrected.sum() == pytest.approx(photon_cnt, rel=0.03)
+    assert np.all(corrected >= hist)
+    raw = MMD_Histogram.fit_modulation(hist)['modulation']
+    fitted = corrector.fit(hist, seconds)['modulation']
+    assert abs(fitted - 0.8) < abs(raw - 0.8) and fitted == pytest.approx(0.8, abs=0.01) # the modulation of the emulator
+
+def test_background_is_scaled_to_the_detecting_time():
+    corrector = MMD_Histogram.HistogramCorrector(4, 1e-6, dead_bins=0)
+    for k in range(5):
+        corrector.add_background(np.array([1, 2, 0, 1]), 0.2)
+    assert corrector.background_time == pytest.approx(1.)
+    assert list(corrector.background_rate()) == pytest.approx([5, 10, 0, 5])
+    assert list(corrector.correct(np.array([100, 100, 100, 100]), 2.)) == pytest.approx([90, 80, 100, 90])
+    corrector.clear_background()
+    assert corrector.background_time == 0 and corrector.background.sum() == 0
+
+def test_no_dead_time_no_change():
+    hist = np.arange(10.)
+    assert np.array_equal(MMD_Histogram.dead_time_correct(hist, 1000, 0), hist)
@@ -0,0 +1,39 @@
+""" The Verilator co-simulation: its build, and the driver against the RTL where Verilator is installed. """
+
+import os
+import time
+import numpy as np
+import pytest
+import XEM7305_Cosim
+import XEM7305_MicroMotion_Detector
+
+BIT_FILE = os.path.join(os.path.dirname(XEM7305_Cosim.FIRMWARE_DIR), 'micromotion_detector.bit')
+
+def test_build_needs_verilator(tmp_path, monkeypatch):
+    monkeypatch.setattr(XEM7305_Cosim, 'find_verilator', lambda: None)
+    with pytest.raises(RuntimeError, match="verilator not found"):
+        XEM7305_Cosim.build(build_dir=str(tmp_path), force=True)
+
+def test_build_is_cached(tmp_path, monkeypatch):
+    """ A binary newer than the RTL sources is not built again. """
+    binary = os.path.join(str(tmp_path), XEM7305_Cosim.BINARY_NAME)
+    open(binary, 'w').close()
+    t = time.time() + 60
+    os.utime(binary, (t, t))
+    monkeypatch.setattr(XEM7305_Cosim, 'find_verilator', lambda: pytest.fail("built again"))
+    assert XEM7305_Cosim.build(build_dir=str(tmp_path)) == binary
+
+@pytest.mark.skipif(XEM7305_Cosim.find_verilator() is None, reason="verilator is not installed")
+def test_driver_against_the_rtl():
+    cosim = XEM7305_Cosim.FrontPanelCosim(photon_rate=1e6, realtime=False)
+    dev = XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=cosim, bit_file=BIT_FILE)
+    dev.reset_dev()
+    cosim.advance(0.001)
+    photon_cnt, tdiff_cnt, ttl_period, fifo_cnt = dev.probe_dev()
+    assert photon_cnt > 0 and tdiff_cnt > 0
+    assert 106 <= ttl_period <= 107 # 460 MHz / (21.5 MHz / n_period 5)
+    buff = bytearray(4 * (fifo_cnt // 4 * 4))
+    dev.pipe_out(buff)
+    diff = np.frombuffer(buff, dtype=np.uint8)
+    assert diff.size > 0 and np.all((diff >= 1) & (diff <= ttl_period))
+    cosim.Close()
@@ -0,0 +1,63 @@
+""" DeltaPublisher and DeltaDecoder: the histogram rebuilt exactly from keyframes and sparse deltas. """
+
+import numpy as np
+import MMD_Histogram
+import MMD_Server
+
+def test_varints_and_zigzag():
+    values = np.array([0, 1, 127, 128, 300, 16383, 16384, 2**32, 2**63 - 1], dtype=np.uint64)
+    assert np.array_equal(MMD_Histogram.unpack_varints(MMD_Histogram.pack_varints(values)), values)
+    incr = np.array([0, 1, -1, 5, -300, 2**40, -2**40])
+    assert np.array_equal(MMD_Histogram.zigzag_decode(MMD_Histogram.zigzag_encode(incr)), incr)
+
+def test_round_trip():
+    rng = np.random.default_rng(1)
+    pub = MMD_Histogram.DeltaPublisher(keyframe_interval=10)
+    dec = MMD_Histogram.DeltaDecoder()
+    kinds = []
+    pub.add_subscriber(lambda seq, packet, hist: kinds.append(packet[:1]) or dec.apply(packet))
+    hist = np.zeros(107, dtype=np.int64)
+    for k in range(30):
+        hist = hist + np.bincount(rng.integers(0, 107, 5), minlength=107)
+        if (k == 12):
+            hist[:] = 0 # a restart: the bins decrease
+        pub.publish(hist)
+        assert dec.synced and dec.seq == pub.seq and np.array_equal(dec.hist, hist)
+    assert kinds.count(MMD_Histogram.KEYFRAME) == 4 # the first one, then every 10 packets
+    pub.publish(np.zeros(120, dtype=np.int64)) # other bins: a keyframe
+    assert kinds[-1] == MMD_Histogram.KEYFRAME and dec.hist.size == 120
+
+def test_missed_packet_waits_for_a_keyframe():
+    pub = MMD_Histogram.DeltaPublisher(keyframe_interval=5)
+    dec = MMD_Histogram.DeltaDecoder()
+    hist = np.zeros(16, dtype=np.int64)
+    packets = []
+    for k in range(1, 11):
+        hist[k] += k
+        packets.append(pub.publish(hist))
+    assert dec.apply(packets[0])
+    assert not dec.apply(packets[2]) # packets[1] was missed
+    assert not dec.apply(packets[3]) and not dec.synced
+    assert dec.apply(packets[4]) # seq 5: a keyframe
+    for packet in packets[5:]:
+        assert dec.apply(packet)
+    assert np.array_equal(dec.hist, hist)
+
+def test_subscriber_gets_the_packets():
+    server = MMD_Server.ControlServer(None, port=0)
+    server.start()
+    client = MMD_Server.ControlClient(port=server.address[1], timeout=5.)
+    pub = MMD_Histogram.DeltaPublisher()
+    pub.add_subscriber(server.publish)
+    hist = np.zeros(107, dtype=np.int64)
+    hist[3] = 1
+    pub.publish(hist) # before the subscription: sent as a keyframe at subscribe
+    client.subscribe()
+    for k in range(5):
+        hist[(7 * k) % 107] += k + 1
+        pub.publish(hist)
+    for k in range(6):
+        client.next_event()
+    assert client.seq == pub.seq and np.array_equal(client.hist, hist)
+    client.close()
+    server.stop()
@@ -0,0 +1,76 @@
+""" Event files whose timestamps restart from 0 (resume, reconnect) are not taken for a wrap. """
+
+import os
+import shutil
+import time
+import numpy as np
+import pytest
+import MMD_Analysis
+import XEM7305_MicroMotion_Detector
+
+BIT_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'micromotion_detector.bit')
+
+def write_events(path, ts, restarts=None):
+    words = (np.asarray(ts, dtype=np.uint32) << 8) | 50
+    words.astype('<u4').tofile(path)
+    if (restarts is not None):
+        with open(path + XEM7305_MicroMotion_Detector.RESTARTS_SUFFIX, 'w') as f:
+            f.write("".join("%d\n" % n for n in restarts))
+
+def test_restart_is_not_a_wrap(tmp_path):
+    path = str(tmp_path / 'mmd_events.bin')
+    # 3 s of events, then the resumed run from the reset: 1 s
+    first = np.arange(1000, 2360000, 2360)
+    second = np.arange(100, 787000, 787)
+    write_events(path, np.concatenate([first, second]), restarts=[first.size])
+    ticks, diff = XEM7305_MicroMotion_Detector.load_events(path)
+    assert np.all(np.diff(ticks) >= 0)
+    assert ticks[-1] == first[-1] + second[-1] # the time between the parts is not counted
+    result = MMD_Analysis.analyze([path], ttl_period=107, jobs=1, shard_events=700)
+    span = (first[-1] - first[0]) + (second[-1] - second[0])
+    assert result['files'][0]['duration'] == pytest.approx(span * XEM7305_MicroMotion_Detector.TIMESTAMP_TICK * 1e-9)
+    assert result['files'][0]['events'] == first.size + second.size
+
+def test_without_restarts_a_step_back_is_a_wrap(tmp_path):
+    path = str(tmp_path / 'mmd_events.bin')
+    write_events(path, [100, 16777000, 200])
+    ticks, diff = XEM7305_MicroMotion_Detector.load_events(path)
+    assert list(ticks) == [100, 16777000, (1 << 24) + 200]
+
+def test_reconnect_marks_the_restart(tmp_path, monkeypatch):
+    pytest.importorskip('PyQt5')
+    pytest.importorskip('pyqtgraph')
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+    import MMD_GUI
+    shutil.copy(BIT_FILE, str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(MMD_GUI, 'SIMULATE', False)
+    monkeypatch.setattr(MMD_GUI, 'EMULATE', True)
+    app = QApplication.instance() or QApplication([])
+    w = MMD_GUI.MainWindow()
+    w.ckbCountStop.setChecked(False)
+    w.ckbTimeStop.setChecked(False)
+    w.ckbTimestamp.setChecked(True)
+    w.start()
+    t_end = time.monotonic() + 0.5
+    while (time.monotonic() < t_end):
+        app.processEvents()
+        time.sleep(0.005)
+    w.dev._device.unplug()
+    t_end = time.monotonic() + 0.3
+    while (time.monotonic() < t_end):
+        app.processEvents()
+        time.sleep(0.005)
+    n_before = w.mmd.events_file.tell() // XEM7305_MicroMotion_Detector.BYTES_PER_EVENT
+    w.dev._device.plug()
+    t_end = time.monotonic() + 1.5
+    while (time.monotonic() < t_end):
+        app.processEvents()
+        time.sleep(0.005)
+    assert w.mmd.n_reconnect == 1
+    w.stop()
+    w.close()
+    assert XEM7305_MicroMotion_Detector.load_restarts(MMD_GUI.EVENTS_FILE) == [n_before]
+    ticks, diff = XEM7305_MicroMotion_Detector.load_events(MMD_GUI.EVENTS_FILE)
+    assert np.all(np.diff(ticks) >= 0)
@@ -0,0 +1,40 @@
+""" Sub-clock time resolution (FINE_BITS) against the emulator: the histogram mode counts c_clk / 2^fine_bits. """
+
+import numpy as np
+import XEM7305_Emulator
+import XEM7305_MicroMotion_Detector
+
+def make_detector(fine_bits):
+    emu = XEM7305_Emulator.FrontPanelEmulator(photon_rate=1e5, realtime=False, seed=4, fine_bits=fine_bits)
+    dev = XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=emu, bit_file=XEM7305_Emulator.__file__)
+    return emu, dev
+
+def test_build_word_is_read():
+    emu, dev = make_detector(2)
+    assert dev.fine_bits == 2
+    assert dev.hist_bins == XEM7305_MicroMotion_Detector.HIST_BINS << 2
+    assert dev.sampling_period == XEM7305_Emulator.CLOCK_PERIOD / 4
+    emu, dev = make_detector(0)
+    assert dev.fine_bits == 0 and dev.hist_bins == XEM7305_MicroMotion_Detector.HIST_BINS
+
+def test_histogram_has_the_sub_clock_bins():
+    emu, dev = make_detector(2)
+    dev.set_histogram_mode(True)
+    dev.reset_dev()
+    emu.advance(0.1)
+    hist = dev.read_histogram()
+    tdiff_cnt = dev.probe_dev()[1]
+    assert hist.size == dev.hist_bins and hist.sum() == tdiff_cnt > 0
+    fine = np.flatnonzero(hist)
+    assert fine.min() >= 1 and fine.max() <= emu.ttl_period << 2 # c_diff 1 ~ TTL period, in quarters of a clock
+    assert np.count_nonzero(hist[::4]) > 0 and np.count_nonzero(hist[1::4]) > 0 # not only whole clocks
+
+def test_fifo_still_gets_clock_periods():
+    emu, dev = make_detector(2)
+    dev.reset_dev()
+    emu.advance(0.01)
+    n_words = dev.fifo_r_count() // 4 * 4
+    buff = bytearray(4 * n_words)
+    dev.pipe_out(buff)
+    diff = np.frombuffer(buff, dtype=np.uint8)
+    assert diff.size > 0 and diff.max() <= emu.ttl_period # not 4 times as large
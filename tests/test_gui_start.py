@@ -0,0 +1,53 @@
+""" The USB transactions of Start in the GUI, against the emulator. """
+
+import os
+import shutil
+import pytest
+
+pytest.importorskip('PyQt5')
+pytest.importorskip('pyqtgraph')
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtWidgets import QApplication
+import MMD_GUI
+
+BIT_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'micromotion_detector.bit')
+
+def test_start_transactions(tmp_path, monkeypatch):
+    """
+    Histogram mode (no reader thread, so the count is exact): the 2 probes of the RF trigger TTL and PMT signals (the probe
+    does not reset), then set_modes and the one reset of start_device, a transaction with a self-timed reset.
+    """
+    shutil.copy(BIT_FILE, str(tmp_path))
+    monkeypatch.chdir(tmp_path) # the checkpoint written at stop
+    monkeypatch.setattr(MMD_GUI, 'SIMULATE', False)
+    monkeypatch.setattr(MMD_GUI, 'EMULATE', True)
+    app = QApplication.instance() or QApplication([])
+    w = MMD_GUI.MainWindow()
+    emu = w.dev._device
+    assert w.dev._trigger_reset
+    w.ckbHistOnFPGA.setChecked(True)
+    n = emu.n_transactions
+    w.start()
+    assert w.mmd.is_detecting()
+    assert emu.n_transactions - n == 4
+    w.stop()
+    w.close()
+
+def test_start_without_photons(tmp_path, monkeypatch):
+    """ The probe sees no time difference: no detecting, and the device is not reset. """
+    shutil.copy(BIT_FILE, str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(MMD_GUI, 'SIMULATE', False)
+    monkeypatch.setattr(MMD_GUI, 'EMULATE', True)
+    monkeypatch.setattr(MMD_GUI, 'N_MAX_PROBE', 3)
+    app = QApplication.instance() or QApplication([])
+    w = MMD_GUI.MainWindow()
+    emu = w.dev._device
+    emu.photon_rate = 0.
+    n = emu.n_transactions
+    w.start()
+    assert not w.mmd.is_detecting()
+    assert w.lblAlarm.text() == MMD_GUI.ALARM_NO_SIGNALS
+    assert emu.n_transactions - n == 1 + 3 # the probes
+    w.close()
@@ -0,0 +1,67 @@
+""" Stopping the reader thread of the GUI, at Stop and at a disconnect, against the emulator. """
+
+import os
+import shutil
+import time
+import pytest
+
+pytest.importorskip('PyQt5')
+pytest.importorskip('pyqtgraph')
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtWidgets import QApplication
+import MMD_GUI
+
+BIT_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'micromotion_detector.bit')
+
+def process(app, seconds):
+    t_end = time.monotonic() + seconds
+    while (time.monotonic() < t_end):
+        app.processEvents()
+        time.sleep(0.005)
+
+def run_window(seconds):
+    app = QApplication.instance() or QApplication([])
+    w = MMD_GUI.MainWindow()
+    w.ckbCountStop.setChecked(False)
+    w.ckbTimeStop.setChecked(False)
+    w.start()
+    process(app, seconds)
+    return app, w
+
+def test_stop_keeps_the_read_buffers(tmp_path, monkeypatch):
+    shutil.copy(BIT_FILE, str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(MMD_GUI, 'SIMULATE', False)
+    monkeypatch.setattr(MMD_GUI, 'EMULATE', True)
+    app, w = run_window(1.) # app: the QApplication lives as long as the window
+    mmd = w.mmd
+    assert mmd.n_update > 0
+    w.stop()
+    assert mmd.reader is None
+    photon_cnt, tdiff_cnt, ttl_period, fifo_cnt = w.dev.probe_dev()
+    # every time difference counted by the FPGA is in the histogram, or still in the FIFO (the bytes of a word being written aside)
+    assert 0 <= tdiff_cnt - mmd.events_total - 4 * fifo_cnt < 4
+    assert sum(mmd.hist) == mmd.cnt_detected == mmd.events_total
+    w.close()
+
+def test_unplug_is_found_by_the_reader(tmp_path, monkeypatch):
+    """ The updates do not use the device while the reader thread does: the reader finds the disconnect. """
+    shutil.copy(BIT_FILE, str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(MMD_GUI, 'SIMULATE', False)
+    monkeypatch.setattr(MMD_GUI, 'EMULATE', True)
+    app, w = run_window(0.5)
+    mmd = w.mmd
+    is_open = w.dev.is_open
+    reader_running = [] # at each is_open() call
+    monkeypatch.setattr(w.dev, 'is_open', lambda: reader_running.append(mmd.reader is not None) or is_open())
+    w.dev._device.unplug()
+    process(app, 0.5)
+    assert mmd.reconnecting and mmd.reader is None
+    w.dev._device.plug()
+    process(app, 1.5) # the next attempt, after RECONNECT_INTERVAL
+    assert not mmd.reconnecting and mmd.n_reconnect == 1 and mmd.reader is not None
+    assert not any(reader_running)
+    w.stop()
+    w.close()
@@ -0,0 +1,31 @@
+""" MMD_Health.HealthMonitor, with simulated ticks. """
+
+import MMD_Health
+
+def run(periods, ttl_period=107):
+    """ The events of ticks of 0.2 s with photons and RF trigger TTLs, of these periods. """
+    health = MMD_Health.HealthMonitor(ttl_period=ttl_period, stall_time=1.)
+    events = []
+    for k, period in enumerate(periods):
+        events.extend(health.check(100 * (k + 1), 90 * (k + 1), period, now=0.2 * (k + 1)))
+    return health, events
+
+def test_period_change_is_confirmed():
+    health, events = run([107, 107, 214, 214, 214])
+    assert [(e.state, e.ttl_period) for e in events] == [(MMD_Health.TTL_CHANGED, 214)]
+    assert not health.accumulate
+
+def test_glitch_is_not_reported():
+    health, events = run([107, 214, 107, 107])
+    assert events == []
+    assert health.accumulate
+
+def test_second_change_is_reported():
+    """ A new period while already changed is reported, e.g. for the segment of a new histogram. """
+    health, events = run([107, 214, 214, 321, 321, 321, 107])
+    assert [(e.state, e.ttl_period) for e in events] == [(MMD_Health.TTL_CHANGED, 214), (MMD_Health.TTL_CHANGED, 321),
+                                                           (MMD_Health.OK, 107)]
+
+def test_alternating_periods_are_not_confirmed():
+    health, events = run([107, 214, 321, 214, 321])
+    assert events == []
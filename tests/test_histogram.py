@@ -0,0 +1,25 @@
+""" MMD_Histogram utilities. """
+
+import numpy as np
+import MMD_Histogram
+
+def test_time_resolved_histogram():
+    hists, edges = MMD_Histogram.time_resolved_histogram([0, 5, 12, 13], [1, 2, 3, 9], size_bins=4, t_bin=10)
+    assert hists.tolist() == [[0, 1, 1, 0], [0, 0, 0, 1]] # bin 9 is ignored
+    assert edges.tolist() == [0, 10, 20]
+
+def test_time_resolved_histogram_after_the_events():
+    hists, edges = MMD_Histogram.time_resolved_histogram([1, 2, 3], [0, 1, 2], size_bins=5, t_bin=1, t_start=10)
+    assert hists.shape == (0, 5)
+    assert edges.tolist() == [10]
+
+def test_delta_round_trip_of_large_increments():
+    """ Increments above 2**53 are not rounded by the encoding (no float64 on the way). """
+    hist = np.zeros(8, dtype=np.int64)
+    dec = MMD_Histogram.DeltaDecoder()
+    assert dec.apply(MMD_Histogram.encode_keyframe(0, hist))
+    bins = np.array([1, 6])
+    incr = np.array([2**60 + 1, -(2**55 + 3)])
+    assert dec.apply(MMD_Histogram.encode_delta(1, hist.size, bins, incr))
+    hist[bins] += incr
+    assert np.array_equal(dec.hist, hist)
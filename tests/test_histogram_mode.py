@@ -0,0 +1,37 @@
+""" The on-FPGA histogram mode against the emulator: each readout holds the photons since the previous one. """
+
+import numpy as np
+import XEM7305_Emulator
+import XEM7305_MicroMotion_Detector
+
+def make_detector():
+    emu = XEM7305_Emulator.FrontPanelEmulator(photon_rate=1e5, realtime=False, seed=3)
+    dev = XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=emu, bit_file=XEM7305_Emulator.__file__)
+    return emu, dev
+
+def test_readouts_count_every_photon_once():
+    emu, dev = make_detector()
+    dev.set_histogram_mode(True)
+    dev.reset_dev()
+    total = np.zeros(XEM7305_MicroMotion_Detector.HIST_BINS, dtype=np.int64)
+    for k in range(5):
+        emu.advance(0.05)
+        hist = dev.read_histogram()
+        assert hist.size == XEM7305_MicroMotion_Detector.HIST_BINS
+        total += hist
+    photon_cnt, tdiff_cnt, ttl_period, fifo_cnt = dev.probe_dev()
+    assert tdiff_cnt > 0 and total.sum() == tdiff_cnt
+    assert fifo_cnt == 0 # the FIFO gets nothing in the histogram mode
+    assert ttl_period == emu.ttl_period
+    assert np.all(total[ttl_period + 1:] == 0) and total[0] == 0 # c_diff is 1 ~ TTL period
+    assert dev.read_histogram().sum() == 0 # nothing new
+
+def test_fifo_mode_fills_the_fifo():
+    emu, dev = make_detector()
+    dev.set_histogram_mode(True)
+    dev.set_histogram_mode(False)
+    dev.reset_dev()
+    emu.advance(0.01)
+    photon_cnt, tdiff_cnt, ttl_period, fifo_cnt = dev.probe_dev()
+    assert fifo_cnt == tdiff_cnt // 4 > 0
+    assert dev.read_histogram().sum() == 0
@@ -0,0 +1,46 @@
+""" The rate limited queued logging of the MMD loggers. """
+
+import logging
+import MMD_Logging
+
+class FakeTime:
+    now = 0.
+    @classmethod
+    def monotonic(cls):
+        return cls.now
+
+def make_record(msg, *args):
+    return logging.LogRecord('MMD.test', logging.DEBUG, __file__, 1, msg, args, None)
+
+def test_rate_limit_per_template(monkeypatch):
+    monkeypatch.setattr(MMD_Logging, 'time', FakeTime)
+    flt = MMD_Logging.RateLimitFilter(count=5, period=1.)
+    passed = [flt.filter(make_record("update # %d", k)) for k in range(20)]
+    assert sum(passed) == 5
+    assert flt.filter(make_record("other message")) # another template has its own bucket
+    FakeTime.now = 1.
+    record = make_record("update # %d", 20)
+    assert flt.filter(record)
+    assert "15 similar messages suppressed" in record.msg
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+def test_queued_records_are_written_by_the_thread():
+    handler = ListHandler()
+    logger = MMD_Logging.setup_logging(logging.DEBUG, count=3, handler=handler)
+    try:
+        child = logging.getLogger(MMD_Logging.LOGGER_NAME + '.test')
+        for k in range(10):
+            child.debug("update # %d", k)
+        child.info("done")
+        MMD_Logging.stop_logging() # flushes the queue
+        assert [line.split(': ', 1)[1] for line in handler.lines] == ["update # 0", "update # 1", "update # 2", "done"]
+    finally:
+        MMD_Logging.stop_logging()
+        logger.handlers = []
+        logger.propagate = True
@@ -0,0 +1,50 @@
+""" MetricsRegistry and MetricsServer: the Prometheus text format over HTTP. """
+
+import socket
+import urllib.request
+import urllib.error
+import pytest
+import MMD_Metrics
+
+def test_render():
+    registry = MMD_Metrics.MetricsRegistry()
+    registry.update(mmd_photon_rate=1234.5, mmd_ttl_period=107)
+    registry.inc('mmd_updates_total')
+    registry.inc('mmd_updates_total', 2)
+    text = registry.render()
+    assert "# TYPE mmd_updates_total counter\nmmd_updates_total 3.0\n" in text
+    assert "mmd_photon_rate 1234.5\n" in text
+    assert "mmd_ttl_period 107.0\n" in text
+    registry.reset()
+    assert registry.get('mmd_updates_total') == 0
+
+def test_serve_over_tcp():
+    registry = MMD_Metrics.MetricsRegistry()
+    registry.set('mmd_detecting', 1)
+    server = MMD_Metrics.MetricsServer(registry, port=0)
+    server.start()
+    try:
+        host, port = server.address
+        response = urllib.request.urlopen('http://%s:%d/metrics' % (host, port), timeout=5)
+        assert response.headers['Content-Type'] == MMD_Metrics.CONTENT_TYPE
+        assert "mmd_detecting 1.0" in response.read().decode()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen('http://%s:%d/other' % (host, port), timeout=5)
+    finally:
+        server.stop()
+    assert server.address is None
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason="no Unix sockets")
+def test_serve_over_unix_socket(tmp_path):
+    path = str(tmp_path / 'mmd_metrics.sock')
+    server = MMD_Metrics.MetricsServer(MMD_Metrics.MetricsRegistry(), unix_socket=path)
+    server.start()
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(path)
+        client.sendall(b'GET /metrics HTTP/1.0\r\n\r\n')
+        reply = client.makefile('rb').read().decode()
+        client.close()
+        assert reply.startswith("HTTP/1.0 200") and "mmd_read_bytes_total 0.0" in reply
+    finally:
+        server.stop()
@@ -0,0 +1,107 @@
+""" PipeReader against the emulated board, with the latency and the bandwidth of a slow USB link. """
+
+import time
+import numpy as np
+import XEM7305_Emulator
+import XEM7305_MicroMotion_Detector
+
+FIFO_WORDS = XEM7305_Emulator.FIFO_DEPTH // 4
+
+def make_detector(**kwargs):
+    emu = XEM7305_Emulator.FrontPanelEmulator(seed=1, **kwargs)
+    dev = XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=emu, bit_file=XEM7305_Emulator.__file__)
+    return emu, dev
+
+def test_no_event_lost():
+    """ Every event counted by the FPGA is read, or still in the FIFO, in order. """
+    emu, dev = make_detector(photon_rate=2e5, latency=0.0005)
+    dev.set_modes(timestamp=True)
+    dev.reset_dev()
+    reader = XEM7305_MicroMotion_Detector.PipeReader(dev, min_words=4)
+    reader.start()
+    chunks = []
+    t0 = time.perf_counter()
+    while (time.perf_counter() - t0 < 1.):
+        time.sleep(0.2)
+        chunks.extend(reader.get_all())
+    chunks.extend(reader.stop())
+    status = dev.probe_dev()
+    buff = b''.join(buff for buff, s in chunks)
+    n_events = len(buff) // XEM7305_MicroMotion_Detector.BYTES_PER_EVENT
+    assert n_events > 0
+    assert n_events + status[3] == status[1]
+    ticks, diff = dev.decode_events(buff)
+    assert np.all(np.diff(ticks) >= 0)
+    dev.close()
+
+def test_reads_ahead_of_a_slow_caller():
+    """ A caller taking the buffers at long update intervals does not leave the data in the FIFO. """
+    emu, dev = make_detector(photon_rate=2e5, latency=0.0005)
+    dev.reset_dev()
+    reader = XEM7305_MicroMotion_Detector.PipeReader(dev, min_words=4)
+    reader.start()
+    n_bytes = 0
+    for k in range(3):
+        time.sleep(0.5)
+        n_bytes = n_bytes + sum(len(buff) for buff, s in reader.get_all())
+    n_bytes = n_bytes + sum(len(buff) for buff, s in reader.stop())
+    assert reader.fifo_max < FIFO_WORDS // 4
+    assert reader.queued_max > XEM7305_Emulator.FIFO_DEPTH // 4
+    assert n_bytes == reader.bytes_read
+    dev.close()
+
+def test_look_ahead_is_capped():
+    """ Beyond max_bytes waiting for the caller, the thread stops reading and the FIFO keeps the data. """
+    emu, dev = make_detector(photon_rate=2e5, latency=0.0005)
+    dev.reset_dev()
+    reader = XEM7305_MicroMotion_Detector.PipeReader(dev, max_bytes=1 << 14, min_words=4)
+    reader.start()
+    time.sleep(0.3)
+    queued = reader.queued_max
+    n_bytes = sum(len(buff) for buff, s in reader.stop())
+    assert 1 << 14 <= queued < (1 << 14) + XEM7305_Emulator.FIFO_DEPTH
+    assert n_bytes == reader.bytes_read
+    assert dev.probe_dev()[3] > 0
+    dev.close()
+
+def read_rate(threaded, seconds=1.):
+    """ Time differences per second taken by a caller spending 0.5 us per time difference on decoding. """
+    emu, dev = make_detector(photon_rate=1e6, latency=0.002, bandwidth=1.25e6)
+    dev.reset_dev()
+    reader = XEM7305_MicroMotion_Detector.PipeReader(dev) if threaded else None
+    if (threaded):
+        reader.start()
+    n_events, t0 = 0, time.perf_counter()
+    while (time.perf_counter() - t0 < seconds):
+        if (threaded):
+            chunk = reader.get(timeout=0.1)
+            buff = chunk[0] if chunk is not None else b''
+        else:
+            fifo_cnt = dev.probe_dev()[3]
+            buff = bytearray(4 * (fifo_cnt // 4 * 4))
+            dev.pipe_out(buff)
+        time.sleep(len(buff) * 0.5e-6)
+        n_events = n_events + len(buff)
+    rate = n_events / (time.perf_counter() - t0)
+    if (threaded):
+        reader.stop()
+    dev.close()
+    return rate
+
+def test_threaded_is_faster():
+    assert read_rate(True) > 1.2 * read_rate(False)
+
+def test_unplug_is_seen_by_the_thread():
+    emu, dev = make_detector(photon_rate=2e5, latency=0.0005)
+    dev.reset_dev()
+    reader = XEM7305_MicroMotion_Detector.PipeReader(dev, min_words=4)
+    reader.start()
+    time.sleep(0.1)
+    assert not reader.lost
+    emu.unplug()
+    t0 = time.perf_counter()
+    while (not reader.lost and time.perf_counter() - t0 < 1.):
+        time.sleep(0.01)
+    assert reader.lost
+    reader.stop()
+    dev.close()
@@ -0,0 +1,43 @@
+""" StageProfiler: the stages of an update tick, in a ring buffer of fixed size. """
+
+import numpy as np
+import MMD_Profiler
+
+def run_ticks(prof, n):
+    for k in range(n):
+        prof.begin_tick()
+        prof.mark('wireout')
+        prof.mark('pipeout')
+        prof.mark('pipeout') # a stage marked twice in a tick adds up
+        prof.end_tick()
+
+def test_ring_keeps_the_last_ticks():
+    prof = MMD_Profiler.StageProfiler(size=8)
+    run_ticks(prof, 20)
+    assert prof.n_tick == 20
+    ticks = prof.samples()
+    assert len(ticks) == 8 and np.all(ticks > 0) # the whole ring, no column kept empty for the next tick
+    assert np.all(prof.samples('wireout') <= ticks)
+    assert np.all(prof.samples('decode') == 0) # not marked
+    summary = prof.summary()
+    assert set(summary) == set(MMD_Profiler.STAGES) | {'tick'}
+    assert summary['tick']['max'] >= summary['tick']['p50'] > 0
+    prof.clear()
+    assert prof.n_tick == 0 and len(prof.samples()) == 0
+
+def test_disabled_records_nothing():
+    prof = MMD_Profiler.StageProfiler(enabled=False)
+    run_ticks(prof, 5)
+    assert prof.n_tick == 0
+    prof.enabled = True
+    run_ticks(prof, 5)
+    assert prof.n_tick == 5
+
+def test_dump(tmp_path):
+    prof = MMD_Profiler.StageProfiler(size=16)
+    run_ticks(prof, 4)
+    path = str(tmp_path / 'profile.txt')
+    prof.dump(path)
+    data = np.loadtxt(path)
+    assert data.shape == (4, len(MMD_Profiler.STAGES) + 1)
+    assert "ticks: 4" in prof.report()
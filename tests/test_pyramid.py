@@ -0,0 +1,51 @@
+""" HistogramPyramid: the coarser views of the histogram, equal to rebin() for every factor. """
+
+import numpy as np
+import pytest
+import MMD_Histogram
+import MMD_Server
+
+@pytest.mark.parametrize('size_bins', [1, 2, 7, 107, 256, 300])
+def test_rebin_of_every_factor(size_bins):
+    rng = np.random.default_rng(size_bins)
+    pyramid = MMD_Histogram.HistogramPyramid(size_bins)
+    hist = np.zeros(size_bins, dtype=np.int64)
+    for k in range(3):
+        hist_tmp = rng.integers(0, 50, size_bins)
+        pyramid.add(hist_tmp)
+        hist += hist_tmp
+    assert np.array_equal(pyramid.hist, hist)
+    for factor in range(1, size_bins + 3):
+        coarse = pyramid.rebin(factor)
+        assert np.array_equal(coarse, MMD_Histogram.rebin(hist, factor))
+        edges = pyramid.edges(factor)
+        assert edges.size == coarse.size + 1 and edges[-1] == size_bins
+    assert pyramid.levels[-1].size == 1 and pyramid.levels[-1][0] == hist.sum()
+
+def test_set_replaces_every_level():
+    pyramid = MMD_Histogram.HistogramPyramid(10)
+    pyramid.add(np.ones(10, dtype=np.int64))
+    assert list(pyramid.rebin(3)) == [3, 3, 3, 1]
+    pyramid.set(np.arange(10))
+    assert list(pyramid.rebin(4)) == [6, 22, 17]
+    assert list(pyramid.rebin(3)) == [3, 12, 21, 9] # the prefix sums are recomputed
+    pyramid.set(np.zeros(10))
+    assert all(level.sum() == 0 for level in pyramid.levels)
+
+class PyramidController:
+    def __init__(self, pyramid):
+        self.pyramid = pyramid
+    def remote_histogram(self, factor):
+        return {'seq': 1, 'factor': factor, 'edges': self.pyramid.edges(factor).tolist(), 'hist': self.pyramid.rebin(factor).tolist()}
+
+def test_remote_rebinned_histogram():
+    pyramid = MMD_Histogram.HistogramPyramid(107)
+    pyramid.add(np.arange(107))
+    server = MMD_Server.ControlServer(PyramidController(pyramid), port=0)
+    server.start()
+    client = MMD_Server.ControlClient(port=server.address[1], timeout=5.)
+    assert client.histogram(factor=4) == MMD_Histogram.rebin(np.arange(107), 4).tolist()
+    with pytest.raises(RuntimeError, match="factor"):
+        client.histogram(factor=0)
+    client.close()
+    server.stop()
@@ -0,0 +1,29 @@
+""" read_histogram() when the bank swap fails. """
+
+import XEM7305_Emulator
+import XEM7305_MicroMotion_Detector
+
+class SwapFailingEmulator(XEM7305_Emulator.FrontPanelEmulator):
+    """ The trigger of the bank swap fails, the other transactions work. """
+    fail_swap = False
+
+    def ActivateTriggerIn(self, epAddr, bit):
+        if (self.fail_swap and bit == 0):
+            return XEM7305_Emulator.Failed
+        return super().ActivateTriggerIn(epAddr, bit)
+
+def test_failed_swap_returns_none():
+    emu = SwapFailingEmulator(photon_rate=1e5, realtime=False, seed=1)
+    dev = XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=emu, bit_file=XEM7305_Emulator.__file__)
+    dev.set_modes(histogram=True)
+    dev.reset_dev()
+    emu.advance(0.1)
+    first = dev.read_histogram()
+    assert first is not None and first.sum() > 0
+    emu.advance(0.1)
+    emu.fail_swap = True
+    assert dev.read_histogram() is None # not the bank read last time, counted again
+    emu.fail_swap = False
+    second = dev.read_histogram()
+    assert second.sum() > 0
+    dev.close()
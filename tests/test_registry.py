@@ -0,0 +1,68 @@
+""" The typed errors of the driver, the retries of init_dev(), and the registry of open detectors, against the emulator. """
+
+import pytest
+import XEM7305_Emulator
+import XEM7305_MicroMotion_Detector
+
+class CountingEmulator(XEM7305_Emulator.FrontPanelEmulator):
+    """ Count the configurations, and fail the first opens. """
+    def __init__(self, fail_opens=0, **kwargs):
+        super().__init__(**kwargs)
+        self.fail_opens = fail_opens
+        self.n_configure = 0
+
+    def OpenBySerial(self, serial=''):
+        if (self.fail_opens > 0):
+            self.fail_opens = self.fail_opens - 1
+            return XEM7305_Emulator.Failed
+        return super().OpenBySerial(serial)
+
+    def ConfigureFPGA(self, strFilename):
+        self.n_configure = self.n_configure + 1
+        return super().ConfigureFPGA(strFilename)
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    waited = []
+    monkeypatch.setattr(XEM7305_MicroMotion_Detector.time, 'sleep', waited.append)
+    return waited
+
+def test_open_is_retried(sleeps):
+    emu = CountingEmulator(fail_opens=2, realtime=False)
+    dev = XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=emu, bit_file=XEM7305_Emulator.__file__)
+    assert dev.is_open()
+    assert sleeps == [XEM7305_MicroMotion_Detector.OPEN_BACKOFF, 2 * XEM7305_MicroMotion_Detector.OPEN_BACKOFF]
+
+def test_errors_are_typed(sleeps):
+    emu = CountingEmulator(fail_opens=100, realtime=False)
+    with pytest.raises(XEM7305_MicroMotion_Detector.DeviceOpenError):
+        XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=emu, bit_file=XEM7305_Emulator.__file__)
+    assert len(sleeps) == XEM7305_MicroMotion_Detector.OPEN_RETRIES
+    del sleeps[:]
+    emu = CountingEmulator(realtime=False)
+    with pytest.raises(XEM7305_MicroMotion_Detector.ConfigureError) as e:
+        XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=emu, bit_file='no_such_file.bit')
+    assert not e.value.transient and sleeps == [] # a missing bit file is not retried
+    emu = CountingEmulator(realtime=False)
+    emu.unplug()
+    with pytest.raises(XEM7305_MicroMotion_Detector.DeviceNotFoundError):
+        XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=emu, bit_file=XEM7305_Emulator.__file__)
+    assert issubclass(XEM7305_MicroMotion_Detector.DeviceNotFoundError, XEM7305_MicroMotion_Detector.DetectorError)
+
+def test_registry_shares_the_detector(sleeps):
+    emu = CountingEmulator(serial='TEST-REGISTRY', realtime=False)
+    det = XEM7305_MicroMotion_Detector.get_detector('TEST-REGISTRY', bit_file=XEM7305_Emulator.__file__, device=emu)
+    try:
+        assert XEM7305_MicroMotion_Detector.get_detector('TEST-REGISTRY', bit_file=XEM7305_Emulator.__file__) is det
+        assert emu.n_configure == 1 # opened and configured once
+        emu.unplug()
+        emu.plug()
+        assert XEM7305_MicroMotion_Detector.get_detector('TEST-REGISTRY', bit_file=XEM7305_Emulator.__file__) is det
+        assert det.is_open() and emu.n_configure == 2 # reconnected
+    finally:
+        XEM7305_MicroMotion_Detector.release_detector(det)
+    assert not det.is_open()
+    other = CountingEmulator(serial='TEST-REGISTRY', realtime=False)
+    det2 = XEM7305_MicroMotion_Detector.get_detector('TEST-REGISTRY', bit_file=XEM7305_Emulator.__file__, device=other)
+    assert det2 is not det
+    XEM7305_MicroMotion_Detector.release_detector(det2)
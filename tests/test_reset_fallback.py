@@ -0,0 +1,33 @@
+""" reset_dev of a firmware without the self-timed reset: the wireIn 0x00 sequence, against the emulator. """
+
+import XEM7305_Emulator
+import XEM7305_MicroMotion_Detector
+
+def make_wire_reset_detector():
+    emu = XEM7305_Emulator.FrontPanelEmulator(photon_rate=1e5, realtime=False, seed=2)
+    dev = XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=emu, bit_file=XEM7305_Emulator.__file__)
+    dev._trigger_reset = False # as read from a bitstream whose build word has no self-timed reset bit
+    return emu, dev
+
+def test_wire_reset_clears_the_fifo_and_the_counters():
+    emu, dev = make_wire_reset_detector()
+    emu.advance(0.05)
+    photon_cnt, tdiff_cnt, ttl_period, fifo_cnt = dev.probe_dev()
+    assert photon_cnt > 0 and tdiff_cnt > 0 and fifo_cnt > 0
+    n = emu.n_transactions
+    dev.reset_dev()
+    assert emu.n_transactions - n == 4 # reset, reset_fifo, release reset_fifo, (1 ms) release reset
+    assert dev.probe_dev() == (0, 0, 0, 0)
+    emu.advance(0.05) # released: counting again
+    photon_cnt, tdiff_cnt, ttl_period, fifo_cnt = dev.probe_dev()
+    assert tdiff_cnt > 0 and fifo_cnt == tdiff_cnt // 4 and ttl_period == emu.ttl_period
+
+def test_wire_reset_after_clear():
+    emu, dev = make_wire_reset_detector()
+    emu.advance(0.05)
+    dev.clear_dev() # held in reset
+    emu.advance(0.05)
+    assert dev.probe_dev() == (0, 0, 0, 0)
+    dev.reset_dev()
+    emu.advance(0.05)
+    assert dev.probe_dev()[1] > 0
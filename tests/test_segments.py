@@ -0,0 +1,62 @@
+""" The histograms of the previous RF trigger TTL periods: saved in the checkpoint, resumed, and served, against the emulator. """
+
+import os
+import shutil
+import time
+import pytest
+
+pytest.importorskip('PyQt5')
+pytest.importorskip('pyqtgraph')
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtWidgets import QApplication
+import MMD_Checkpoint
+import MMD_GUI
+import MMD_Server
+
+BIT_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'micromotion_detector.bit')
+
+def process(app, seconds):
+    t_end = time.monotonic() + seconds
+    while (time.monotonic() < t_end):
+        app.processEvents()
+        time.sleep(0.005)
+
+def test_segments_are_saved_resumed_and_served(tmp_path, monkeypatch):
+    shutil.copy(BIT_FILE, str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(MMD_GUI, 'SIMULATE', False)
+    monkeypatch.setattr(MMD_GUI, 'EMULATE', True)
+    app = QApplication.instance() or QApplication([])
+    w = MMD_GUI.MainWindow()
+    w.ckbCountStop.setChecked(False)
+    w.ckbTimeStop.setChecked(False)
+    w.ckbNewSegment.setChecked(True)
+    w.start()
+    process(app, 0.7)
+    w.dev._device.ttl_period = 120
+    process(app, 1.)
+    mmd = w.mmd
+    assert [ttl_period for ttl_period, _ in mmd.segments] == [107]
+    first = mmd.segments[0][1].copy()
+    assert first.sum() > 0
+    w.stop()
+    mmd.checkpointer.flush()
+
+    snapshot = MMD_Checkpoint.load(MMD_GUI.CHECKPOINT_FILE) # written at Stop
+    assert list(snapshot['segment_ttl_periods']) == [107]
+    assert list(snapshot['segment_hists']) == list(first)
+
+    server = MMD_Server.ControlServer(w, port=0)
+    server.start()
+    client = MMD_Server.ControlClient(port=server.address[1])
+    segments = client.segments()
+    assert [segment['ttl_period'] for segment in segments] == [107]
+    assert segments[0]['hist'] == first.tolist()
+    client.close()
+    server.stop()
+
+    mmd.segments = []
+    mmd.restore_segments(snapshot)
+    assert len(mmd.segments) == 1 and mmd.segments[0][0] == 107 and list(mmd.segments[0][1]) == list(first)
+    w.close()
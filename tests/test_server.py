@@ -0,0 +1,76 @@
+""" ControlServer: the JSON-lines protocol, with a fake controller. """
+
+import json
+import socket
+import pytest
+import MMD_Server
+
+class FakeController:
+    def __init__(self):
+        self.settings = {}
+        self.detecting = False
+    def remote_start(self, **settings):
+        self.settings.update(settings)
+        self.detecting = True
+        return True
+    def remote_stop(self):
+        self.detecting = False
+        return True
+    def remote_set_conditions(self, **conditions):
+        self.settings.update(conditions)
+        return True
+    def remote_status(self):
+        return {'detecting': self.detecting, 'settings': self.settings}
+
+@pytest.fixture
+def server():
+    invoked = []
+    def invoke(fn):
+        invoked.append(fn)
+        return MMD_Server._call_directly(fn)
+    server = MMD_Server.ControlServer(FakeController(), port=0, invoke=invoke)
+    server.start()
+    server.invoked = invoked
+    yield server
+    server.stop()
+
+def test_commands(server):
+    client = MMD_Server.ControlClient(port=server.address[1], timeout=5.)
+    assert client.request('ping') == 'pong'
+    assert client.start(update_interval=200, use_cond_cnt=True, cond_cnt=50000)
+    assert client.status() == {'detecting': True, 'settings': {'update_interval': 200, 'use_cond_cnt': True, 'cond_cnt': 50000}}
+    client.set_conditions(cond_time=10)
+    assert client.status()['settings']['cond_time'] == 10
+    assert client.stop() and not client.status()['detecting']
+    assert len(server.invoked) == 6 # every controller call goes through invoke (the GUI thread)
+    client.close()
+
+def test_errors_are_replies(server):
+    client = MMD_Server.ControlClient(port=server.address[1], timeout=5.)
+    with pytest.raises(RuntimeError, match="unknown command"):
+        client.request('launch')
+    with pytest.raises(RuntimeError, match="unknown settings: speed"):
+        client.start(speed=3)
+    assert not client.status()['detecting'] # the connection is still usable
+    client.close()
+
+def test_raw_json_lines(server):
+    sock = socket.create_connection(server.address, timeout=5.)
+    f = sock.makefile('rb')
+    sock.sendall(b'{"id": 7, "cmd": "ping"}\n{"id": 8, "cmd": "stop", "args": {}}\nnot json\n')
+    assert json.loads(f.readline()) == {'id': 7, 'ok': True, 'result': 'pong'}
+    assert json.loads(f.readline()) == {'id': 8, 'ok': True, 'result': True}
+    reply = json.loads(f.readline())
+    assert reply['id'] is None and not reply['ok']
+    f.close()
+    sock.close()
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason="no Unix sockets")
+def test_unix_socket(tmp_path):
+    path = str(tmp_path / 'mmd_control.sock')
+    server = MMD_Server.ControlServer(FakeController(), unix_socket=path)
+    server.start()
+    client = MMD_Server.ControlClient(unix_socket=path, timeout=5.)
+    assert client.request('ping') == 'pong'
+    client.close()
+    server.stop()
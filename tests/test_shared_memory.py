@@ -0,0 +1,97 @@
+""" The seqlocked shared memory histogram (MMD_SharedMemory), between processes and from the GUI with SHARE. """
+
+import os
+import shutil
+import subprocess
+import sys
+import time
+import numpy as np
+import pytest
+import MMD_SharedMemory
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def name():
+    return 'mmd_test_%d' % os.getpid()
+
+def test_snapshot_of_an_update(name):
+    writer = MMD_SharedMemory.SharedHistogramWriter(8, n_channels=2, name=name)
+    reader = MMD_SharedMemory.SharedHistogramReader(name)
+    assert (reader.size_bins, reader.n_channels) == (8, 2)
+    hist = np.arange(8)
+    writer.publish(hist, np.vstack([hist, 2 * hist]), n_update=3, time_detected=40, cnt_detected=28, channel=1)
+    snapshot = reader.snapshot()
+    assert snapshot['seq'] == 2
+    assert np.array_equal(snapshot['hist'], hist) and np.array_equal(snapshot['channel_hist'][1], 2 * hist)
+    assert (snapshot['n_update'], snapshot['time_detected'], snapshot['cnt_detected'], snapshot['channel']) == (3, 40, 28, 1)
+    assert abs(snapshot['updated'] - time.time()) < 5.
+    hist[:] = 0 # a copy, not a view of the block
+    assert snapshot['hist'].sum() == 28
+    reader.close()
+    writer.close()
+
+def test_wait(name):
+    writer = MMD_SharedMemory.SharedHistogramWriter(4, name=name)
+    reader = MMD_SharedMemory.SharedHistogramReader(name)
+    assert reader.snapshot()['channel_hist'] is None
+    writer.publish(np.ones(4), n_update=1)
+    assert reader.wait(0, timeout=1.)['n_update'] == 1
+    assert reader.wait(2, timeout=0.05) is None # no update after it
+    reader.close()
+    writer.close()
+
+def test_a_new_block_closes_the_old_one(name):
+    writer = MMD_SharedMemory.SharedHistogramWriter(4, name=name)
+    reader = MMD_SharedMemory.SharedHistogramReader(name)
+    writer.close()
+    assert reader.closed and reader.snapshot() is None
+    with pytest.raises(FileNotFoundError):
+        reader.reopen()
+    writer = MMD_SharedMemory.SharedHistogramWriter(16, name=name)
+    reader.reopen()
+    assert reader.size_bins == 16 and not reader.closed
+    reader.close()
+    writer.close()
+
+def test_no_torn_snapshot_in_another_process(name):
+    size_bins, n_updates = 4096, 3000
+    writer = MMD_SharedMemory.SharedHistogramWriter(size_bins, name=name)
+    proc = subprocess.Popen([sys.executable, MMD_SharedMemory.__file__, '--check', name, str(n_updates)],
+                            stdout=subprocess.PIPE, text=True)
+    time.sleep(1.) # the reader attaches
+    hist = np.zeros(size_bins, dtype=np.int64)
+    for k in range(1, n_updates + 1):
+        hist[:] = k
+        writer.publish(hist, n_update=k, cnt_detected=k * size_bins)
+    n, torn, retries = map(int, proc.communicate(timeout=30)[0].split())
+    writer.close()
+    assert n > 0 and torn == 0
+
+def test_the_gui_shares_its_histogram(name, tmp_path, monkeypatch):
+    pytest.importorskip('PyQt5')
+    pytest.importorskip('pyqtgraph')
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+    import MMD_GUI
+    shutil.copy(os.path.join(ROOT, 'micromotion_detector.bit'), str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(MMD_GUI, 'SIMULATE', False)
+    monkeypatch.setattr(MMD_GUI, 'EMULATE', True)
+    monkeypatch.setattr(MMD_GUI, 'SHARE', name)
+    app = QApplication.instance() or QApplication([])
+    w = MMD_GUI.MainWindow()
+    w.start()
+    t_end = time.monotonic() + 1.
+    while (time.monotonic() < t_end):
+        app.processEvents()
+        time.sleep(0.005)
+    w.stop()
+    reader = MMD_SharedMemory.SharedHistogramReader(name)
+    snapshot = reader.snapshot()
+    mmd = w.mmd
+    assert snapshot['n_update'] == mmd.n_update > 0 and snapshot['detecting'] == 0
+    assert np.array_equal(snapshot['hist'], mmd.hist) and snapshot['cnt_detected'] == mmd.cnt_detected
+    w.close()
+    assert reader.closed
+    reader.close()
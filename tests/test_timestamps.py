@@ -0,0 +1,55 @@
+""" The timestamped event mode against the emulator, and the time-resolved histograms of the events. """
+
+import numpy as np
+import MMD_Histogram
+import XEM7305_Emulator
+import XEM7305_MicroMotion_Detector
+
+def read_fifo(dev):
+    """ The whole words in the FIFO, in pipe outs of 16 bytes. """
+    n_words = dev.fifo_r_count() // 4 * 4
+    buff = bytearray(4 * n_words)
+    dev.pipe_out(buff)
+    return buff
+
+def test_events_are_timestamped_from_the_reset():
+    emu = XEM7305_Emulator.FrontPanelEmulator(photon_rate=2e4, realtime=False, seed=5)
+    dev = XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=emu, bit_file=XEM7305_Emulator.__file__)
+    dev.set_timestamp_mode(True)
+    dev.reset_dev()
+    ticks, diffs = [], []
+    for k in range(4):
+        emu.advance(0.1)
+        t, d = dev.decode_events(read_fifo(dev))
+        ticks.append(t)
+        diffs.append(np.array(d))
+    ticks, diffs = np.concatenate(ticks), np.concatenate(diffs)
+    assert ticks.size > 4000
+    assert np.all(np.diff(ticks) >= 0) # decoded in order, across the buffers
+    assert ticks[-1] * XEM7305_MicroMotion_Detector.TIMESTAMP_TICK * 1e-9 <= 0.4
+    assert ticks[-1] * XEM7305_MicroMotion_Detector.TIMESTAMP_TICK * 1e-9 > 0.39 # the last event, close to the end
+    assert np.all((diffs >= 1) & (diffs <= emu.ttl_period))
+    photon_cnt, tdiff_cnt, ttl_period, fifo_cnt = dev.probe_dev()
+    assert ticks.size + 4 * fifo_cnt == tdiff_cnt # one word per event
+
+def test_unwrap():
+    wrap = 1 << XEM7305_MicroMotion_Detector.TIMESTAMP_BITS
+    ts = np.array([wrap - 3, wrap - 1, 2, 5])
+    assert list(XEM7305_MicroMotion_Detector.unwrap_timestamps(ts[:2])) == [wrap - 3, wrap - 1]
+    assert list(XEM7305_MicroMotion_Detector.unwrap_timestamps(ts[2:], last=wrap - 1)) == [wrap + 2, wrap + 5]
+
+def test_load_events(tmp_path):
+    path = str(tmp_path / 'mmd_events.bin')
+    ts = np.array([10, 20, 16777200, 5], dtype=np.uint32)
+    diff = np.array([3, 4, 5, 6], dtype=np.uint32)
+    ((ts << 8) | diff).astype('<u4').tofile(path)
+    ticks, d = XEM7305_MicroMotion_Detector.load_events(path)
+    assert list(ticks) == [10, 20, 16777200, (1 << 24) + 5]
+    assert list(d) == [3, 4, 5, 6]
+
+def test_time_resolved_histogram():
+    t = np.array([0, 5, 9, 10, 25, 29])
+    bins = np.array([0, 1, 1, 2, 0, 7]) # 7: out of the bins, ignored
+    hists, t_edges = MMD_Histogram.time_resolved_histogram(t, bins, 3, t_bin=10)
+    assert hists.tolist() == [[1, 2, 0], [0, 0, 1], [1, 0, 0]]
+    assert list(t_edges) == [0, 10, 20, 30]
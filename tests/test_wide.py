@@ -0,0 +1,31 @@
+""" The 16-bit time difference mode against the emulator, for RF trigger TTL periods of 256 clocks or more. """
+
+import numpy as np
+import MMD_Histogram
+import XEM7305_Emulator
+import XEM7305_MicroMotion_Detector
+
+def test_long_ttl_period_through_the_fifo():
+    emu = XEM7305_Emulator.FrontPanelEmulator(photon_rate=1e5, ttl_period=300, realtime=False, seed=6, data_bits=10)
+    dev = XEM7305_MicroMotion_Detector.XEM7305_MicroMotion_Detector(device=emu, bit_file=XEM7305_Emulator.__file__)
+    assert dev.data_bits == 10 and dev.hist_bins == 1 << 10
+    dev.set_wide_mode(True)
+    dev.reset_dev()
+    emu.advance(0.02)
+    photon_cnt, tdiff_cnt, ttl_period, fifo_cnt = dev.probe_dev()
+    assert ttl_period == 300 # data_bits wide, not 8
+    n_words = fifo_cnt // 4 * 4
+    buff = bytearray(4 * n_words)
+    dev.pipe_out(buff)
+    diff = np.frombuffer(buff, dtype=XEM7305_MicroMotion_Detector.WIDE_DTYPE)
+    assert diff.size == n_words * 4 // XEM7305_MicroMotion_Detector.BYTES_PER_WIDE_DIFF
+    assert 0 <= tdiff_cnt - diff.size - 2 * (fifo_cnt - n_words) < 2 # two time differences per word, the last one may wait for its pair
+    assert diff.min() >= 1 and diff.max() <= 300 and diff.max() > 255
+    hist = np.bincount(MMD_Histogram.phase_bin_index(1 << 10, 300)[diff], minlength=300)
+    assert hist.sum() == diff.size and hist.size == 300
+
+def test_phase_bin_index():
+    index = MMD_Histogram.phase_bin_index(8, 5)
+    assert list(index) == [0, 4, 3, 2, 1, 0, 4, 3] # (size_bins - c_diff) mod size_bins
+    index = MMD_Histogram.phase_bin_index(8, 5, n_negative=2)
+    assert list(index[-2:]) == [2, 1] # c_diff -2, -1